@@ -1,26 +1,17 @@
-import json
-from pathlib import Path
 import pandas as pd
-import geopandas as gpd
 
 from tethys_sdk.layouts import MapLayout
 from tethys_sdk.routing import controller
 from .app import CSES as app
 
-#functions to load AWS data
-import boto3
-import os
-from botocore import UNSIGNED 
-from botocore.client import Config
-import os
-os.environ['AWS_NO_SIGN_REQUEST'] = 'YES'
+#hot path timing spans, exposed at the metrics/ URL
+from .instrumentation import instrumented, span
 
-#Model evaluation metrics
-from sklearn.metrics import r2_score
-from sklearn.metrics import mean_squared_error
-from sklearn.metrics import max_error
-from sklearn.metrics import mean_absolute_percentage_error
-import hydroeval as he
+#composed layers cached by query parameters, pages answered with 304 when unchanged
+from .layer_cache import ConditionalLayoutMixin, cached_layers, skip_layer_cache
+
+#data access layer, S3 bucket or local mirror selected by the app settings
+from .storage import StorageError, get_storage
 
 
 #Date picker
@@ -37,13 +28,13 @@ from datetime import date, timedelta
 from django.http import HttpResponse 
 
 #utils
-from .utils import combine_jsons, reach_json
-
-#Set Global Variables
+from .fetch import fetch_all
+from .utils import combine_jsons, compare_models, reach_json, score_layer, select_stations, station_layers, station_plot, STATIONS_LAYER
+from .site_index import STREAMSTATS_KEY, get_site_index
+from .huc_lookup import HUC_LOOKUP_KEY, huc_sites, wbd_key
+from .huc_boundaries import CODE_COL, NAME_COL, detail_for_extent, huc_boundaries
+from .serialize import station_geojson
 
-BUCKET_NAME = 'streamflow-app-data'
-S3 = boto3.resource('s3', config=Config(signature_version=UNSIGNED))
-BUCKET = S3.Bucket(BUCKET_NAME) 
 
 #Controller base configurations
 BASEMAPS = [
@@ -65,7 +56,7 @@ BACK_URL = reverse_lazy('community_streamflow_evaluation_system:home')
     url="huc_eval/",
     app_workspace=True,
 )   
-class HUC_Eval(MapLayout): 
+class HUC_Eval(ConditionalLayoutMixin, MapLayout): 
     # Define base map options
     app = app
     back_url = BACK_URL
@@ -78,6 +69,8 @@ class HUC_Eval(MapLayout):
     show_properties_popup = True  
     plot_slide_sheet = True
     template_name = 'community_streamflow_evaluation_system/huc_eval.html' 
+    layer_cache_params = ('huc_ids', 'start-date', 'end-date', 'model_id', 'compare_ids')
+    layer_cache_sources = (HUC_LOOKUP_KEY, STREAMSTATS_KEY)
    
      
     def get_context(self, request, *args, **kwargs):
@@ -136,6 +129,14 @@ class HUC_Eval(MapLayout):
                                     select2_options={'placeholder': 'Select a model',
                                                     'allowClear': True})
 
+        #other models plotted with the selected model when a station is clicked
+        compare_ids = SelectInput(display_text='Compare Models',
+                                    name='compare_ids',
+                                    multiple=True,
+                                    options=model_id.options,
+                                    select2_options={'placeholder': 'Optional: models to compare',
+                                                    'allowClear': True})
+
         # Call Super   
         context = super().get_context( 
             request,  
@@ -146,59 +147,19 @@ class HUC_Eval(MapLayout):
         context['end_date_picker'] = end_date_picker 
         context['huc_ids'] = huc_ids
         context['model_id'] = model_id
+        context['compare_ids'] = compare_ids
         return context
     '''
     Get WBD HUC data, how to add in multiple hucs at once from same HU?
     '''
+    @instrumented('huc.join_wbd')
     def Join_WBD_StreamStats(self, HUCid):
         try:
-            #Get HUC level
-            HUC_length = 'huc'+str(len(HUCid[0]))
-
-            #columns to keep
-            HUC_cols = ['areaacres', 'areasqkm', 'states', HUC_length, 'name', 'shape_Length', 'shape_Area', 'geometry']
-            HUC_Geo = gpd.GeoDataFrame(columns = HUC_cols, geometry = 'geometry')
-
-            for h in HUCid:
-                HU = h[:2]
-                HUCunit = 'WBDHU'+str(len(h))       
-                filepath = f"s3://{BUCKET_NAME}/WBD/WBD_{HU}_HU2_GDB/WBD_{HU}_HU2_GDB.gdb/"
-                HUC_G = gpd.read_file(filepath, layer=HUCunit)
-                
-    
-                #select HUC
-                HUC_G = HUC_G[HUC_G[HUC_length] == h] 
-                HUC_G = HUC_G[HUC_cols]
-                HUC_Geo = pd.concat([HUC_Geo,HUC_G])
-
-            #Load streamstats wiht lat long to get geolocational information
-            csv_key = 'Streamstats/Streamstats.csv'
-            obj = BUCKET.Object(csv_key)
-            body = obj.get()['Body']
-            Streamstats = pd.read_csv(body)
-            Streamstats.pop('Unnamed: 0')
-            Streamstats.drop_duplicates(subset = 'NWIS_site_id', inplace = True)
-            Streamstats.reset_index(inplace = True, drop = True)
-
-            #Convert to geodataframe
-            StreamStats = gpd.GeoDataFrame(Streamstats, geometry=gpd.points_from_xy(Streamstats.dec_long_va, Streamstats.dec_lat_va))
-            
-            #the csv loses the 0 in front of USGS ids, fix
-            NWIS = list(Streamstats['NWIS_site_id'].astype(str))
-            Streamstats['NWIS_site_id'] = ["0"+str(i) if len(i) <8 else i for i in NWIS]        
+            #precomputed HUC12 to gauge table, any HUC level is answered by prefix (see huc_lookup.py)
+            sites = huc_sites(get_storage(), HUCid, self.sjoin_WBD_StreamStats)
 
-            # Join StreamStats with HUC
-            sites = StreamStats.sjoin(HUC_Geo, how = 'inner', predicate = 'intersects')
-            
-            #Somehow duplicate rows occuring, fix added
-            sites =  sites.drop_duplicates()
-            #takes rows with site name
-            sites = sites[sites['NWIS_sitename'].notna()] 
-
-            #get list of sites
+            #get list of sites, ids are normalized by the site index
             reach_ids = list(set(list(sites['NWIS_site_id'])))
-            reach_ids = [str(reach) for reach in reach_ids]
-            reach_ids = ["0"+str(i) if len(i) <8 else i for i in reach_ids]  
 
             #get list of states to request geojson files
             stateids = list(set(list(sites['state_id'])))
@@ -209,29 +170,97 @@ class HUC_Eval(MapLayout):
                 stationpaths.append(stations_path)
 
             #combine stations
-            combined = combine_jsons(stationpaths, BUCKET_NAME, S3)
+            combined = combine_jsons(stationpaths, get_storage())
             
 
             #get site ids out of DF to make new geojson
-            finaldf = gpd.GeoDataFrame()
-            for site in reach_ids:
-                df = combined[combined['USGS_id'] == site]
-                finaldf = pd.concat([finaldf, df])
-
-            #reset index and drop any duplicates
-            finaldf.reset_index(inplace = True, drop = True)
-            finaldf.drop_duplicates('USGS_id', inplace = True)       
+            finaldf = select_stations(combined, reach_ids)
    
             return finaldf
 
         except KeyError:
             print('No monitoring stations in this HUC')
 
+    @instrumented('huc.wbd_fallback')
+    def sjoin_WBD_StreamStats(self, HUCid):
+        '''
+        Fallback for when the HUC lookup table is not in the bucket, reads the WBD layer of each HUC and joins it with StreamStats.
+        '''
+        #geopandas is only needed on this fallback path
+        import geopandas as gpd
+
+        #Get HUC level
+        HUC_length = 'huc'+str(len(HUCid[0]))
+
+        #columns to keep
+        HUC_cols = ['areaacres', 'areasqkm', 'states', HUC_length, 'name', 'shape_Length', 'shape_Area', 'geometry']
+        HUC_Geo = gpd.GeoDataFrame(columns = HUC_cols, geometry = 'geometry')
 
+        #the HU2 geodatabases of all HUCs are read concurrently
+        def read_huc(h):
+            HU = h[:2]
+            HUCunit = 'WBDHU'+str(len(h))       
+            filepath = get_storage().path(wbd_key(HU))
+            HUC_G = gpd.read_file(filepath, layer=HUCunit)
+
+            #select HUC
+            HUC_G = HUC_G[HUC_G[HUC_length] == h] 
+            return HUC_G[HUC_cols]
+
+        HUC_Geo = pd.concat([HUC_Geo] + fetch_all(read_huc, HUCid))
+
+        #Load streamstats wiht lat long to get geolocational information, cached per process
+        StreamStats = get_site_index(get_storage()).gdf
+
+        # Join StreamStats with HUC
+        with span('huc.sjoin'):
+            sites = StreamStats.sjoin(HUC_Geo, how = 'inner', predicate = 'intersects')
+        
+        #Somehow duplicate rows occuring, fix added
+        sites =  sites.drop_duplicates()
+        #takes rows with site name
+        sites = sites[sites['NWIS_sitename'].notna()] 
+
+        return sites
+
+
+    @instrumented('huc.boundaries')
+    def huc_boundary_layers(self, HUCid, map_view):
+        '''
+        Simplified outlines of the HUCs at the detail of the map extent, read from the tables built by huc_boundaries.py.
+        The map extent grows to the outlines. No layer is added when the tables have not been built.
+        '''
+        try:
+            boundaries = huc_boundaries(get_storage(), HUCid, detail_for_extent(map_view['view']['extent']))
+        except StorageError as e:
+            print(f'No simplified HUC boundaries, {e}')
+            return []
+        if len(boundaries) == 0:
+            return []
+
+        minx, miny, maxx, maxy = map_view['view']['extent']
+        bminx, bminy, bmaxx, bmaxy = boundaries.geometry.total_bounds
+        map_view['view']['extent'] = [min(minx, bminx), min(miny, bminy), max(maxx, bmaxx), max(maxy, bmaxy)]
+
+        return [self.build_geojson_layer(
+            geojson=station_geojson(boundaries, properties=[CODE_COL, NAME_COL]),
+            layer_name='HUC Boundaries',
+            layer_title='HUC Boundaries',
+            layer_variable='huc_boundaries',
+            visible=True,
+            selectable=True,
+        )]
+
+
+    @instrumented('huc.compose_layers')
+    @cached_layers
     def compose_layers(self, request, map_view, app_workspace, *args, **kwargs): #can we select the geojson files from the input fields (e.g: AL, or a dropdown)
         """
         Add layers to the MapLayout and create associated layer group objects.
         """
+        #read outside the try below, a bad parameter never switches the view to its default map
+        compare_ids = compare_models(request)
+
         try: 
              #http request for user inputs
             startdate = request.GET.get('start-date')
@@ -243,13 +272,7 @@ class HUC_Eval(MapLayout):
             huc_id = request.GET.get('huc_ids')
             huc_id = huc_id.strip('][').split(', ')
 
-            finaldf = self.Join_WBD_StreamStats(huc_id) #for future work, building a lookup table/dictionary would be much faster!
-
-            '''
-            This might be the correct location to determine model performance, this will determine icon color as a part of the geojson file below
-            We can also speed up the app by putting all model preds into one csv per state and all obs in one csv per state. - load one file vs multiple.
-            '''
-
+            finaldf = self.Join_WBD_StreamStats(huc_id)
 
             map_view['view']['extent'] = list(finaldf.geometry.total_bounds)
 
@@ -257,21 +280,12 @@ class HUC_Eval(MapLayout):
             finaldf['startdate'] = datetime.strptime(startdate[0], '%m-%d-%Y').strftime('%Y-%m-%d')
             finaldf['enddate'] = datetime.strptime(enddate[0], '%m-%d-%Y').strftime('%Y-%m-%d')
             finaldf['model_id'] = model_id[0]
-            
-            #convert back to geojson
-            stations_geojson = json.loads(finaldf.to_json()) 
-            stations_geojson.update({"crs": { "type": "name", "properties": { "name": "urn:ogc:def:crs:OGC:1.3:CRS84" }}})         
 
+            #score every station for the selected model and window, the skill class sets the icon color
+            finaldf = score_layer(get_storage(), finaldf, app_workspace)
 
-            stations_layer = self.build_geojson_layer(
-                geojson=stations_geojson,
-                layer_name='USGS Stations',
-                layer_title='USGS Station',
-                layer_variable='stations',
-                visible=True,
-                selectable=True,
-                plottable=True,
-            ) 
+            #HUC outlines drawn below the stations
+            layers = self.huc_boundary_layers(huc_id, map_view) + station_layers(self, finaldf, compare_models=compare_ids)
 
             # Create layer groups
             layer_groups = [
@@ -279,14 +293,14 @@ class HUC_Eval(MapLayout):
                     id='nextgen-features',
                     display_name='NextGen Features',
                     layer_control='checkbox',  # 'checkbox' or 'radio'
-                    layers=[
-                        stations_layer,
-                    ],
+                    layers=layers,
                     visible= True
                 )
             ]
 
         except: 
+            #the default map is not cached under the parameters that failed
+            skip_layer_cache(request)
             print('No inputs, going to defaults')
             #put in some defaults
             reach_ids = ['10171000', '10166430', '10168000','10164500', '10163000', '10157500','10155500', '10156000', 
@@ -296,37 +310,17 @@ class HUC_Eval(MapLayout):
             enddate = '01-02-2019'
             modelid = 'NWM_v2.1'
 
-            finaldf = reach_json(reach_ids,BUCKET, BUCKET_NAME, S3)
-
-            '''
-            This might be the correct location to determine model performance, this will determine icon color as a part of the geojson file below
-            We can also speed up the app by putting all model preds into one csv per state and all obs in one csv per state. - load one file vs multiple.
-            '''
+            finaldf = reach_json(reach_ids, get_storage())
 
             map_view['view']['extent'] = list(finaldf.geometry.total_bounds)
-            stations_geojson = json.loads(finaldf.to_json()) 
-            stations_geojson.update({"crs": { "type": "name", "properties": { "name": "urn:ogc:def:crs:OGC:1.3:CRS84" }}}) 
-
-
-            stations_layer = self.build_geojson_layer(
-                geojson=stations_geojson,
-                layer_name='USGS Stations',
-                layer_title='USGS Station',
-                layer_variable='stations',
-                visible=True,
-                selectable=True,
-                plottable=True,
-            ) 
-            
+
             # Create layer groups
             layer_groups = [
                 self.build_layer_group(
                     id='nextgen-features',
                     display_name='NextGen Features',
                     layer_control='checkbox',  # 'checkbox' or 'radio'
-                    layers=[
-                        stations_layer,
-                    ],
+                    layers=station_layers(self, finaldf),
                     visible= True
                 )
             ]
@@ -349,6 +343,15 @@ class HUC_Eval(MapLayout):
                     }}
                 }}
             }},
+            'Polygon': {'ol.style.Style': {
+                'stroke': {'ol.style.Stroke': {
+                    'color': 'navy',
+                    'width': 3
+                }},
+                'fill': {'ol.style.Fill': {
+                    'color': 'rgba(0, 25, 128, 0.1)'
+                }}
+            }},
             'MultiPolygon': {'ol.style.Style': {
                 'stroke': {'ol.style.Stroke': {
                     'color': 'navy',
@@ -369,6 +372,7 @@ class HUC_Eval(MapLayout):
             }},
         }
 
+    @instrumented('huc.plot')
     def get_plot_for_layer_feature(self, request, layer_name, feature_id, layer_data, feature_props, app_workspace,
                                 *args, **kwargs):
         """
@@ -383,144 +387,6 @@ class HUC_Eval(MapLayout):
             str, list<dict>, dict: plot title, data series, and layout options, respectively.
       """     
 
-        # Get the feature ids, add start/end date, and model as features in geojson above to have here.
-        id = feature_props.get('id') #we could connect the hydrofabric in here for NWM v3.0
-        NHD_id = feature_props.get('NHD_id') 
-        state = feature_props.get('state')
-        startdate= feature_props.get('startdate')
-        enddate = feature_props.get('enddate')
-        model_id = feature_props.get('model_id')
-  
         # USGS observed flow
-        if layer_name == 'USGS Stations':
-            layout = {
-                'yaxis': {
-                    'title': 'Streamflow (cfs)'
-                },
-                'xaxis': {
-                    'title': 'Date'
-                }
-            }  
-
-            #USGS observed flow
-            USGS_directory = f"NWIS/NWIS_sites_{state}.h5/NWIS_{id}.csv"
-            obj = BUCKET.Object(USGS_directory)
-            body = obj.get()['Body']
-            USGS_df = pd.read_csv(body)
-            USGS_df.pop('Unnamed: 0')  
-            
-
-            #modeled flow, starting with NWM
-            try:
-                #try to use model/date inputs for plotting
-                model_directory = f"{model_id}/NHD_segments_{state}.h5/{model_id}_{NHD_id}.csv"  
-                obj = BUCKET.Object(model_directory)
-                body = obj.get()['Body']
-                model_df = pd.read_csv(body)
-                model_df.pop('Unnamed: 0')
-                modelcols = model_df.columns.to_list()[-2:]
-                model_df = model_df[modelcols]
-
-                 #combine Dfs, remove nans
-                USGS_df.drop_duplicates(subset=['Datetime'], inplace=True)
-                model_df.drop_duplicates(subset=['Datetime'],  inplace=True)
-                USGS_df.set_index('Datetime', inplace = True, drop = True)
-                model_df.set_index('Datetime', inplace = True, drop = True)
-                DF = pd.concat([USGS_df, model_df], axis = 1, join = 'inner')
-                #try to select user input dates
-                DF = DF.loc[startdate:enddate]
-                DF.reset_index(inplace=True)
-                
-                time_col = DF.Datetime.to_list()#limited to less than 500 obs/days 
-                USGS_streamflow_cfs = DF.USGS_flow.to_list()#limited to less than 500 obs/days 
-                Mod_streamflow_cfs = DF[f"{model_id[:3]}_flow"].to_list()#limited to less than 500 obs/days
-
-                #calculate model skill
-                r2 = round(r2_score(USGS_streamflow_cfs, Mod_streamflow_cfs),2)
-                rmse = round(mean_squared_error(USGS_streamflow_cfs, Mod_streamflow_cfs, squared=False),0)
-                maxerror = round(max_error(USGS_streamflow_cfs, Mod_streamflow_cfs),0)
-                MAPE = round(mean_absolute_percentage_error(USGS_streamflow_cfs, Mod_streamflow_cfs)*100,0)
-                kge, r, alpha, beta = he.evaluator(he.kge,USGS_streamflow_cfs,Mod_streamflow_cfs)
-                kge = round(kge[0],2)
- 
- 
-                data = [
-                    {
-                        'name': 'USGS Observed',
-                        'mode': 'lines',
-                        'x': time_col,
-                        'y': USGS_streamflow_cfs,
-                        'line': {
-                            'width': 2,
-                            'color': 'blue'
-                        }
-                    },
-                    { 
-                        'name': f"{model_id} Modeled",
-                        'mode': 'lines',
-                        'x': time_col,
-                        'y': Mod_streamflow_cfs,
-                        'line': {
-                            'width': 2,
-                            'color': 'red'
-                        }
-                    },
-                ]
-                
-
-                return f"{model_id} and Observed Streamflow at USGS site: {id} <br> RMSE: {rmse} cfs <br> KGE: {kge} <br> MaxError: {maxerror} cfs", data, layout
-            
-            except:
-                print("No user inputs, default configuration.")
-                model = 'NWM_v2.1'
-                model_directory = f"{model}/NHD_segments_{state}.h5/{model}_{NHD_id}.csv"  #put state in geojson file
-                obj = BUCKET.Object(model_directory)
-                body = obj.get()['Body']
-                model_df = pd.read_csv(body)
-                model_df.pop('Unnamed: 0')
-
-                #combine Dfs, remove nans
-                USGS_df.drop_duplicates(subset=['Datetime'], inplace=True)
-                model_df.drop_duplicates(subset=['Datetime'],  inplace=True)
-                USGS_df.set_index('Datetime', inplace = True)
-                model_df.set_index('Datetime', inplace = True)
-                DF = pd.concat([USGS_df, model_df], axis = 1, join = 'inner')
-                DF.reset_index(inplace=True)
-                time_col = DF.Datetime.to_list()[:45] 
-                USGS_streamflow_cfs = DF.USGS_flow.to_list()[:45] 
-                Mod_streamflow_cfs = DF[f"{model[:3]}_flow"].to_list()[:45]
-
-                #calculate model skill
-                r2 = round(r2_score(USGS_streamflow_cfs, Mod_streamflow_cfs),2)
-                rmse = round(mean_squared_error(USGS_streamflow_cfs, Mod_streamflow_cfs, squared=False),0)
-                maxerror = round(max_error(USGS_streamflow_cfs, Mod_streamflow_cfs),0)
-                MAPE = round(mean_absolute_percentage_error(USGS_streamflow_cfs, Mod_streamflow_cfs)*100,0)
-                kge, r, alpha, beta = he.evaluator(he.kge,USGS_streamflow_cfs,Mod_streamflow_cfs)
-                kge = round(kge[0],2)
-
-                data = [
-                    {
-                        'name': 'USGS Observed',
-                        'mode': 'lines',
-                        'x': time_col,
-                        'y': USGS_streamflow_cfs,
-                        'line': {
-                            'width': 2,
-                            'color': 'blue'
-                        }
-                    },
-                    {
-                        'name': f"Default Configuration: NWM v2.1 Modeled",
-                        'mode': 'lines',
-                        'x': time_col,
-                        'y': Mod_streamflow_cfs,
-                        'line': {
-                            'width': 2,
-                            'color': 'red'
-                        }
-                    },
-                ]
-
-
-                return f'Default Configuration:{model} Observed Streamflow at USGS site: {id} <br> RMSE: {rmse} cfs <br> KGE: {kge} <br> MaxError: {maxerror} cfs', data, layout
-            
+        if layer_name.startswith(STATIONS_LAYER):
+            return station_plot(get_storage(), feature_props, app_workspace, layer_data.get('compare_models'))
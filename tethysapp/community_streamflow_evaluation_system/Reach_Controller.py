@@ -1,26 +1,16 @@
-import json
-from pathlib import Path
-import pandas as pd
-import geopandas as gpd
-
 from tethys_sdk.layouts import MapLayout
 from tethys_sdk.routing import controller
 from .app import CSES as app
 
-#functions to load AWS data
-import boto3
-import os
-from botocore import UNSIGNED 
-from botocore.client import Config
-import os
-os.environ['AWS_NO_SIGN_REQUEST'] = 'YES'
+#hot path timing spans, exposed at the metrics/ URL
+from .instrumentation import instrumented
+
+#composed layers cached by query parameters, pages answered with 304 when unchanged
+from .layer_cache import ConditionalLayoutMixin, cached_layers, skip_layer_cache
 
-#Model evaluation metrics
-from sklearn.metrics import r2_score
-from sklearn.metrics import mean_squared_error
-from sklearn.metrics import max_error
-from sklearn.metrics import mean_absolute_percentage_error
-import hydroeval as he
+#data access layer, S3 bucket or local mirror selected by the app settings
+from .storage import get_storage
+from .site_index import STREAMSTATS_KEY
 
 
 #Date picker
@@ -28,6 +18,7 @@ from tethys_sdk.gizmos import DatePicker
 from django.shortcuts import render, reverse, redirect
 from tethys_sdk.gizmos import DatePicker, SelectInput, TextInput
 import datetime
+from django.contrib import messages
 from django.http import JsonResponse
 from django.urls import reverse_lazy
 from datetime import datetime
@@ -37,15 +28,8 @@ from datetime import date, timedelta
 from django.http import HttpResponse 
 
 #utils
-from .utils import combine_jsons, reach_json
-
-#Set Global Variables
-
-#s3 = boto3.resource('s3')
-
-BUCKET_NAME = 'streamflow-app-data'
-S3 = boto3.resource('s3', config=Config(signature_version=UNSIGNED))
-BUCKET = S3.Bucket(BUCKET_NAME) 
+from .network_index import get_crosswalk, get_network, hydrofabric_files, upstream_selection
+from .utils import combine_jsons, compare_models, reach_json, score_layer, station_layers, station_plot, STATIONS_LAYER
 
 
 #Controller base configurations
@@ -71,7 +55,7 @@ BACK_URL = reverse_lazy('community_streamflow_evaluation_system:home')
     url="reach_eval/",
     app_workspace=True,
 )   
-class Reach_Eval(MapLayout): 
+class Reach_Eval(ConditionalLayoutMixin, MapLayout): 
     # Define base map options
     app = app
     back_url = BACK_URL
@@ -84,6 +68,14 @@ class Reach_Eval(MapLayout):
     show_properties_popup = True  
     plot_slide_sheet = True
     template_name = 'community_streamflow_evaluation_system/reach_eval.html' 
+    layer_cache_params = ('reach_ids', 'upstream_id', 'start-date', 'end-date', 'model_id', 'compare_ids')
+    layer_cache_sources = (STREAMSTATS_KEY,)
+
+    def layer_cache_files(self, request, map_view, app_workspace, *args, **kwargs):
+        #upstream selections are rebuilt when the hydrofabric of the workspace changes
+        if (request.GET.get('upstream_id') or '').strip():
+            return hydrofabric_files(app_workspace)
+        return ()
     
      
     def get_context(self, request, *args, **kwargs):
@@ -126,6 +118,12 @@ class Reach_Eval(MapLayout):
                                    placeholder= 'e.g.: 10224000, 10219000',
                                    )
 
+        #every gauge upstream of a hydrofabric reach, see network_index.py
+        upstream_id = TextInput(display_text='Or select every USGS site upstream of a reach',
+                                   name='upstream_id',
+                                   placeholder= 'e.g.: wb-113061 or 02453000',
+                                   )
+
         model_id = SelectInput(display_text='Select Model',
                                     name='model_id',
                                     multiple=False,
@@ -142,6 +140,14 @@ class Reach_Eval(MapLayout):
                                     select2_options={'placeholder': 'Select a model',
                                                     'allowClear': True})
 
+        #other models plotted with the selected model when a station is clicked
+        compare_ids = SelectInput(display_text='Compare Models',
+                                    name='compare_ids',
+                                    multiple=True,
+                                    options=model_id.options,
+                                    select2_options={'placeholder': 'Optional: models to compare',
+                                                    'allowClear': True})
+
         # Call Super   
         context = super().get_context( 
             request,  
@@ -151,16 +157,44 @@ class Reach_Eval(MapLayout):
         context['start_date_picker'] = start_date_picker  
         context['end_date_picker'] = end_date_picker 
         context['reach_ids'] = reach_ids
+        context['upstream_id'] = upstream_id
         context['model_id'] = model_id
+        context['compare_ids'] = compare_ids
         return context
 
 
+    @instrumented('reach.compose_layers')
+    @cached_layers
     def compose_layers(self, request, map_view, app_workspace, *args, **kwargs): #can we select the geojson files from the input fields (e.g: AL, or a dropdown)
         """
         Add layers to the MapLayout and create associated layer group objects.
         """
        
      
+        #read outside the try below, a bad parameter never switches the view to its default map
+        compare_ids = compare_models(request)
+
+        #an unknown reach or one without gauges upstream shows an empty map and the reason, not the default map
+        upstream_id = (request.GET.get('upstream_id') or '').strip()
+        if upstream_id:
+            try:
+                upstream_ids, message = upstream_selection(get_network(app_workspace), get_crosswalk(app_workspace), upstream_id)
+            except OSError:
+                upstream_ids, message = [], 'No hydrofabric in the app workspace'
+            if message is not None:
+                #not cached, the message is shown on every request
+                skip_layer_cache(request)
+                messages.warning(request, message)
+                return [
+                    self.build_layer_group(
+                        id='nextgen-features',
+                        display_name='NextGen Features',
+                        layer_control='checkbox',
+                        layers=[],
+                        visible= True
+                    )
+                ]
+
         try: 
              #http request for user inputs
             startdate = request.GET.get('start-date')
@@ -169,36 +203,25 @@ class Reach_Eval(MapLayout):
             enddate = enddate.strip('][').split(', ')
             model_id = request.GET.get('model_id')
             model_id = model_id.strip('][').split(', ')
-            reach_ids = request.GET.get('reach_ids')
-            reach_ids = reach_ids.strip('][').split(', ')
+            if upstream_id:
+                #upstream traversal of the hydrofabric, the gauges replace the typed site list
+                reach_ids = upstream_ids
+            else:
+                reach_ids = request.GET.get('reach_ids')
+                reach_ids = reach_ids.strip('][').split(', ')
 
-            # USGS stations - from AWS s3
-            finaldf = reach_json(reach_ids,BUCKET, BUCKET_NAME, S3)
+            # USGS stations - from the storage backend
+            finaldf = reach_json(reach_ids, get_storage())
 
             #update json with start/end date, modelid to support click, adjustment in the get_plot_for_layer_feature()
             finaldf['startdate'] = datetime.strptime(startdate[0], '%m-%d-%Y').strftime('%Y-%m-%d')
             finaldf['enddate'] = datetime.strptime(enddate[0], '%m-%d-%Y').strftime('%Y-%m-%d')
             finaldf['model_id'] = model_id[0]
-            
-            '''
-            This might be the correct location to determine model performance, this will determine icon color as a part of the geojson file below
-            We can also speed up the app by putting all model preds into one csv per state and all obs in one csv per state. - load one file vs multiple.
-            '''
 
             map_view['view']['extent'] = list(finaldf.geometry.total_bounds)
-            stations_geojson = json.loads(finaldf.to_json()) 
-            stations_geojson.update({"crs": { "type": "name", "properties": { "name": "urn:ogc:def:crs:OGC:1.3:CRS84" }}})         
 
-
-            stations_layer = self.build_geojson_layer(
-                geojson=stations_geojson,
-                layer_name='USGS Stations',
-                layer_title='USGS Station',
-                layer_variable='stations',
-                visible=True,
-                selectable=True,
-                plottable=True,
-            ) 
+            #score every station for the selected model and window, the skill class sets the icon color
+            finaldf = score_layer(get_storage(), finaldf, app_workspace)
 
             # Create layer groups
             layer_groups = [
@@ -206,45 +229,30 @@ class Reach_Eval(MapLayout):
                     id='nextgen-features',
                     display_name='NextGen Features',
                     layer_control='checkbox',  # 'checkbox' or 'radio'
-                    layers=[
-                        stations_layer,
-                    ],
+                    layers=station_layers(self, finaldf, compare_models=compare_ids),
                     visible= True
                 )
             ]
 
         except: 
+            #the default map is not cached under the parameters that failed
+            skip_layer_cache(request)
             print('No inputs, going to defaults')
             #put in some defaults
             reach_ids = ['10126000', '10068500']
             startdate = '01-01-2019' 
             enddate = '01-02-2019'
             modelid = 'NWM_v2.1'
-            finaldf = reach_json(reach_ids,BUCKET, BUCKET_NAME, S3)
+            finaldf = reach_json(reach_ids, get_storage())
             map_view['view']['extent'] = list(finaldf.geometry.total_bounds)
-            stations_geojson = json.loads(finaldf.to_json()) 
-            stations_geojson.update({"crs": { "type": "name", "properties": { "name": "urn:ogc:def:crs:OGC:1.3:CRS84" }}}) 
-
-
-            stations_layer = self.build_geojson_layer(
-                geojson=stations_geojson,
-                layer_name='USGS Stations',
-                layer_title='USGS Station',
-                layer_variable='stations',
-                visible=True,
-                selectable=True,
-                plottable=True,
-            ) 
-            
+
             # Create layer groups
             layer_groups = [
                 self.build_layer_group(
                     id='nextgen-features',
                     display_name='NextGen Features',
                     layer_control='checkbox',  # 'checkbox' or 'radio'
-                    layers=[
-                        stations_layer,
-                    ],
+                    layers=station_layers(self, finaldf),
                     visible= True
                 )
             ]
@@ -287,6 +295,7 @@ class Reach_Eval(MapLayout):
             }},
         }
 
+    @instrumented('reach.plot')
     def get_plot_for_layer_feature(self, request, layer_name, feature_id, layer_data, feature_props, app_workspace,
                                 *args, **kwargs):
         """
@@ -301,144 +310,6 @@ class Reach_Eval(MapLayout):
             str, list<dict>, dict: plot title, data series, and layout options, respectively.
       """     
 
-        # Get the feature ids, add start/end date, and model as features in geojson above to have here.
-        id = feature_props.get('id') #we could connect the hydrofabric in here for NWM v3.0
-        NHD_id = feature_props.get('NHD_id') 
-        state = feature_props.get('state')
-        startdate= feature_props.get('startdate')
-        enddate = feature_props.get('enddate')
-        model_id = feature_props.get('model_id')
-  
         # USGS observed flow
-        if layer_name == 'USGS Stations':
-            layout = {
-                'yaxis': {
-                    'title': 'Streamflow (cfs)'
-                },
-                'xaxis': {
-                    'title': 'Date'
-                }
-            }  
-
-            #USGS observed flow
-            USGS_directory = f"NWIS/NWIS_sites_{state}.h5/NWIS_{id}.csv"
-            obj = BUCKET.Object(USGS_directory)
-            body = obj.get()['Body']
-            USGS_df = pd.read_csv(body)
-            USGS_df.pop('Unnamed: 0')  
-            
-
-            #modeled flow, starting with NWM
-            try:
-                #try to use model/date inputs for plotting
-                model_directory = f"{model_id}/NHD_segments_{state}.h5/{model_id}_{NHD_id}.csv"  
-                obj = BUCKET.Object(model_directory)
-                body = obj.get()['Body']
-                model_df = pd.read_csv(body)
-                model_df.pop('Unnamed: 0')
-                modelcols = model_df.columns.to_list()[-2:]
-                model_df = model_df[modelcols]
-
-                 #combine Dfs, remove nans
-                USGS_df.drop_duplicates(subset=['Datetime'], inplace=True)
-                model_df.drop_duplicates(subset=['Datetime'],  inplace=True)
-                USGS_df.set_index('Datetime', inplace = True, drop = True)
-                model_df.set_index('Datetime', inplace = True, drop = True)
-                DF = pd.concat([USGS_df, model_df], axis = 1, join = 'inner')
-                #try to select user input dates
-                DF = DF.loc[startdate:enddate]
-                DF.reset_index(inplace=True)
-                
-                time_col = DF.Datetime.to_list()#limited to less than 500 obs/days 
-                USGS_streamflow_cfs = DF.USGS_flow.to_list()#limited to less than 500 obs/days 
-                Mod_streamflow_cfs = DF[f"{model_id[:3]}_flow"].to_list()#limited to less than 500 obs/days
-
-                #calculate model skill
-                r2 = round(r2_score(USGS_streamflow_cfs, Mod_streamflow_cfs),2)
-                rmse = round(mean_squared_error(USGS_streamflow_cfs, Mod_streamflow_cfs, squared=False),0)
-                maxerror = round(max_error(USGS_streamflow_cfs, Mod_streamflow_cfs),0)
-                MAPE = round(mean_absolute_percentage_error(USGS_streamflow_cfs, Mod_streamflow_cfs)*100,0)
-                kge, r, alpha, beta = he.evaluator(he.kge,USGS_streamflow_cfs,Mod_streamflow_cfs)
-                kge = round(kge[0],2)
- 
- 
-                data = [
-                    {
-                        'name': 'USGS Observed',
-                        'mode': 'lines',
-                        'x': time_col,
-                        'y': USGS_streamflow_cfs,
-                        'line': {
-                            'width': 2,
-                            'color': 'blue'
-                        }
-                    },
-                    { 
-                        'name': f"{model_id} Modeled",
-                        'mode': 'lines',
-                        'x': time_col,
-                        'y': Mod_streamflow_cfs,
-                        'line': {
-                            'width': 2,
-                            'color': 'red'
-                        }
-                    },
-                ]
-                
-
-                return f"{model_id} and Observed Streamflow at USGS site: {id} <br> RMSE: {rmse} cfs <br> KGE: {kge} <br> MaxError: {maxerror} cfs", data, layout
-            
-            except:
-                print("No user inputs, default configuration.")
-                model = 'NWM_v2.1'
-                model_directory = f"{model}/NHD_segments_{state}.h5/{model}_{NHD_id}.csv"  #put state in geojson file
-                obj = BUCKET.Object(model_directory)
-                body = obj.get()['Body']
-                model_df = pd.read_csv(body)
-                model_df.pop('Unnamed: 0')
-
-                #combine Dfs, remove nans
-                USGS_df.drop_duplicates(subset=['Datetime'], inplace=True)
-                model_df.drop_duplicates(subset=['Datetime'],  inplace=True)
-                USGS_df.set_index('Datetime', inplace = True)
-                model_df.set_index('Datetime', inplace = True)
-                DF = pd.concat([USGS_df, model_df], axis = 1, join = 'inner')
-                DF.reset_index(inplace=True)
-                time_col = DF.Datetime.to_list()[:45] 
-                USGS_streamflow_cfs = DF.USGS_flow.to_list()[:45] 
-                Mod_streamflow_cfs = DF[f"{model[:3]}_flow"].to_list()[:45]
-
-                #calculate model skill
-                r2 = round(r2_score(USGS_streamflow_cfs, Mod_streamflow_cfs),2)
-                rmse = round(mean_squared_error(USGS_streamflow_cfs, Mod_streamflow_cfs, squared=False),0)
-                maxerror = round(max_error(USGS_streamflow_cfs, Mod_streamflow_cfs),0)
-                MAPE = round(mean_absolute_percentage_error(USGS_streamflow_cfs, Mod_streamflow_cfs)*100,0)
-                kge, r, alpha, beta = he.evaluator(he.kge,USGS_streamflow_cfs,Mod_streamflow_cfs)
-                kge = round(kge[0],2)
-
-                data = [
-                    {
-                        'name': 'USGS Observed',
-                        'mode': 'lines',
-                        'x': time_col,
-                        'y': USGS_streamflow_cfs,
-                        'line': {
-                            'width': 2,
-                            'color': 'blue'
-                        }
-                    },
-                    {
-                        'name': f"Default Configuration: NWM v2.1 Modeled",
-                        'mode': 'lines',
-                        'x': time_col,
-                        'y': Mod_streamflow_cfs,
-                        'line': {
-                            'width': 2,
-                            'color': 'red'
-                        }
-                    },
-                ]
-
-
-                return f'Default Configuration:{model} Observed Streamflow at USGS site: {id} <br> RMSE: {rmse} cfs <br> KGE: {kge} <br> MaxError: {maxerror} cfs', data, layout
-            
\ No newline at end of file
+        if layer_name.startswith(STATIONS_LAYER):
+            return station_plot(get_storage(), feature_props, app_workspace, layer_data.get('compare_models'))
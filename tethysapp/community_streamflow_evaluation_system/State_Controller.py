@@ -1,26 +1,15 @@
-import json
-from pathlib import Path
-import pandas as pd
-import geopandas as gpd
-
 from tethys_sdk.layouts import MapLayout
 from tethys_sdk.routing import controller
 from .app import CSES as app
 
-#functions to load AWS data
-import boto3
-import os
-from botocore import UNSIGNED 
-from botocore.client import Config
-import os
-os.environ['AWS_NO_SIGN_REQUEST'] = 'YES'
+#hot path timing spans, exposed at the metrics/ URL
+from .instrumentation import instrumented
+
+#composed layers cached by query parameters, pages answered with 304 when unchanged
+from .layer_cache import ConditionalLayoutMixin, cached_layers, skip_layer_cache
 
-#Model evaluation metrics
-from sklearn.metrics import r2_score
-from sklearn.metrics import mean_squared_error
-from sklearn.metrics import max_error
-from sklearn.metrics import mean_absolute_percentage_error
-import hydroeval as he
+#data access layer, S3 bucket or local mirror selected by the app settings
+from .storage import StorageError, get_storage
 
 
 #Date picker
@@ -37,13 +26,11 @@ from datetime import date, timedelta
 from django.http import HttpResponse 
 
 #utils
-from .utils import combine_jsons, reach_json
+from urllib.parse import urlencode
+from .clusters import CLUSTER_MIN_STATIONS
+from .serialize import dumps
+from .utils import combine_jsons, compare_models, reach_json, load_station_layer, station_clusters, station_layers, station_plot, STATIONS_LAYER
 
-#Set Global Variables
-
-BUCKET_NAME = 'streamflow-app-data'
-S3 = boto3.resource('s3', config=Config(signature_version=UNSIGNED))
-BUCKET = S3.Bucket(BUCKET_NAME) 
 
 #Controller base configurations
 BASEMAPS = [
@@ -64,7 +51,7 @@ BACK_URL = reverse_lazy('community_streamflow_evaluation_system:home')
     url="state_eval/",
     app_workspace=True,
 )   
-class State_Eval(MapLayout): 
+class State_Eval(ConditionalLayoutMixin, MapLayout): 
     # Define base map options
     app = app
     back_url = BACK_URL
@@ -77,6 +64,8 @@ class State_Eval(MapLayout):
     show_properties_popup = True  
     plot_slide_sheet = True
     template_name = 'community_streamflow_evaluation_system/state_eval.html' 
+    layer_cache_params = ('state_id', 'start-date', 'end-date', 'model_id', 'compare_ids')
+    layer_cache_sources = ()
    
      
     def get_context(self, request, *args, **kwargs):
@@ -188,6 +177,14 @@ class State_Eval(MapLayout):
                                     select2_options={'placeholder': 'Select a model',
                                                     'allowClear': True})
 
+        #other models plotted with the selected model when a station is clicked
+        compare_ids = SelectInput(display_text='Compare Models',
+                                    name='compare_ids',
+                                    multiple=True,
+                                    options=model_id.options,
+                                    select2_options={'placeholder': 'Optional: models to compare',
+                                                    'allowClear': True})
+
         # Call Super   
         context = super().get_context( 
             request,  
@@ -198,12 +195,18 @@ class State_Eval(MapLayout):
         context['end_date_picker'] = end_date_picker 
         context['state_id'] = state_id
         context['model_id'] = model_id
+        context['compare_ids'] = compare_ids
         return context
 
+    @instrumented('state.compose_layers')
+    @cached_layers
     def compose_layers(self, request, map_view, app_workspace, *args, **kwargs): 
         """
         Add layers to the MapLayout and create associated layer group objects.
         """
+        #read outside the try below, a bad parameter never switches the view to its default map
+        compare_ids = compare_models(request)
+
         try: 
             #http request for user inputs
             state_id = request.GET.get('state_id')
@@ -214,32 +217,25 @@ class State_Eval(MapLayout):
             model_id = request.GET.get('model_id')
             model_id = model_id.strip('][').split(', ')
       
-            # USGS stations - from AWS s3
-            stations_path = f"GeoJSON/StreamStats_{state_id}_4326.geojson" 
-            obj = S3.Object(BUCKET_NAME, stations_path)
+            #start/end date and model are added to the features to support click, adjustment in the get_plot_for_layer_feature()
+            startdate = datetime.strptime(startdate[0], '%m-%d-%Y').strftime('%Y-%m-%d')
+            enddate = datetime.strptime(enddate[0], '%m-%d-%Y').strftime('%Y-%m-%d')
+            model_id = model_id[0]
+
+            # USGS stations - from the storage backend, scored for the selected model and window, the skill class sets the icon color
+            clusters = station_clusters(get_storage(), state_id, startdate, enddate, model_id, app_workspace)
+            gdf = clusters.gdf
 
             # set the map extend based on the stations
-            gdf = gpd.read_file(obj.get()['Body'], driver='GeoJSON')
             map_view['view']['extent'] = list(gdf.geometry.total_bounds)
 
-            #update json with start/end date, modelid to support click, adjustment in the get_plot_for_layer_feature()
-            gdf['startdate'] = datetime.strptime(startdate[0], '%m-%d-%Y').strftime('%Y-%m-%d')
-            gdf['enddate'] = datetime.strptime(enddate[0], '%m-%d-%Y').strftime('%Y-%m-%d')
-            gdf['model_id'] = model_id[0]
-
-            stations_geojson = json.loads(gdf.to_json()) 
-            stations_geojson.update({"crs": { "type": "name", "properties": { "name": "urn:ogc:def:crs:OGC:1.3:CRS84" }}})          
-        
-
-            stations_layer = self.build_geojson_layer(
-                geojson=stations_geojson,
-                layer_name='USGS Stations',
-                layer_title='USGS Station',
-                layer_variable='stations',
-                visible=True,
-                selectable=True,
-                plottable=True,
-            ) 
+            #large states are sent as clusters that are refreshed from the cluster endpoint as the map moves
+            if len(clusters) > CLUSTER_MIN_STATIONS:
+                cluster_url = reverse('community_streamflow_evaluation_system:state_station_clusters') + '?' + urlencode(
+                    {'state_id': state_id, 'startdate': startdate, 'enddate': enddate, 'model_id': model_id})
+                layers = station_layers(self, gdf, clusters, cluster_url, compare_ids)
+            else:
+                layers = station_layers(self, gdf, compare_models=compare_ids)
 
             # Create layer groups
             layer_groups = [
@@ -247,37 +243,24 @@ class State_Eval(MapLayout):
                     id='nextgen-features',
                     display_name='NextGen Features',
                     layer_control='checkbox',  # 'checkbox' or 'radio'
-                    layers=[
-                        stations_layer,
-                    ],
+                    layers=layers,
                     visible= True
                 )
             ]
 
         except: 
+            #the default map is not cached under the parameters that failed
+            skip_layer_cache(request)
             #Default state id to initiat mapping
             print('No useable inputs, default mapping')
             state_id = 'AL'
     
-            # USGS stations - from AWS s3
+            # USGS stations - from the storage backend
             stations_path = f"GeoJSON/StreamStats_{state_id}_4326.geojson" #will need to change the filename to have state before 4326
-            obj = S3.Object(BUCKET_NAME, stations_path)
-            stations_geojson = json.load(obj.get()['Body']) 
+            gdf = load_station_layer(stations_path, get_storage())
 
             # set the map extend based on the stations
-            gdf = gpd.read_file(obj.get()['Body'], driver='GeoJSON')
             map_view['view']['extent'] = list(gdf.geometry.total_bounds)
-        
-
-            stations_layer = self.build_geojson_layer(
-                geojson=stations_geojson,
-                layer_name='USGS Stations',
-                layer_title='USGS Station',
-                layer_variable='stations',
-                visible=True,
-                selectable=True,
-                plottable=True,
-            )
 
             # Create layer groups
             layer_groups = [
@@ -285,9 +268,7 @@ class State_Eval(MapLayout):
                     id='nextgen-features',
                     display_name='NextGen Features',
                     layer_control='checkbox',  # 'checkbox' or 'radio'
-                    layers=[
-                        stations_layer,
-                    ],
+                    layers=station_layers(self, gdf),
                     visible= True
                 )
             ]
@@ -330,6 +311,7 @@ class State_Eval(MapLayout):
             }},
         }
 
+    @instrumented('state.plot')
     def get_plot_for_layer_feature(self, request, layer_name, feature_id, layer_data, feature_props, app_workspace,
                                 *args, **kwargs):
         """
@@ -344,147 +326,34 @@ class State_Eval(MapLayout):
             str, list<dict>, dict: plot title, data series, and layout options, respectively.
       """     
 
-        # Get the feature ids, add start/end date, and model as features in geojson above to have here.
-        id = feature_props.get('id') #we could connect the hydrofabric in here for NWM v3.0
-        NHD_id = feature_props.get('NHD_id') 
-        state = feature_props.get('state')
-        startdate= feature_props.get('startdate')
-        enddate = feature_props.get('enddate')
-        model_id = feature_props.get('model_id')
-  
         # USGS observed flow
-        if layer_name == 'USGS Stations':
-            layout = {
-                'yaxis': {
-                    'title': 'Streamflow (cfs)'
-                },
-                'xaxis': {
-                    'title': 'Date'
-                }
-            }  
-
-            #USGS observed flow
-            USGS_directory = f"NWIS/NWIS_sites_{state}.h5/NWIS_{id}.csv"
-            obj = BUCKET.Object(USGS_directory)
-            body = obj.get()['Body']
-            USGS_df = pd.read_csv(body)
-            USGS_df.pop('Unnamed: 0')  
-            
-
-            #modeled flow, starting with NWM
-            try:
-                #try to use model/date inputs for plotting
-                model_directory = f"{model_id}/NHD_segments_{state}.h5/{model_id}_{NHD_id}.csv"  
-                obj = BUCKET.Object(model_directory)
-                body = obj.get()['Body']
-                model_df = pd.read_csv(body)
-                model_df.pop('Unnamed: 0')
-                modelcols = model_df.columns.to_list()[-2:]
-                model_df = model_df[modelcols]
-
-                 #combine Dfs, remove nans
-                USGS_df.drop_duplicates(subset=['Datetime'], inplace=True)
-                model_df.drop_duplicates(subset=['Datetime'],  inplace=True)
-                USGS_df.set_index('Datetime', inplace = True, drop = True)
-                model_df.set_index('Datetime', inplace = True, drop = True)
-                DF = pd.concat([USGS_df, model_df], axis = 1, join = 'inner')
-                #try to select user input dates
-                DF = DF.loc[startdate:enddate]
-                DF.reset_index(inplace=True)
-                
-                time_col = DF.Datetime.to_list()#limited to less than 500 obs/days 
-                USGS_streamflow_cfs = DF.USGS_flow.to_list()#limited to less than 500 obs/days 
-                Mod_streamflow_cfs = DF[f"{model_id[:3]}_flow"].to_list()#limited to less than 500 obs/days
-
-                #calculate model skill
-                r2 = round(r2_score(USGS_streamflow_cfs, Mod_streamflow_cfs),2)
-                rmse = round(mean_squared_error(USGS_streamflow_cfs, Mod_streamflow_cfs, squared=False),0)
-                maxerror = round(max_error(USGS_streamflow_cfs, Mod_streamflow_cfs),0)
-                MAPE = round(mean_absolute_percentage_error(USGS_streamflow_cfs, Mod_streamflow_cfs)*100,0)
-                kge, r, alpha, beta = he.evaluator(he.kge,USGS_streamflow_cfs,Mod_streamflow_cfs)
-                kge = round(kge[0],2)
- 
- 
-                data = [
-                    {
-                        'name': 'USGS Observed',
-                        'mode': 'lines',
-                        'x': time_col,
-                        'y': USGS_streamflow_cfs,
-                        'line': {
-                            'width': 2,
-                            'color': 'blue'
-                        }
-                    },
-                    { 
-                        'name': f"{model_id} Modeled",
-                        'mode': 'lines',
-                        'x': time_col,
-                        'y': Mod_streamflow_cfs,
-                        'line': {
-                            'width': 2,
-                            'color': 'red'
-                        }
-                    },
-                ]
-                
-
-                return f"{model_id} and Observed Streamflow at USGS site: {id} <br> RMSE: {rmse} cfs <br> KGE: {kge} <br> MaxError: {maxerror} cfs", data, layout
-            
-            except:
-                print("No user inputs, default configuration.")
-                model = 'NWM_v2.1'
-                model_directory = f"{model}/NHD_segments_{state}.h5/{model}_{NHD_id}.csv"  #put state in geojson file
-                obj = BUCKET.Object(model_directory)
-                body = obj.get()['Body']
-                model_df = pd.read_csv(body)
-                model_df.pop('Unnamed: 0')
-
-                #combine Dfs, remove nans
-                USGS_df.drop_duplicates(subset=['Datetime'], inplace=True)
-                model_df.drop_duplicates(subset=['Datetime'],  inplace=True)
-                USGS_df.set_index('Datetime', inplace = True)
-                model_df.set_index('Datetime', inplace = True)
-                DF = pd.concat([USGS_df, model_df], axis = 1, join = 'inner')
-                DF.reset_index(inplace=True)
-                time_col = DF.Datetime.to_list()[:45] 
-                USGS_streamflow_cfs = DF.USGS_flow.to_list()[:45] 
-                Mod_streamflow_cfs = DF[f"{model[:3]}_flow"].to_list()[:45]
-
-                #calculate model skill
-                r2 = round(r2_score(USGS_streamflow_cfs, Mod_streamflow_cfs),2)
-                rmse = round(mean_squared_error(USGS_streamflow_cfs, Mod_streamflow_cfs, squared=False),0)
-                maxerror = round(max_error(USGS_streamflow_cfs, Mod_streamflow_cfs),0)
-                MAPE = round(mean_absolute_percentage_error(USGS_streamflow_cfs, Mod_streamflow_cfs)*100,0)
-                kge, r, alpha, beta = he.evaluator(he.kge,USGS_streamflow_cfs,Mod_streamflow_cfs)
-                kge = round(kge[0],2)
-
-                data = [
-                    {
-                        'name': 'USGS Observed',
-                        'mode': 'lines',
-                        'x': time_col,
-                        'y': USGS_streamflow_cfs,
-                        'line': {
-                            'width': 2,
-                            'color': 'blue'
-                        }
-                    },
-                    {
-                        'name': f"Default Configuration: NWM v2.1 Modeled",
-                        'mode': 'lines',
-                        'x': time_col,
-                        'y': Mod_streamflow_cfs,
-                        'line': {
-                            'width': 2,
-                            'color': 'red'
-                        }
-                    },
-                ]
-
-
-                return f'Default Configuration:{model} Observed Streamflow at USGS site: {id} <br> RMSE: {rmse} cfs <br> KGE: {kge} <br> MaxError: {maxerror} cfs', data, layout
-            
-            
+        if layer_name.startswith(STATIONS_LAYER):
+            return station_plot(get_storage(), feature_props, app_workspace, layer_data.get('compare_models'))
 
 
+@controller(
+    name="state_station_clusters",
+    url="state_eval/clusters/",
+    app_workspace=True,
+)
+@instrumented('state.clusters')
+def state_station_clusters(request, app_workspace):
+    '''
+    Station clusters of the visible extent of the state map, requested by station_clusters.js when the map moves.
+    '''
+    params = request.GET
+    try:
+        zoom = int(float(params['zoom']))
+        bbox = [float(value) for value in params['bbox'].split(',')]
+        clusters = station_clusters(get_storage(), params['state_id'], params['startdate'], params['enddate'],
+                                    params['model_id'], app_workspace)
+    except (KeyError, ValueError) as e:
+        return JsonResponse({'error': f'Invalid cluster request: {e}'}, status=400)
+    except StorageError as e:
+        return JsonResponse({'error': str(e)}, status=404)
+
+    geojson = clusters.query(zoom, bbox, group=params.get('skill'))
+    #bind the features to the layer they are drawn in
+    for feature in geojson['features']:
+        feature['properties']['layer_name'] = params.get('layer_name', STATIONS_LAYER)
+    return HttpResponse(dumps(geojson), content_type='application/json')
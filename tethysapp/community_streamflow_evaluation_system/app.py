@@ -1,3 +1,4 @@
+from tethys_sdk.app_settings import CustomSetting
 from tethys_sdk.base import TethysAppBase
 
 class CSES(TethysAppBase):
@@ -17,4 +18,38 @@ class CSES(TethysAppBase):
     tags = '"Hydrology", "WMO", "UA"'
     enable_feedback = False
     feedback_emails = []
-    controller_modules = ["controllers", "State_Controller", "Reach_Controller", "HUC_Controller"]
\ No newline at end of file
+    controller_modules = ["controllers", "State_Controller", "Reach_Controller", "HUC_Controller"]
+
+    def custom_settings(self):
+        """
+        Custom settings for the app.
+        """
+        return (
+            CustomSetting(
+                name='series_cache_mb',
+                type=CustomSetting.TYPE_INTEGER,
+                description='Disk budget in MB of the time series cache in the app workspace.',
+                required=False,
+                default=512,
+            ),
+            CustomSetting(
+                name='plot_max_points',
+                type=CustomSetting.TYPE_INTEGER,
+                description='Maximum points per hydrograph trace (at least 4), longer windows are downsampled keeping the peaks.',
+                required=False,
+                default=2000,
+            ),
+            CustomSetting(
+                name='storage_backend',
+                type=CustomSetting.TYPE_STRING,
+                description="Where the app data is read from: 's3' for the streamflow-app-data bucket or 'local' for a mirror on disk.",
+                required=False,
+                default='s3',
+            ),
+            CustomSetting(
+                name='local_data_root',
+                type=CustomSetting.TYPE_STRING,
+                description='Directory mirroring the streamflow-app-data bucket layout, used by the local storage backend.',
+                required=False,
+            ),
+        )
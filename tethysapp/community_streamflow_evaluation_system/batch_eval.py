@@ -0,0 +1,205 @@
+"""
+Batch evaluation of every gauge of every state for one model and evaluation window.
+
+The work is sharded by state, the unit the State evaluation map reads and scores in one batched pass: a shard
+enumerates the stations of the state's StreamStats GeoJSON, takes the standard windows from the scorecards
+and aligns and scores the remaining stations with skill.score_stations. The shards run on a process pool, so
+the scoring runs on every core while the reads of each shard still overlap on the fetch pool of its process.
+The largest states are submitted first to keep the pool busy until the end. The workers are spawned, not
+forked, so none of them shares the storage backend, S3 connections or fetch pool of the parent process, and
+each selects the storage backend from the CSES_STORAGE_BACKEND and CSES_DATA_ROOT environment variables.
+
+Every finished shard is written as a checkpoint under <checkpoints>/<model>_<start>_<end>/<state>.parquet,
+an interrupted run started again with the same arguments skips the states already done. The checkpoints are
+consolidated into one results table::
+
+    CSES_STORAGE_BACKEND=local CSES_DATA_ROOT=/data/streamflow-app-data \\
+        python -m tethysapp.community_streamflow_evaluation_system.batch_eval \\
+        --model NWM_v3.0 --start 2018-10-01 --end 2019-09-30 --workers 8 --out NWM_v3.0_WY2019.parquet
+"""
+import argparse
+import multiprocessing
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import pandas as pd
+
+from .metrics import METRICS
+from .scorecards import STATIONS_KEY, station_scores
+from .series_store import MODEL_IDS
+from .site_index import STATE_COL as SITE_STATE_COL, get_site_index
+from .skill import ID_COL, NHD_COL, STATE_COL, station_table
+from .storage import ObjectNotFound, get_storage
+
+
+CHECKPOINT_FILE = '{state}.parquet'
+
+#columns of the results table
+MODEL_COL = 'model_id'
+START_COL = 'startdate'
+END_COL = 'enddate'
+RESULT_COLUMNS = [STATE_COL, ID_COL, NHD_COL, MODEL_COL, START_COL, END_COL] + METRICS
+
+
+def checkpoint_dir(root, model_id, startdate, enddate):
+    """
+    Checkpoint folder of one model and window, runs with other arguments never share checkpoints.
+    """
+    return os.path.join(root, f'{model_id}_{startdate}_{enddate}')
+
+
+def list_states(storage):
+    """
+    States of the StreamStats gauges, the largest first.
+    """
+    counts = get_site_index(storage).frame[SITE_STATE_COL].dropna().astype(str).value_counts()
+    return list(counts.index)
+
+
+def _stations(storage, state):
+    import geopandas as gpd
+
+    body = storage.get(STATIONS_KEY.format(state=state)).body
+    stations = pd.DataFrame(gpd.read_file(body, driver='GeoJSON'))
+    return station_table(stations)
+
+
+def evaluate_state(state, model_id, startdate, enddate, out_dir):
+    """
+    Score every station of a state and write its checkpoint. Runs in the pool workers.
+
+    Args:
+        state (str): two letter state id.
+        model_id (str): model to evaluate.
+        startdate (str): first date (YYYY-MM-DD) of the evaluation window.
+        enddate (str): last date (YYYY-MM-DD) of the evaluation window.
+        out_dir (str): checkpoint folder of the run.
+
+    Returns:
+        tuple: state, number of stations and seconds spent.
+    """
+    start = time.perf_counter()
+    #each worker process selects the storage backend from the environment
+    storage = get_storage()
+    try:
+        stations = _stations(storage, state)
+    except ObjectNotFound:
+        #no station layer, the empty checkpoint marks the state as done
+        stations = pd.DataFrame(columns=[ID_COL, NHD_COL, STATE_COL])
+
+    if len(stations) > 0:
+        scores = station_scores(storage, stations, model_id, startdate, enddate)
+        scores = scores.reindex(index=list(stations[ID_COL]), columns=METRICS)
+    else:
+        scores = pd.DataFrame(columns=METRICS)
+    result = stations.reset_index(drop=True)
+    result[STATE_COL] = state
+    result[MODEL_COL] = model_id
+    result[START_COL] = startdate
+    result[END_COL] = enddate
+    result = pd.concat([result, scores.reset_index(drop=True).astype('float64')], axis=1)[RESULT_COLUMNS]
+
+    #written under a temporary name and renamed, an interrupted write leaves no checkpoint behind
+    path = os.path.join(out_dir, CHECKPOINT_FILE.format(state=state))
+    partial = f'{path}.{os.getpid()}.tmp'
+    result.to_parquet(partial, index=False, compression='zstd')
+    os.replace(partial, path)
+    return state, len(result), time.perf_counter() - start
+
+
+def pending_states(states, out_dir):
+    """
+    States without a checkpoint, in the given order.
+    """
+    return [state for state in states if not os.path.exists(os.path.join(out_dir, CHECKPOINT_FILE.format(state=state)))]
+
+
+def consolidate(states, out_dir):
+    """
+    Results table of the checkpoints of the given states.
+    """
+    frames = [pd.read_parquet(os.path.join(out_dir, CHECKPOINT_FILE.format(state=state))) for state in states]
+    frames = [frame for frame in frames if len(frame) > 0]
+    if len(frames) == 0:
+        return pd.DataFrame(columns=RESULT_COLUMNS)
+    return pd.concat(frames, ignore_index=True)[RESULT_COLUMNS]
+
+
+def run_batch(states, model_id, startdate, enddate, out_dir, workers=None, log=print):
+    """
+    Evaluate the states that have no checkpoint yet and consolidate all of them.
+
+    Args:
+        states (list): two letter state ids, submitted in this order.
+        model_id (str): model to evaluate.
+        startdate (str): first date (YYYY-MM-DD) of the evaluation window.
+        enddate (str): last date (YYYY-MM-DD) of the evaluation window.
+        out_dir (str): checkpoint folder of the run, see checkpoint_dir.
+        workers (int): worker processes, None for one per core. With 1 the shards run in this process with its
+            storage backend, otherwise the workers select it from the environment.
+        log (callable): progress messages.
+
+    Returns:
+        pd.DataFrame: one row per station, see RESULT_COLUMNS.
+    """
+    os.makedirs(out_dir, exist_ok=True)
+    pending = pending_states(states, out_dir)
+    if len(pending) < len(states):
+        log(f'Resuming, {len(states) - len(pending)} of {len(states)} states already done')
+
+    args = [(state, model_id, startdate, enddate, out_dir) for state in pending]
+    if workers == 1:
+        for arg in args:
+            log('{}: scored {} stations in {:.1f} s'.format(*evaluate_state(*arg)))
+    elif len(args) > 0:
+        #boto3 sessions and connection pools are not fork safe
+        with ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context('spawn')) as executor:
+            futures = {executor.submit(evaluate_state, *arg): arg[0] for arg in args}
+            for future in as_completed(futures):
+                try:
+                    log('{}: scored {} stations in {:.1f} s'.format(*future.result()))
+                except Exception as e:
+                    #the other shards go on, the failed one is retried by the next run
+                    log(f'{futures[future]}: failed, {e}')
+
+    missing = pending_states(states, out_dir)
+    if len(missing) > 0:
+        raise RuntimeError(f'No results for {", ".join(missing)}, run again to retry them')
+    return consolidate(states, out_dir)
+
+
+def write_results(results, path):
+    """
+    Write the results table as zstd compressed Parquet, or csv for a .csv path.
+    """
+    os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+    if path.endswith('.csv'):
+        results.to_csv(path, index=False)
+    else:
+        results.to_parquet(path, index=False, compression='zstd')
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Evaluate every gauge of every state for one model and window.')
+    parser.add_argument('--model', required=True, choices=MODEL_IDS, help='model to evaluate')
+    parser.add_argument('--start', required=True, help='first date, YYYY-MM-DD')
+    parser.add_argument('--end', required=True, help='last date, YYYY-MM-DD')
+    parser.add_argument('--states', nargs='+', default=None, help='two letter state ids, default all')
+    parser.add_argument('--workers', type=int, default=None, help='worker processes, default one per core')
+    parser.add_argument('--checkpoints', default='batch_checkpoints', help='checkpoint folder, kept for resuming')
+    parser.add_argument('--out', default=None, help='results table, .parquet or .csv')
+    args = parser.parse_args(argv)
+
+    states = args.states or list_states(get_storage())
+    out_dir = checkpoint_dir(args.checkpoints, args.model, args.start, args.end)
+    out = args.out or f'{args.model}_{args.start}_{args.end}.parquet'
+
+    start = time.perf_counter()
+    results = run_batch(states, args.model, args.start, args.end, out_dir, args.workers)
+    write_results(results, out)
+    print(f'Wrote {len(results)} stations of {len(states)} states to {out} in {time.perf_counter() - start:.1f} s')
+
+
+if __name__ == '__main__':
+    main()
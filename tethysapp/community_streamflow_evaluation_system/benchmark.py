@@ -0,0 +1,523 @@
+"""
+Offline latency and memory benchmark of the State, HUC and Reach evaluation classes.
+
+A synthetic streamflow-app-data tree (StreamStats csv, per-state station GeoJSON, NWIS and model csvs, the
+HUC12 gauge lookup and a small WBD geodatabase) is generated in a local folder and served through the local
+storage backend, so runs need no network and are comparable between commits. For every station count and
+evaluation window the benchmark times compose_layers and get_plot_for_layer_feature end to end, cold (all
+in-process caches dropped), warm (data caches filled, the composed layer cache dropped) and cached (served
+from the composed layer cache), and records the peak Python memory of a separate traced run. The
+startup time, importing the controller modules in a fresh interpreter, is measured as well.
+
+The layouts run in order on the same tree: csv, csv-indexed adds the csv sidecar indexes, parquet the
+columnar stores, and no-lookup removes the HUC12 gauge lookup table so the HUC evaluation falls back to the
+spatial join of the WBD geodatabase.
+
+Run it inside the Tethys environment and compare against a previous result::
+
+    python -m tethysapp.community_streamflow_evaluation_system.benchmark --out bench.json
+    python -m tethysapp.community_streamflow_evaluation_system.benchmark --out new.json --compare bench.json
+    python -m tethysapp.community_streamflow_evaluation_system.benchmark --startup-only --out startup.json
+"""
+import argparse
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+import types
+from datetime import datetime, timezone
+
+import numpy as np
+import pandas as pd
+
+
+STATES = {'AL': ('03', (-88.0, 31.0, -85.0, 35.0)), 'UT': ('16', (-113.0, 38.0, -110.0, 42.0))}
+RECORD_START = '1980-01-01'
+RECORD_END = '2020-12-31'
+MODELS = ['NWM_v2.1', 'NWM_v3.0', 'MLP', 'XGBoost', 'CNN', 'LSTM']
+
+#default grid of the benchmark
+STATION_COUNTS = [10, 50, 200]
+WINDOW_DAYS = [30, 365, 3650]
+WINDOW_END = '2019-12-31'
+REPEATS = 5
+
+#stations per HUC12 cell of the synthetic WBD layer
+STATIONS_PER_HUC = 5
+
+#data layouts, in the order they are added to the tree
+LAYOUTS = ['csv', 'csv-indexed', 'parquet', 'no-lookup']
+
+#modules a worker imports when it loads the app, and the dependencies whose import dominates startup
+CONTROLLER_MODULES = ['controllers', 'State_Controller', 'HUC_Controller', 'Reach_Controller']
+HEAVY_MODULES = ['numpy', 'pandas', 'pyarrow.dataset', 'geopandas', 'shapely', 'pyproj', 'pyogrio', 'fiona',
+                 'boto3', 'botocore', 'sklearn', 'hydroeval']
+
+#run in a fresh interpreter, Django is set up before the clock starts so only the app imports are timed
+STARTUP_PROBE = '''
+import importlib, json, os, sys, time
+import django
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'tethys_portal.settings')
+django.setup()
+package, modules, heavy = sys.argv[1], sys.argv[2].split(','), sys.argv[3].split(',')
+before = set(sys.modules)
+start = time.perf_counter()
+for module in modules:
+    importlib.import_module(f'{package}.{module}')
+seconds = time.perf_counter() - start
+print(json.dumps({'seconds': seconds, 'loaded': [m for m in heavy if m in sys.modules and m not in before]}))
+'''
+
+
+class BenchmarkRequest:
+    """
+    Minimal stand-in for the HttpRequest the controllers read their GET parameters from.
+    """
+
+    def __init__(self, **params):
+        self.GET = BenchmarkQuery(params)
+
+
+class BenchmarkQuery(dict):
+    """
+    Minimal stand-in for the QueryDict of the GET parameters, a list value is a repeated parameter.
+    """
+
+    def __init__(self, params):
+        super().__init__({key: [str(v) for v in value] if isinstance(value, (list, tuple)) else [str(value)]
+                          for key, value in params.items()})
+
+    def __getitem__(self, key):
+        return super().__getitem__(key)[-1]
+
+    def get(self, key, default=None):
+        values = super().get(key)
+        return values[-1] if values else default
+
+    def getlist(self, key):
+        return list(super().get(key, []))
+
+
+def _site_ids(state, count):
+    prefix = {'AL': 2, 'UT': 10}.get(state, 9)
+    return [f'{prefix:02d}{i:06d}' for i in range(count)]
+
+
+def _nhd_id(site_id):
+    return str(int(site_id) + 10_000_000)
+
+
+def _huc12(state, index):
+    HU2 = STATES[state][0]
+    return f'{HU2}{index // STATIONS_PER_HUC:010d}'
+
+
+def _flows(rng, dates, scale):
+    #seasonal flow with noise and a few gaps
+    doy = dates.dayofyear.to_numpy()
+    flow = scale * (1.5 + np.sin(2 * np.pi * doy / 365.25)) * rng.lognormal(0, 0.3, len(dates))
+    flow[rng.random(len(dates)) < 0.01] = np.nan
+    return flow
+
+
+def build_tree(root, count, states=tuple(STATES), models=MODELS, seed=0):
+    """
+    Write a synthetic bucket tree with count stations per state under root.
+
+    Returns:
+        dict: site ids, NHD ids and HUC12 codes per state.
+    """
+    import geopandas as gpd
+    from shapely.geometry import Point, box
+
+    rng = np.random.default_rng(seed)
+    dates = pd.date_range(RECORD_START, RECORD_END, name='Datetime')
+    layout = {}
+    streamstats, lookup = [], []
+
+    for state in states:
+        HU2, (xmin, ymin, xmax, ymax) = STATES[state]
+        site_ids = _site_ids(state, count)
+        side = int(np.ceil(np.sqrt(count)))
+        xs = xmin + (xmax - xmin) * (np.arange(count) % side + 0.5) / side
+        ys = ymin + (ymax - ymin) * (np.arange(count) // side + 0.5) / side
+
+        stations = gpd.GeoDataFrame({
+            'id': site_ids,
+            'USGS_id': site_ids,
+            'NHD_id': [_nhd_id(site_id) for site_id in site_ids],
+            'state': state,
+            'NWIS_sitename': [f'Synthetic site {site_id}' for site_id in site_ids],
+        }, geometry=[Point(x, y) for x, y in zip(xs, ys)], crs='EPSG:4326')
+        os.makedirs(os.path.join(root, 'GeoJSON'), exist_ok=True)
+        stations.to_file(os.path.join(root, 'GeoJSON', f'StreamStats_{state}_4326.geojson'), driver='GeoJSON')
+
+        streamstats.append(pd.DataFrame({
+            'NWIS_site_id': site_ids,
+            'NWIS_sitename': stations['NWIS_sitename'],
+            'dec_lat_va': ys,
+            'dec_long_va': xs,
+            'state_id': state,
+            'NHD_reachcode': stations['NHD_id'],
+        }))
+
+        obs_dir = os.path.join(root, 'NWIS', f'NWIS_sites_{state}.h5')
+        os.makedirs(obs_dir, exist_ok=True)
+        for site_id in site_ids:
+            flow = _flows(rng, dates, rng.uniform(10, 1000))
+            pd.DataFrame({'Datetime': dates, 'USGS_flow': flow}).to_csv(
+                os.path.join(obs_dir, f'NWIS_{site_id}.csv'), index=False)
+
+            for model in models:
+                model_dir = os.path.join(root, model, f'NHD_segments_{state}.h5')
+                os.makedirs(model_dir, exist_ok=True)
+                modeled = flow * rng.uniform(0.6, 1.4) + rng.normal(0, np.nanstd(flow) * 0.3, len(flow))
+                pd.DataFrame({'Datetime': dates, f'{model[:3]}_flow': modeled}).to_csv(
+                    os.path.join(model_dir, f'{model}_{_nhd_id(site_id)}.csv'), index=False)
+
+        hucs = [_huc12(state, i) for i in range(count)]
+        lookup.append(pd.DataFrame({'huc12': hucs, 'NWIS_site_id': site_ids, 'state_id': state}))
+
+        #one HUC12 polygon around each group of stations
+        cells = []
+        for huc in sorted(set(hucs)):
+            members = [i for i, code in enumerate(hucs) if code == huc]
+            cells.append({'huc12': huc, 'name': f'Synthetic {huc}', 'states': state, 'areaacres': 0.0,
+                          'areasqkm': 0.0, 'shape_Length': 0.0, 'shape_Area': 0.0,
+                          'geometry': box(xs[members].min() - 0.01, ys[members].min() - 0.01,
+                                          xs[members].max() + 0.01, ys[members].max() + 0.01)})
+        _write_wbd(root, HU2, gpd.GeoDataFrame(cells, crs='EPSG:4326'))
+        layout[state] = {'site_ids': site_ids, 'hucs': sorted(set(hucs))}
+
+    os.makedirs(os.path.join(root, 'Streamstats'), exist_ok=True)
+    pd.concat(streamstats).to_csv(os.path.join(root, 'Streamstats', 'Streamstats.csv'))
+    os.makedirs(os.path.join(root, 'WBD'), exist_ok=True)
+    pd.concat(lookup).to_csv(os.path.join(root, 'WBD', 'HUC12_gauges.csv'), index=False)
+    return layout
+
+
+def _write_wbd(root, HU2, cells):
+    from .huc_lookup import wbd_key
+
+    path = os.path.join(root, wbd_key(HU2).rstrip('/'))
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    try:
+        cells.to_file(path, layer='WBDHU12', driver='OpenFileGDB')
+    except Exception as e:
+        #writing FileGDBs needs GDAL >= 3.6, the HUC fallback join is then not benchmarked
+        print(f'Unable to write the synthetic WBD geodatabase: {e}')
+
+
+def convert_tree(root, states=tuple(STATES), models=MODELS):
+    """
+    Add the columnar observation and model stores of every state to the tree.
+    """
+    from .series_store import convert_models, convert_observations
+    from .storage import LocalBackend
+
+    storage = LocalBackend(root)
+    for state in states:
+        convert_observations(storage, state, root)
+        convert_models(storage, state, root, models=models)
+
+
+def index_tree(root, states=tuple(STATES), models=MODELS):
+    """
+    Add the sidecar offset index of every csv of the tree.
+    """
+    from .series_store import index_csvs
+    from .storage import LocalBackend
+
+    storage = LocalBackend(root)
+    for state in states:
+        index_csvs(storage, state, root, models=models)
+
+
+def reset_caches(workspace=None):
+    """
+    Drop every in-process cache, and the disk series cache of the workspace, so the next request runs cold.
+    """
+    from .huc_boundaries import BOUNDARIES
+    from .huc_lookup import _HUC_LOOKUP
+    from .layer_cache import LAYER_CACHE
+    from .scorecards import SCORECARDS
+    from .series_cache import SERIES_CACHE_DIR, get_series_cache
+    from .series_store import CSV_INDEXES, DATASETS, MODEL_FRAMES, VERSIONS
+    from .site_index import clear_site_index
+    from .utils import STATION_CLUSTERS, STATION_LAYERS
+
+    for cache in (LAYER_CACHE, BOUNDARIES, STATION_LAYERS, STATION_CLUSTERS, DATASETS, MODEL_FRAMES, VERSIONS, CSV_INDEXES, SCORECARDS):
+        cache.clear()
+    clear_site_index()
+    _HUC_LOOKUP.clear()
+    if workspace is not None:
+        #filled by the previous cases and by the compose_layers run ahead of a plot
+        get_series_cache(os.path.join(workspace.path, SERIES_CACHE_DIR)).clear()
+
+
+def _cases(layout, window_days, controllers=('State_Eval', 'Reach_Eval', 'HUC_Eval')):
+    end = pd.Timestamp(WINDOW_END)
+    state = next(iter(layout))
+    site_ids = layout[state]['site_ids']
+    for days in window_days:
+        start = end - pd.Timedelta(days=days - 1)
+        dates = {'start-date': start.strftime('%m-%d-%Y'), 'end-date': end.strftime('%m-%d-%Y'),
+                 'model_id': MODELS[0]}
+        requests = {
+            'State_Eval': BenchmarkRequest(state_id=state, **dates),
+            'Reach_Eval': BenchmarkRequest(reach_ids=f"[{', '.join(site_ids)}]", **dates),
+            'HUC_Eval': BenchmarkRequest(huc_ids=f"[{', '.join(layout[state]['hucs'])}]", **dates),
+        }
+        for controller in controllers:
+            yield controller, days, requests[controller]
+
+
+def _controller(name):
+    if name == 'State_Eval':
+        from .State_Controller import State_Eval
+        return State_Eval()
+    if name == 'HUC_Eval':
+        from .HUC_Controller import HUC_Eval
+        return HUC_Eval()
+    from .Reach_Controller import Reach_Eval
+    return Reach_Eval()
+
+
+def _plot(view, request, layers, workspace):
+    #plot the first station of the first station layer, like a click on the map
+    layer = layers[0]['layers'][0]
+    feature = layer.options['features'][0]
+    return view.get_plot_for_layer_feature(request, layer.data['layer_name'], feature.get('id'), layer.data,
+                                           feature['properties'], workspace)
+
+
+def _stage(view, stage, request, workspace, state):
+    if stage == 'compose_layers':
+        state['layers'] = view.compose_layers(request, {'view': {}}, workspace)
+        return state['layers']
+    return _plot(view, request, state['layers'], workspace)
+
+
+def measure(view, stage, request, workspace, repeats=REPEATS):
+    """
+    Cold, warm and cached latency and peak traced memory of one controller stage.
+
+    The warm runs drop the composed layer cache before each run, so they time the composition with the data
+    caches filled. The cached runs keep it, a compose_layers run is then a layer cache hit.
+    """
+    from .layer_cache import LAYER_CACHE
+
+    state = {}
+    if stage != 'compose_layers':
+        state['layers'] = view.compose_layers(request, {'view': {}}, workspace)
+
+    reset_caches(workspace)
+    start = time.perf_counter()
+    _stage(view, stage, request, workspace, state)
+    cold = time.perf_counter() - start
+
+    warm = []
+    for _ in range(repeats):
+        LAYER_CACHE.clear()
+        start = time.perf_counter()
+        _stage(view, stage, request, workspace, state)
+        warm.append(time.perf_counter() - start)
+
+    cached = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        _stage(view, stage, request, workspace, state)
+        cached.append(time.perf_counter() - start)
+
+    reset_caches(workspace)
+    tracemalloc.start()
+    try:
+        _stage(view, stage, request, workspace, state)
+        peak = tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+    warm.sort()
+    cached.sort()
+    return {
+        'cold_s': cold,
+        'warm_median_s': statistics.median(warm),
+        'warm_p95_s': warm[min(len(warm) - 1, int(round(0.95 * (len(warm) - 1))))],
+        'warm_min_s': warm[0],
+        'cached_median_s': statistics.median(cached),
+        'peak_mb': peak / 2**20,
+        'repeats': repeats,
+    }
+
+
+def measure_startup(modules=CONTROLLER_MODULES, repeats=REPEATS):
+    """
+    Time the import of the controller modules in fresh interpreters, as a worker does when it boots.
+
+    Returns:
+        dict: median and min import seconds, and the heavy dependencies the imports load.
+    """
+    package = __name__.rpartition('.')[0]
+    seconds, loaded = [], []
+    for _ in range(repeats):
+        output = subprocess.run([sys.executable, '-c', STARTUP_PROBE, package, ','.join(modules), ','.join(HEAVY_MODULES)],
+                                capture_output=True, text=True, check=True).stdout
+        probe = json.loads(output.strip().splitlines()[-1])
+        seconds.append(probe['seconds'])
+        loaded = probe['loaded']
+    startup = {'median_s': statistics.median(seconds), 'min_s': min(seconds), 'loaded': loaded}
+    print(f"startup: {startup['median_s']:.3f}s median, loads {', '.join(loaded) or 'no heavy modules'}")
+    return startup
+
+
+def run(root, counts=STATION_COUNTS, window_days=WINDOW_DAYS, repeats=REPEATS, layouts=LAYOUTS, workspace_root=None):
+    """
+    Build the synthetic tree for every station count and benchmark all cases.
+
+    Returns:
+        list: one result dict per controller, stage, layout, station count and window.
+    """
+    from .huc_lookup import HUC_LOOKUP_KEY, wbd_key
+    from .storage import LocalBackend, set_storage
+
+    results = []
+    for count in counts:
+        tree = os.path.join(root, f'stations_{count}')
+        print(f'Building a synthetic tree with {count} stations per state in {tree}')
+        layout = build_tree(tree, count)
+
+        #every layout changes the tree, so they run in the order of LAYOUTS
+        for data_layout in [data_layout for data_layout in LAYOUTS if data_layout in layouts]:
+            controllers = ('State_Eval', 'Reach_Eval', 'HUC_Eval')
+            if data_layout == 'csv-indexed':
+                index_tree(tree)
+            if data_layout == 'parquet':
+                convert_tree(tree)
+            if data_layout == 'no-lookup':
+                if not os.path.exists(os.path.join(tree, wbd_key(STATES[next(iter(layout))][0]))):
+                    print('No synthetic WBD geodatabase, the no-lookup layout is skipped')
+                    continue
+                #only the HUC evaluation reads the lookup table
+                os.remove(os.path.join(tree, HUC_LOOKUP_KEY))
+                controllers = ('HUC_Eval',)
+            set_storage(LocalBackend(tree))
+            workspace = types.SimpleNamespace(path=tempfile.mkdtemp(dir=workspace_root))
+
+            for controller, days, request in _cases(layout, window_days, controllers):
+                view = _controller(controller)
+                for stage in ('compose_layers', 'get_plot_for_layer_feature'):
+                    result = {'controller': controller, 'stage': stage, 'layout': data_layout,
+                              'stations': count, 'window_days': days}
+                    result.update(measure(view, stage, request, workspace, repeats))
+                    print(f"{controller:10s} {stage:26s} {data_layout:11s} stations={count:<5d} days={days:<5d} "
+                          f"cold={result['cold_s']:.3f}s warm={result['warm_median_s']:.3f}s "
+                          f"cached={result['cached_median_s']:.3f}s peak={result['peak_mb']:.1f}MB")
+                    results.append(result)
+
+    set_storage(None)
+    return results
+
+
+def _case_key(result):
+    return (result['controller'], result['stage'], result['layout'], result['stations'], result['window_days'])
+
+
+def compare(report, baseline, threshold=1.2):
+    """
+    Print the startup ratio and the warm median and cold latency ratio of every case against a previous run.
+
+    Args:
+        report (dict): report of this run.
+        baseline (dict): report of the previous run.
+
+    Returns:
+        list: keys of the cases slower than threshold times the baseline.
+    """
+    previous = {_case_key(result): result for result in baseline['results']}
+    regressions = []
+    if 'startup' in report and 'startup' in baseline:
+        ratio = report['startup']['median_s'] / max(baseline['startup']['median_s'], 1e-9)
+        flag = ' REGRESSION' if ratio > threshold else ''
+        print(f'startup: x{ratio:.2f}{flag}')
+        if flag:
+            regressions.append(('startup',))
+    for result in report['results']:
+        before = previous.get(_case_key(result))
+        if before is None:
+            continue
+        warm = result['warm_median_s'] / max(before['warm_median_s'], 1e-9)
+        cold = result['cold_s'] / max(before['cold_s'], 1e-9)
+        flag = ' REGRESSION' if warm > threshold or cold > threshold else ''
+        print(f"{' '.join(str(part) for part in _case_key(result))}: warm x{warm:.2f} cold x{cold:.2f}{flag}")
+        if flag:
+            regressions.append(_case_key(result))
+    return regressions
+
+
+def _commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', 'HEAD'], capture_output=True, text=True, check=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def _setup_django():
+    import django
+    from django.conf import settings
+
+    if not settings.configured:
+        os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'tethys_portal.settings')
+        django.setup()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Benchmark the evaluation classes against a synthetic local bucket.')
+    parser.add_argument('--counts', nargs='+', type=int, default=STATION_COUNTS, help='stations per state')
+    parser.add_argument('--windows', nargs='+', type=int, default=WINDOW_DAYS, help='evaluation window lengths in days')
+    parser.add_argument('--repeats', type=int, default=REPEATS, help='warm runs per case')
+    parser.add_argument('--layouts', nargs='+', choices=LAYOUTS, default=LAYOUTS,
+                        help='data layouts to benchmark, csv-indexed adds the csv sidecars, parquet the columnar '
+                             'stores, no-lookup removes the HUC12 gauge lookup')
+    parser.add_argument('--root', default=None, help='folder for the synthetic trees, default a temporary folder')
+    parser.add_argument('--out', default='bench.json', help='json result file')
+    parser.add_argument('--compare', default=None, help='previous json result file to compare against')
+    parser.add_argument('--threshold', type=float, default=1.2, help='slowdown ratio reported as a regression')
+    parser.add_argument('--startup-only', action='store_true', help='only measure the app import time')
+    args = parser.parse_args(argv)
+
+    _setup_django()
+    startup = measure_startup(repeats=args.repeats)
+    results = []
+    if not args.startup_only:
+        root = args.root or tempfile.mkdtemp(prefix='cses-bench-')
+        results = run(root, args.counts, args.windows, args.repeats, args.layouts)
+
+    report = {
+        'commit': _commit(),
+        'timestamp': datetime.now(timezone.utc).isoformat(),
+        'python': sys.version.split()[0],
+        'platform': platform.platform(),
+        'parameters': {'counts': args.counts, 'windows': args.windows, 'repeats': args.repeats,
+                       'layouts': args.layouts},
+        'startup': startup,
+        'results': results,
+    }
+    with open(args.out, 'w') as f:
+        json.dump(report, f, indent=2)
+    print(f'Wrote {len(results)} results to {args.out}')
+
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        if compare(report, baseline, args.threshold):
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
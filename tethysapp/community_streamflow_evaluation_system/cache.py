@@ -0,0 +1,121 @@
+import threading
+import time
+from collections import OrderedDict
+
+from .storage import StorageError
+
+
+class LRUCache:
+    """
+    Thread-safe, size-bounded least-recently-used cache with an optional time to live per entry.
+    """
+
+    def __init__(self, maxsize=32, ttl=None):
+        """
+        Args:
+            maxsize (int): maximum number of entries kept, the least recently used entry is evicted first.
+            ttl (float): seconds an entry stays valid, None keeps entries until they are evicted.
+        """
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._data = OrderedDict()
+        self._lock = threading.RLock()
+
+    def __len__(self):
+        with self._lock:
+            return len(self._data)
+
+    def __contains__(self, key):
+        return self.get(key) is not None
+
+    def get(self, key, default=None):
+        """
+        Return the cached value for key and mark it as recently used.
+        """
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None:
+                return default
+            value, stored = entry
+            if self.ttl is not None and time.monotonic() - stored > self.ttl:
+                del self._data[key]
+                return default
+            self._data.move_to_end(key)
+            return value
+
+    def set(self, key, value):
+        """
+        Store value under key, evicting the least recently used entries past maxsize.
+        """
+        with self._lock:
+            self._data[key] = (value, time.monotonic())
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def pop(self, key, default=None):
+        with self._lock:
+            entry = self._data.pop(key, None)
+            return default if entry is None else entry[0]
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+
+class CachedObject:
+    """
+    A parsed storage object shared by the whole process. It is downloaded once and revalidated
+    with a conditional GET on its ETag at most every ttl seconds.
+    """
+
+    def __init__(self, key, parse, ttl=300):
+        """
+        Args:
+            key (str): object key in the storage backend.
+            parse (callable): parse(body, etag) builds the cached value from the object body.
+            ttl (float): seconds a loaded value is trusted before the ETag is checked again.
+        """
+        self.key = key
+        self.parse = parse
+        self.ttl = ttl
+        self._value = None
+        self._etag = None
+        self._checked = 0.0
+        self._lock = threading.Lock()
+
+    def get(self, storage):
+        """
+        Return the parsed object, loading or refreshing it from the storage backend when needed.
+        Errors on the first load are raised, errors on a refresh keep the stale value.
+        """
+        with self._lock:
+            now = time.monotonic()
+            if self._value is not None and now - self._checked < self.ttl:
+                return self._value
+
+            if self._value is None:
+                self._load(storage.get(self.key))
+            else:
+                try:
+                    stored = storage.get_if_changed(self.key, self._etag)
+                    if stored is not None:
+                        self._load(stored)
+                except StorageError as e:
+                    print(f'Unable to revalidate {self.key}: {e}')
+
+            self._checked = now
+            return self._value
+
+    def _load(self, stored):
+        self._etag = stored.etag
+        self._value = self.parse(stored.body, self._etag)
+
+    def clear(self):
+        """
+        Drop the cached value, the next get() reloads it.
+        """
+        with self._lock:
+            self._value = None
+            self._etag = None
+            self._checked = 0.0
@@ -0,0 +1,128 @@
+"""
+Zoom dependent clustering of the station layers.
+
+Large states (TX, CA) have thousands of stations, embedding all of them with every StreamStats attribute makes
+the page slow to load and the map slow to draw. For those states the map only receives the stations grouped
+into grid cells of about CLUSTER_CELL_PX screen pixels, and station_clusters.js asks the
+state_eval/clusters/ endpoint for the clusters of the visible extent whenever the view changes. From
+CLUSTER_MAX_ZOOM on, and for cells holding a single station, the station features are sent.
+
+The index keeps the Web Mercator coordinates of every station in memory, so a query is a bounding box mask
+and one grid grouping over NumPy arrays.
+"""
+import numpy as np
+
+from .serialize import COORD_PRECISION, station_features
+
+
+#states with more stations than this are sent to the map as clusters
+CLUSTER_MIN_STATIONS = 500
+
+#from this zoom level on every station is sent individually
+CLUSTER_MAX_ZOOM = 10
+
+#size of a cluster cell on screen
+CLUSTER_CELL_PX = 64
+
+#Web Mercator tiling, used to convert zoom levels to meters
+EARTH_RADIUS = 6378137.0
+EARTH_CIRCUMFERENCE = 2 * np.pi * EARTH_RADIUS
+TILE_SIZE = 256
+
+#map width assumed for the initial zoom, the client refreshes the clusters once the map is drawn
+MAP_WIDTH_PX = 1024
+
+
+def mercator(lon, lat):
+    """
+    Web Mercator (EPSG:3857) coordinates in meters of longitudes and latitudes in degrees.
+    """
+    lon = np.asarray(lon, dtype='float64')
+    lat = np.clip(np.asarray(lat, dtype='float64'), -85.0511, 85.0511)
+    x = np.radians(lon) * EARTH_RADIUS
+    y = np.log(np.tan(np.pi / 4 + np.radians(lat) / 2)) * EARTH_RADIUS
+    return x, y
+
+
+def cell_size(zoom):
+    """
+    Side in meters of a cluster cell at a zoom level.
+    """
+    return CLUSTER_CELL_PX * EARTH_CIRCUMFERENCE / (TILE_SIZE * 2 ** zoom)
+
+
+class StationClusters:
+    """
+    In-memory grid index of the station features of one state and evaluation.
+    """
+
+    def __init__(self, gdf, group_col='skill_class'):
+        """
+        Args:
+            gdf (gpd.GeoDataFrame): station points in EPSG:4326 with the properties sent to the map.
+            group_col (str): column splitting the stations into separate map layers, e.g. the skill class.
+        """
+        self.gdf = gdf.reset_index(drop=True)
+        self.lon = self.gdf.geometry.x.to_numpy()
+        self.lat = self.gdf.geometry.y.to_numpy()
+        self.x, self.y = mercator(self.lon, self.lat)
+        self.groups = self.gdf[group_col].to_numpy() if group_col in self.gdf.columns else None
+
+    def __len__(self):
+        return len(self.gdf)
+
+    def fit_zoom(self, width_px=MAP_WIDTH_PX):
+        """
+        Zoom level at which all stations fit the width of the map, used for the clusters embedded in the page.
+        """
+        if len(self) == 0:
+            return 0
+        width = max(self.x.max() - self.x.min(), 1.0)
+        zoom = np.log2(width_px * EARTH_CIRCUMFERENCE / (TILE_SIZE * width))
+        return int(np.clip(np.floor(zoom), 0, CLUSTER_MAX_ZOOM))
+
+    def query(self, zoom, bbox=None, group=None):
+        """
+        Clusters and single stations of a zoom level.
+
+        Args:
+            zoom (int): map zoom level.
+            bbox (list): minx, miny, maxx, maxy in EPSG:4326 of the visible extent, None for every station.
+            group (str): only the stations of this group, e.g. a skill class name, None for every station.
+
+        Returns:
+            dict: GeoJSON FeatureCollection. Clusters are points at the mean station location with the
+            cluster (True) and count properties, single stations are lean station features (see serialize.py).
+        """
+        mask = np.ones(len(self), dtype=bool)
+        if bbox is not None:
+            minx, miny, maxx, maxy = bbox
+            mask &= (self.lon >= minx) & (self.lon <= maxx) & (self.lat >= miny) & (self.lat <= maxy)
+        if group is not None and self.groups is not None:
+            mask &= self.groups == group
+        positions = np.flatnonzero(mask)
+
+        if zoom >= CLUSTER_MAX_ZOOM or len(positions) == 0:
+            return {'type': 'FeatureCollection', 'features': self._stations(positions)}
+
+        size = cell_size(zoom)
+        cells = np.stack([np.floor(self.x[positions] / size), np.floor(self.y[positions] / size)], axis=1)
+        _, inverse, counts = np.unique(cells, axis=0, return_inverse=True, return_counts=True)
+        inverse = inverse.ravel()
+
+        features = self._stations(positions[counts[inverse] == 1])
+        lon = np.bincount(inverse, weights=self.lon[positions]) / counts
+        lat = np.bincount(inverse, weights=self.lat[positions]) / counts
+        lon, lat = np.round(lon, COORD_PRECISION), np.round(lat, COORD_PRECISION)
+        for cell in np.flatnonzero(counts > 1):
+            features.append({
+                'type': 'Feature',
+                'geometry': {'type': 'Point', 'coordinates': [float(lon[cell]), float(lat[cell])]},
+                'properties': {'cluster': True, 'count': int(counts[cell])},
+            })
+        return {'type': 'FeatureCollection', 'features': features}
+
+    def _stations(self, positions):
+        if len(positions) == 0:
+            return []
+        return station_features(self.gdf.iloc[positions])
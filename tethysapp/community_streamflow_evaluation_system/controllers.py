@@ -1,20 +1,7 @@
-import json
-from pathlib import Path
-import pandas as pd
-import geopandas as gpd
-
 from tethys_sdk.layouts import MapLayout
 from tethys_sdk.routing import controller
 from .app import CSES as app
 
-#functions to load AWS data
-import boto3
-import os
-from botocore import UNSIGNED 
-from botocore.client import Config
-import os
-os.environ['AWS_NO_SIGN_REQUEST'] = 'YES'
-
 
 #Date picker
 from tethys_sdk.gizmos import DatePicker
@@ -30,16 +17,11 @@ from datetime import date, timedelta
 from django.http import HttpResponse 
 
 #utils
-from .utils import combine_jsons, reach_json
-
-
-#Set Global Variables
-
-s3 = boto3.resource('s3')
-
-BUCKET_NAME = 'streamflow-app-data'
-BUCKET = s3.Bucket(BUCKET_NAME) 
-S3 = boto3.resource('s3', config=Config(signature_version=UNSIGNED))
+from .utils import combine_jsons, reach_json, extent_stations
+from .instrumentation import CONTENT_TYPE, instrumented, render_metrics
+from .serialize import dumps
+from .site_index import get_site_index
+from .storage import StorageError, get_storage
 
 #Controller base configurations
 BASEMAPS = [
@@ -52,6 +34,9 @@ BASEMAPS = [
     ]
 MAX_ZOOM = 16
 MIN_ZOOM = 1
+
+#stations evaluated at most by one map extent request, zoom in for more
+EXTENT_MAX_STATIONS = 1000
 BACK_URL = reverse_lazy('community_streamflow_evaluation_system:home')
 
 @controller
@@ -75,4 +60,59 @@ def home(request):
         }
 
 
-        return render(request, 'community_streamflow_evaluation_system/home.html', context)
\ No newline at end of file
+        return render(request, 'community_streamflow_evaluation_system/home.html', context)
+
+
+@controller(name='metrics', url='metrics/')
+def metrics(request):
+    '''
+    Hot path timings and bytes read of this worker process, in the Prometheus text format.
+    Staff only, the scraper signs in with a staff account.
+    '''
+    if not request.user.is_staff:
+        return HttpResponse('Staff only', status=403)
+    return HttpResponse(render_metrics(), content_type=CONTENT_TYPE)
+
+
+@controller(
+    name='extent_stations',
+    url='extent/stations/',
+    app_workspace=True,
+)
+@instrumented('extent.stations')
+def map_extent_stations(request, app_workspace):
+    '''
+    Stations of a bounding box (bbox=minx,miny,maxx,maxy) or a circle (lon, lat, radius_km), queried from the
+    spatial index of all StreamStats gauges and scored for startdate, enddate and model_id when they are given.
+    Requested by extent_eval.js to evaluate the visible map extent without reloading the page.
+    '''
+    params = request.GET
+    try:
+        sites = get_site_index(get_storage())
+        if 'bbox' in params:
+            bbox = [float(value) for value in params['bbox'].split(',')]
+            if len(bbox) != 4:
+                raise ValueError('bbox needs minx,miny,maxx,maxy')
+            sites = sites.within_bbox(bbox)
+        else:
+            sites = sites.within_radius(params['lon'], params['lat'], params['radius_km'])
+        model_id = params.get('model_id') or None
+        startdate = params.get('startdate') or None
+        enddate = params.get('enddate') or None
+        if model_id is not None:
+            startdate = datetime.strptime(startdate, '%Y-%m-%d').strftime('%Y-%m-%d')
+            enddate = datetime.strptime(enddate, '%Y-%m-%d').strftime('%Y-%m-%d')
+    except (KeyError, TypeError, ValueError) as e:
+        return JsonResponse({'error': f'Invalid extent request: {e}'}, status=400)
+    except StorageError as e:
+        return JsonResponse({'error': str(e)}, status=404)
+
+    if len(sites) > EXTENT_MAX_STATIONS:
+        return JsonResponse({'error': f'{len(sites)} stations in the extent, zoom in to evaluate at most '
+                                      f'{EXTENT_MAX_STATIONS} stations', 'count': len(sites)}, status=400)
+
+    try:
+        geojson = extent_stations(get_storage(), sites, startdate, enddate, model_id, app_workspace)
+    except StorageError as e:
+        return JsonResponse({'error': str(e)}, status=404)
+    return HttpResponse(dumps(geojson), content_type='application/json')
@@ -0,0 +1,61 @@
+"""
+Downsampling of hydrograph traces for plotting.
+
+A 40 year daily window is about 15k points per trace, far more than the plot has pixels. Each trace is cut
+into buckets and only the first, last, minimum and maximum point of each bucket are kept, so the envelope of
+the hydrograph (peaks and low flows) looks the same while the payload is capped at max_points per trace.
+Metrics are computed on the full series before downsampling.
+"""
+import numpy as np
+
+
+#points per trace when the plot_max_points custom setting is not set
+PLOT_MAX_POINTS = 2000
+
+#the first and last point and one bucket minimum and maximum
+MIN_POINTS = 4
+
+
+def envelope_indices(values, max_points=PLOT_MAX_POINTS):
+    """
+    Positions of the points kept by the min/max envelope of a series.
+
+    Args:
+        values (array-like): series values in time order, NaN marks a gap.
+        max_points (int): maximum number of points kept, at least MIN_POINTS.
+
+    Returns:
+        np.ndarray: sorted positions, every position when the series is already short enough.
+    """
+    if max_points is not None and max_points < MIN_POINTS:
+        raise ValueError(f'max_points must be at least {MIN_POINTS}, got {max_points}')
+    values = np.asarray(values, dtype='float64')
+    n = len(values)
+    if max_points is None or n <= max_points:
+        return np.arange(n)
+
+    #first and last point of the series plus a minimum and maximum per bucket
+    buckets = max(1, (max_points - 2) // 2)
+    size = -(-n // buckets)
+    padded = np.full(buckets * size, np.nan)
+    padded[:n] = values
+    padded = padded.reshape(buckets, size)
+
+    #gaps never win a bucket, an all NaN bucket keeps its first point so the gap is still drawn
+    lows = np.where(np.isnan(padded), np.inf, padded).argmin(axis=1)
+    highs = np.where(np.isnan(padded), -np.inf, padded).argmax(axis=1)
+    offsets = np.arange(buckets) * size
+    kept = np.concatenate([[0, n - 1], offsets + lows, offsets + highs])
+    return np.unique(kept[kept < n])
+
+
+def downsample(frame, column, max_points=PLOT_MAX_POINTS):
+    """
+    Plot arrays of one column of a frame indexed by date, downsampled to at most max_points.
+
+    Returns:
+        list, list: YYYY-MM-DD dates and values of the kept points.
+    """
+    values = frame[column].to_numpy()
+    kept = envelope_indices(values, max_points)
+    return frame.index[kept].strftime('%Y-%m-%d').to_list(), values[kept].tolist()
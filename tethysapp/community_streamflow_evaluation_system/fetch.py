@@ -0,0 +1,105 @@
+"""
+Shared S3 client and thread pool for concurrent object reads.
+
+Every request reads several independent objects (observed and modeled series, the station files of each
+state, the WBD geodatabases of each HU2 region). They are submitted together to one bounded pool so the
+request waits for the slowest object instead of the sum of all of them, and all threads share one boto3
+resource whose client keeps a connection pool sized for the pool.
+"""
+import contextvars
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+
+#threads reading objects concurrently, shared by all requests of a worker process
+FETCH_WORKERS = 16
+
+#connections kept open to S3, more than the pool so nested reads do not wait for a connection
+MAX_POOL_CONNECTIONS = 32
+RETRIES = {'max_attempts': 5, 'mode': 'adaptive'}
+CONNECT_TIMEOUT = 5
+READ_TIMEOUT = 60
+
+_S3 = None
+_EXECUTOR = None
+_LOCK = threading.Lock()
+
+
+def s3_config():
+    """
+    Unsigned botocore config with a connection pool and retries for the public bucket.
+    """
+    from botocore import UNSIGNED
+    from botocore.client import Config
+
+    return Config(
+        signature_version=UNSIGNED,
+        max_pool_connections=MAX_POOL_CONNECTIONS,
+        retries=RETRIES,
+        connect_timeout=CONNECT_TIMEOUT,
+        read_timeout=READ_TIMEOUT,
+    )
+
+
+def s3_resource():
+    """
+    Process-wide boto3 S3 resource, all threads share its client and connection pool.
+    """
+    import boto3
+
+    global _S3
+    with _LOCK:
+        if _S3 is None:
+            _S3 = boto3.session.Session().resource('s3', config=s3_config())
+        return _S3
+
+
+def executor():
+    """
+    Process-wide bounded thread pool for object reads.
+    """
+    global _EXECUTOR
+    with _LOCK:
+        if _EXECUTOR is None:
+            _EXECUTOR = ThreadPoolExecutor(max_workers=FETCH_WORKERS, thread_name_prefix='cses-fetch')
+        return _EXECUTOR
+
+
+def fetch_all(fn, items):
+    """
+    Apply fn to every item concurrently on the shared pool.
+
+    Tasks that no worker has started yet when the caller gets to them are run in the calling thread, so
+    fetches nested inside other fetches never wait on a saturated pool.
+
+    Args:
+        fn (callable): fn(item) reads one object.
+        items (iterable): items to read.
+
+    Returns:
+        list: fn(item) for every item, in order. The first error is raised.
+    """
+    items = list(items)
+    if len(items) <= 1:
+        return [fn(item) for item in items]
+
+    pool = executor()
+    #each task runs in a copy of the caller's context, so reads are timed against the caller's span
+    futures = [pool.submit(contextvars.copy_context().run, fn, item) for item in items]
+    results = []
+    for future, item in zip(futures, items):
+        if future.cancel():
+            results.append(fn(item))
+        else:
+            results.append(future.result())
+    return results
+
+
+def run_concurrently(*calls):
+    """
+    Run independent zero-argument callables concurrently on the shared pool.
+
+    Returns:
+        list: the result of every call, in order.
+    """
+    return fetch_all(lambda call: call(), calls)
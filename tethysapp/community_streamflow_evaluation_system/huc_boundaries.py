@@ -0,0 +1,170 @@
+"""
+Simplified WBD boundary layers of the HUC evaluation map.
+
+The WBD geodatabases hold HU8 to HU12 polygons at full survey resolution, far too many vertices to draw in the
+browser. Each HUC level of each HU2 region is simplified offline at the DETAILS tolerances with a coverage
+simplification, which moves the edge shared by two neighboring units once for both so the simplified units
+still tile the region without gaps or overlaps. Coordinates are snapped to a grid a tenth of the tolerance
+and the tables are stored as zstd compressed GeoParquet, one object per region, level and detail.
+
+A map request reads only the tables of the requested HUCs at the detail matching the pixel size of the map
+extent, never the geodatabases. Build the tables offline and upload them under WBD/Boundaries/::
+
+    python -m tethysapp.community_streamflow_evaluation_system.huc_boundaries --out boundaries
+"""
+import argparse
+import io
+import os
+
+import numpy as np
+
+from .cache import CachedObject, LRUCache
+from .fetch import fetch_all
+from .huc_lookup import HU2_REGIONS, wbd_key
+
+
+BOUNDARY_KEY = 'WBD/Boundaries/WBD_{HU}_HU{level}_{detail}.parquet'
+BOUNDARY_TTL = 3600
+
+#HUC levels drawn by the HUC evaluation map, the WBDHU{level} layers of the geodatabases
+HUC_LEVELS = [2, 4, 6, 8, 10, 12]
+
+#detail name and simplification tolerance in degrees, coarsest first
+DETAILS = [
+    ('low', 0.01),
+    ('medium', 0.002),
+    ('high', 0.0004),
+]
+
+#map width assumed for the extent of the page, see clusters.MAP_WIDTH_PX
+MAP_WIDTH_PX = 1024
+
+CODE_COL = 'huc'
+NAME_COL = 'name'
+
+#parsed boundary tables, one CachedObject per stored object
+BOUNDARIES = LRUCache(maxsize=64)
+
+
+def detail_for_extent(bounds, width_px=MAP_WIDTH_PX):
+    """
+    Coarsest detail whose tolerance is below the size of a pixel of the map extent.
+
+    Args:
+        bounds (list): minx, miny, maxx, maxy in degrees of the map extent.
+        width_px (int): map width in pixels.
+
+    Returns:
+        str: detail name, see DETAILS.
+    """
+    minx, miny, maxx, maxy = bounds
+    pixel = max(maxx - minx, maxy - miny, 1e-9) / width_px
+    for detail, tolerance in DETAILS:
+        if tolerance <= pixel:
+            return detail
+    return DETAILS[-1][0]
+
+
+def simplify_coverage(geometries, tolerance):
+    """
+    Topology preserving simplification of polygons tiling a region, snapped to a tenth of the tolerance.
+    """
+    import shapely
+
+    simplified = shapely.coverage_simplify(np.asarray(geometries), tolerance)
+    #snapping keeps the polygons valid
+    return shapely.set_precision(simplified, tolerance / 10)
+
+
+def build_boundaries(storage, HU, out_dir, levels=HUC_LEVELS, details=DETAILS):
+    """
+    Write the simplified boundary tables of one HU2 region.
+
+    Args:
+        storage (Storage): storage backend holding the WBD geodatabases.
+        HU (str): two digit HU2 region.
+        out_dir (str): local mirror of the bucket root, tables are written under WBD/Boundaries/.
+        levels (list): HUC levels to simplify.
+        details (list): detail names and tolerances.
+
+    Returns:
+        int: number of tables written.
+    """
+    import geopandas as gpd
+
+    written = 0
+    for level in levels:
+        code_col = f'huc{level}'
+        wbd = gpd.read_file(storage.path(wbd_key(HU)), layer=f'WBDHU{level}', columns=[code_col, NAME_COL])
+        wbd = wbd.to_crs('EPSG:4326').rename(columns={code_col: CODE_COL})[[CODE_COL, NAME_COL, 'geometry']]
+        wbd = wbd.sort_values(CODE_COL).reset_index(drop=True)
+
+        for detail, tolerance in details:
+            simplified = wbd.set_geometry(simplify_coverage(wbd.geometry.to_numpy(), tolerance), crs='EPSG:4326')
+            path = os.path.join(out_dir, BOUNDARY_KEY.format(HU=HU, level=level, detail=detail))
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            simplified.to_parquet(path, compression='zstd', index=False)
+            written += 1
+    return written
+
+
+def _read_boundaries(body, etag):
+    import geopandas as gpd
+    return gpd.read_parquet(io.BytesIO(body.read()))
+
+
+def boundary_table(storage, HU, level, detail):
+    """
+    Process-wide simplified boundaries of one region, level and detail, revalidated every BOUNDARY_TTL seconds.
+    Raises ObjectNotFound when the table has not been built.
+    """
+    key = BOUNDARY_KEY.format(HU=HU, level=level, detail=detail)
+    cached = BOUNDARIES.get(key)
+    if cached is None:
+        cached = CachedObject(key, _read_boundaries, ttl=BOUNDARY_TTL)
+        BOUNDARIES.set(key, cached)
+    return cached.get(storage)
+
+
+def huc_boundaries(storage, huc_ids, detail):
+    """
+    Simplified boundaries of HUCs of any level.
+
+    Args:
+        storage (Storage): storage backend holding the boundary tables.
+        huc_ids (list): HUC codes, e.g. ['1602', '16020204'].
+        detail (str): detail name, see detail_for_extent.
+
+    Returns:
+        gpd.GeoDataFrame: huc, name and geometry of the HUCs found, in EPSG:4326.
+    """
+    import geopandas as gpd
+    import pandas as pd
+
+    huc_ids = [str(h).strip() for h in huc_ids if str(h).strip()]
+    tables = sorted({(h[:2], len(h)) for h in huc_ids if len(h) in HUC_LEVELS})
+    #the tables of the regions and levels are read concurrently
+    frames = fetch_all(lambda table: boundary_table(storage, table[0], table[1], detail), tables)
+
+    selected = [frame[frame[CODE_COL].isin(huc_ids)] for frame in frames]
+    if len(selected) == 0:
+        return gpd.GeoDataFrame(columns=[CODE_COL, NAME_COL, 'geometry'], geometry='geometry', crs='EPSG:4326')
+    return gpd.GeoDataFrame(pd.concat(selected, ignore_index=True), geometry='geometry', crs='EPSG:4326')
+
+
+def main(argv=None):
+    from .storage import get_storage
+
+    parser = argparse.ArgumentParser(description='Build the simplified WBD boundary tables from the WBD geodatabases.')
+    parser.add_argument('--regions', nargs='+', default=HU2_REGIONS, help='HU2 regions to process, default all')
+    parser.add_argument('--levels', nargs='+', type=int, default=HUC_LEVELS, help='HUC levels to process')
+    parser.add_argument('--out', default='.', help='local mirror of the bucket root, upload WBD/Boundaries/ from it')
+    args = parser.parse_args(argv)
+
+    storage = get_storage()
+    written = sum(fetch_all(lambda HU: build_boundaries(storage, HU, args.out, args.levels), args.regions))
+    print(f'Wrote {written} boundary tables to {os.path.join(args.out, "WBD", "Boundaries")}')
+
+
+if __name__ == '__main__':
+    main()
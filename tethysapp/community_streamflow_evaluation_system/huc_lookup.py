@@ -0,0 +1,163 @@
+"""
+Precomputed HUC to USGS gauge lookup table.
+
+WBD hydrologic units are nested, every HU2 through HU10 code is a prefix of the HU12 codes it contains.
+Intersecting all StreamStats gauges with the HU12 polygons once therefore answers a query at any HUC level
+with a prefix search, without reading the WBD geodatabases per request.
+
+Build the table offline and upload it to the bucket as WBD/HUC12_gauges.csv::
+
+    python -m tethysapp.community_streamflow_evaluation_system.huc_lookup --out HUC12_gauges.csv
+"""
+import argparse
+
+import numpy as np
+import pandas as pd
+
+from .cache import CachedObject
+from .fetch import fetch_all
+from .site_index import SITE_COL, STATE_COL
+from .storage import StorageError
+
+
+HUC_LOOKUP_KEY = 'WBD/HUC12_gauges.csv'
+HUC_LOOKUP_TTL = 3600
+HUC_COL = 'huc12'
+
+#WBD HU2 regions hosted as WBD/WBD_{HU}_HU2_GDB/WBD_{HU}_HU2_GDB.gdb
+HU2_REGIONS = [f'{hu:02d}' for hu in range(1, 23)]
+
+
+def wbd_key(HU):
+    return f"WBD/WBD_{HU}_HU2_GDB/WBD_{HU}_HU2_GDB.gdb/"
+
+
+class HUCGaugeLookup:
+    """
+    Sorted HU12 code to gauge table answering HUC queries at any level by prefix.
+    """
+
+    def __init__(self, table, etag=None):
+        table = table[[HUC_COL, SITE_COL, STATE_COL]].astype(str)
+        table = table.drop_duplicates().sort_values([HUC_COL, SITE_COL]).reset_index(drop=True)
+
+        self.table = table
+        self.etag = etag
+        self._codes = table[HUC_COL].to_numpy(dtype='U12')
+
+    @classmethod
+    def from_csv(cls, body, etag=None):
+        table = pd.read_csv(body, dtype=str)
+        return cls(table, etag=etag)
+
+    def __len__(self):
+        return len(self.table)
+
+    def _span(self, huc):
+        #all codes starting with huc sort between huc and the next prefix of the same length
+        upper = huc[:-1] + chr(ord(huc[-1]) + 1)
+        lo = np.searchsorted(self._codes, huc, side='left')
+        hi = np.searchsorted(self._codes, upper, side='left')
+        return lo, hi
+
+    def sites(self, huc_ids):
+        """
+        Gauges located in any of the requested HUCs.
+
+        Args:
+            huc_ids (list): HUC codes of any level (2 to 12 digits), levels can be mixed.
+
+        Returns:
+            pd.DataFrame: one row per gauge with the NWIS site id and state id.
+        """
+        rows = []
+        for huc in huc_ids:
+            huc = str(huc).strip()
+            if huc == '':
+                continue
+            lo, hi = self._span(huc)
+            rows.append(np.arange(lo, hi))
+
+        if len(rows) == 0:
+            return self.table.iloc[0:0][[SITE_COL, STATE_COL]]
+        rows = np.unique(np.concatenate(rows))
+        sites = self.table.iloc[rows][[SITE_COL, STATE_COL]]
+        return sites.drop_duplicates(subset=SITE_COL).reset_index(drop=True)
+
+
+_HUC_LOOKUP = CachedObject(HUC_LOOKUP_KEY, lambda body, etag: HUCGaugeLookup.from_csv(body, etag=etag),
+                           ttl=HUC_LOOKUP_TTL)
+
+
+def get_huc_lookup(storage):
+    """
+    Process-wide HUC lookup table, raises ObjectNotFound if the table has not been uploaded.
+    """
+    return _HUC_LOOKUP.get(storage)
+
+
+def huc_sites(storage, huc_ids, fallback):
+    """
+    Gauges located in the requested HUCs, from the lookup table or, when it has not been uploaded, from
+    fallback(huc_ids), e.g. a join of the WBD geodatabases.
+
+    Returns:
+        pd.DataFrame: NWIS_site_id and state_id columns.
+    """
+    try:
+        lookup = get_huc_lookup(storage)
+    except StorageError:
+        print('No HUC lookup table available, joining the WBD geodatabases')
+        return fallback(huc_ids)
+    return lookup.sites(huc_ids)
+
+
+def build_huc_lookup(storage, site_index, regions=HU2_REGIONS):
+    """
+    Intersect every named StreamStats gauge with the WBD HU12 polygons.
+
+    Args:
+        storage (Storage): storage backend holding the WBD geodatabases.
+        site_index (StreamStatsIndex): gauge locations.
+        regions (list): HU2 regions to process.
+
+    Returns:
+        pd.DataFrame: huc12, NWIS_site_id and state_id columns.
+    """
+    import geopandas as gpd
+
+    gauges = site_index.gdf
+    gauges = gauges[gauges['NWIS_sitename'].notna()][[SITE_COL, STATE_COL, 'geometry']]
+    gauges = gauges.set_crs('EPSG:4326')
+
+    #the HU2 geodatabases are read and joined concurrently
+    def join(HU):
+        print(f'Joining gauges with WBDHU12 for region {HU}')
+        wbd = gpd.read_file(storage.path(wbd_key(HU)), layer='WBDHU12', columns=[HUC_COL])
+        wbd = wbd[[HUC_COL, 'geometry']].to_crs(gauges.crs)
+        joined = gauges.sjoin(wbd, how='inner', predicate='intersects')
+        return pd.DataFrame(joined[[HUC_COL, SITE_COL, STATE_COL]])
+
+    tables = fetch_all(join, regions)
+
+    table = pd.concat(tables, ignore_index=True).drop_duplicates()
+    return table.sort_values([HUC_COL, SITE_COL]).reset_index(drop=True)
+
+
+def main(argv=None):
+    from .site_index import get_site_index
+    from .storage import get_storage
+
+    parser = argparse.ArgumentParser(description='Build the HUC to USGS gauge lookup table from the WBD geodatabases.')
+    parser.add_argument('--regions', nargs='+', default=HU2_REGIONS, help='HU2 regions to process, default all')
+    parser.add_argument('--out', default='HUC12_gauges.csv', help=f'output csv, upload it to {HUC_LOOKUP_KEY}')
+    args = parser.parse_args(argv)
+
+    storage = get_storage()
+    table = build_huc_lookup(storage, get_site_index(storage), regions=args.regions)
+    table.to_csv(args.out, index=False)
+    print(f'Wrote {len(table)} HUC12/gauge pairs to {args.out}')
+
+
+if __name__ == '__main__':
+    main()
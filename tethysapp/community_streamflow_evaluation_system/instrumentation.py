@@ -0,0 +1,158 @@
+"""
+Timing spans of the request hot path, exposed as Prometheus text at the app's metrics/ URL.
+
+Each stage of a request (object reads, GeoJSON parsing, the WBD join, re-serialization of the station
+layers, scoring) runs in a span that records its duration in a per-stage histogram and counts its calls and
+errors. Bytes read from the storage backend are counted against the innermost open span, including reads
+submitted to the shared fetch pool from inside it. Ranged reads of the Parquet stores go through the
+pyarrow filesystem, they are timed by the spans around them but their bytes are not counted.
+
+The metrics are kept per worker process, scrape every worker or aggregate them in Prometheus. The URL
+requires a signed in staff user, give the scraper a staff account and its session cookie.
+"""
+import contextvars
+import functools
+import threading
+import time
+from contextlib import contextmanager
+
+
+#histogram buckets in seconds, from cache hits to cold reads of large states
+DURATION_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+#stage of the innermost open span, reads outside of any span are counted as 'other'
+_STAGE = contextvars.ContextVar('cses_stage', default='other')
+
+
+class Histogram:
+    """
+    Cumulative Prometheus histogram with one series per stage.
+    """
+
+    def __init__(self, name, help, buckets=DURATION_BUCKETS):
+        self.name = name
+        self.help = help
+        self.buckets = tuple(buckets)
+        self._series = {}
+        self._lock = threading.Lock()
+
+    def observe(self, stage, value):
+        with self._lock:
+            series = self._series.get(stage)
+            if series is None:
+                series = self._series[stage] = {'counts': [0] * len(self.buckets), 'sum': 0.0, 'count': 0}
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    series['counts'][i] += 1
+            series['sum'] += value
+            series['count'] += 1
+
+    def snapshot(self, stage):
+        with self._lock:
+            series = self._series.get(stage)
+            return None if series is None else {'counts': list(series['counts']), 'sum': series['sum'],
+                                                'count': series['count']}
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.help}', f'# TYPE {self.name} histogram']
+        with self._lock:
+            for stage in sorted(self._series):
+                series = self._series[stage]
+                for bound, count in zip(self.buckets, series['counts']):
+                    lines.append(f'{self.name}_bucket{{stage="{stage}",le="{bound:g}"}} {count}')
+                lines.append(f'{self.name}_bucket{{stage="{stage}",le="+Inf"}} {series["count"]}')
+                lines.append(f'{self.name}_sum{{stage="{stage}"}} {series["sum"]:.6f}')
+                lines.append(f'{self.name}_count{{stage="{stage}"}} {series["count"]}')
+        return lines
+
+
+class Counter:
+    """
+    Monotonic Prometheus counter with one series per stage.
+    """
+
+    def __init__(self, name, help):
+        self.name = name
+        self.help = help
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, stage, amount=1):
+        with self._lock:
+            self._values[stage] = self._values.get(stage, 0) + amount
+
+    def value(self, stage):
+        with self._lock:
+            return self._values.get(stage, 0)
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.help}', f'# TYPE {self.name} counter']
+        with self._lock:
+            for stage in sorted(self._values):
+                lines.append(f'{self.name}{{stage="{stage}"}} {self._values[stage]}')
+        return lines
+
+
+STAGE_SECONDS = Histogram('cses_stage_duration_seconds', 'Duration of the request stages.')
+STAGE_CALLS = Counter('cses_stage_calls_total', 'Calls of the request stages.')
+STAGE_ERRORS = Counter('cses_stage_errors_total', 'Request stages that raised an error.')
+BYTES_READ = Counter('cses_storage_bytes_read_total', 'Bytes read from the storage backend, by the stage reading them.')
+OBJECTS_READ = Counter('cses_storage_objects_read_total', 'Objects read from the storage backend, by the stage reading them.')
+
+REGISTRY = [STAGE_SECONDS, STAGE_CALLS, STAGE_ERRORS, BYTES_READ, OBJECTS_READ]
+
+
+@contextmanager
+def span(stage):
+    """
+    Time a stage of the request, reads inside the block are counted against it.
+
+    Args:
+        stage (str): stage name, e.g. 'state.compose_layers' or 'combine_jsons'.
+    """
+    token = _STAGE.set(stage)
+    start = time.perf_counter()
+    try:
+        yield
+    except BaseException:
+        STAGE_ERRORS.inc(stage)
+        raise
+    finally:
+        STAGE_SECONDS.observe(stage, time.perf_counter() - start)
+        STAGE_CALLS.inc(stage)
+        _STAGE.reset(token)
+
+
+def instrumented(stage):
+    """
+    Decorator running every call of a function or method in a span.
+    """
+    def decorator(fn):
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            with span(stage):
+                return fn(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def record_read(nbytes):
+    """
+    Count an object read of nbytes against the current stage.
+    """
+    stage = _STAGE.get()
+    OBJECTS_READ.inc(stage)
+    if nbytes:
+        BYTES_READ.inc(stage, int(nbytes))
+
+
+def render_metrics():
+    """
+    All metrics of this process in the Prometheus text exposition format.
+    """
+    lines = []
+    for metric in REGISTRY:
+        lines.extend(metric.render())
+    return '\n'.join(lines) + '\n'
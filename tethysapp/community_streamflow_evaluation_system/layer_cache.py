@@ -0,0 +1,226 @@
+"""
+Response level cache of the composed map layers.
+
+Most map requests repeat: every first visit hits the default AL state or the default Jordan River reaches,
+and users flip between a handful of states, models and windows. compose_layers results (the layer groups and
+the map extent) are cached per view and normalized query parameters. An entry records the versions (ETags)
+of the objects it was built from, the station GeoJSON, scorecards and series stores of its states and the
+lookup tables of the view, and is rebuilt when one of them changes. Object versions are cached for
+VERSION_TTL seconds (see series_store.object_version), so changes in the bucket show up within that delay.
+Local files a view reads, e.g. the hydrofabric of the app workspace, are checked by modification time on every
+request. A view falling back to its default map marks the request with skip_layer_cache, the default map is
+then not cached under the parameters that failed.
+
+Map pages carry an ETag derived from the entry, a browser revalidating an unchanged page gets a 304.
+"""
+import functools
+import hashlib
+import os
+import threading
+
+from .cache import LRUCache
+from .scorecards import SCORECARD_STORE, STATIONS_KEY
+from .series_store import MODEL_STORE, OBS_STORE, VERSION_FILE, object_version
+from .storage import get_storage
+
+
+LAYER_CACHE_SIZE = 64
+LAYER_CACHE_TTL = 3600
+LAYER_CACHE = LRUCache(maxsize=LAYER_CACHE_SIZE, ttl=LAYER_CACHE_TTL)
+
+#objects every state of a map depends on
+STATE_SOURCES = [STATIONS_KEY, SCORECARD_STORE, f'{OBS_STORE}/{VERSION_FILE}', f'{MODEL_STORE}/{VERSION_FILE}']
+
+#parameters holding a list, e.g. [10171000, 10166430] or repeated compare_ids, the order does not change the layers
+LIST_PARAMS = ('huc_ids', 'reach_ids', 'compare_ids')
+
+_BUILD_LOCKS = LRUCache(maxsize=LAYER_CACHE_SIZE)
+_BUILD_LOCKS_LOCK = threading.Lock()
+
+
+def _release():
+    #changes with every deployment of the app code or templates, so cached pages are not reused across them
+    root = os.path.dirname(os.path.abspath(__file__))
+    digest = hashlib.sha1()
+    for dirpath, dirnames, filenames in os.walk(root):
+        dirnames[:] = sorted(d for d in dirnames if d not in ('__pycache__', 'workspaces', 'tests'))
+        for filename in sorted(filenames):
+            if filename.endswith(('.py', '.html', '.js')):
+                stat = os.stat(os.path.join(dirpath, filename))
+                digest.update(f'{filename}:{stat.st_size}:{stat.st_mtime_ns}'.encode())
+    return digest.hexdigest()[:16]
+
+
+RELEASE = _release()
+
+
+def normalize_params(request, params):
+    """
+    Cache key part of the query parameters, without the brackets of the form values and with sorted lists.
+
+    Returns:
+        tuple: (name, value) pairs, None for missing parameters.
+    """
+    normalized = []
+    for name in params:
+        value = request.GET.get(name)
+        if value is not None and name in LIST_PARAMS and hasattr(request.GET, 'getlist'):
+            value = ','.join(request.GET.getlist(name))
+        if value is not None:
+            value = value.strip().strip('][')
+            if name in LIST_PARAMS:
+                value = ','.join(sorted(set(item.strip() for item in value.split(',') if item.strip())))
+        normalized.append((name, value))
+    return tuple(normalized)
+
+
+def _states(request, layer_groups):
+    #states of the stations drawn on the map
+    states = set()
+    if request.GET.get('state_id'):
+        states.add(request.GET.get('state_id').strip('][').strip())
+    for group in layer_groups:
+        for layer in group['layers']:
+            features = layer.options.get('features', []) if isinstance(layer.options, dict) else []
+            states.update(f['properties']['state'] for f in features if f.get('properties', {}).get('state'))
+    return sorted(states)
+
+
+def _versions(storage, sources):
+    return tuple(object_version(storage, key) for key in sources)
+
+
+def _file_versions(paths):
+    #size and modification time, None for missing files
+    versions = []
+    for path in paths:
+        try:
+            stat = os.stat(path)
+            versions.append((stat.st_size, stat.st_mtime_ns))
+        except OSError:
+            versions.append(None)
+    return tuple(versions)
+
+
+def _build_lock(key):
+    with _BUILD_LOCKS_LOCK:
+        lock = _BUILD_LOCKS.get(key)
+        if lock is None:
+            lock = threading.Lock()
+            _BUILD_LOCKS.set(key, lock)
+        return lock
+
+
+def skip_layer_cache(request):
+    """
+    Mark the layers composed for a request as not cacheable, e.g. the default map of a request that failed.
+    """
+    request._skip_layer_cache = True
+
+
+def cache_key(view, request):
+    return (type(view).__name__,) + normalize_params(request, view.layer_cache_params)
+
+
+def fresh_entry(view, request):
+    """
+    Cached layers of the request when none of their sources changed, otherwise None.
+    """
+    entry = LAYER_CACHE.get(cache_key(view, request))
+    if entry is None or _file_versions(entry['files']) != entry['file_versions']:
+        return None
+    if _versions(get_storage(), entry['sources']) != entry['versions']:
+        return None
+    return entry
+
+
+def cached_layers(compose_layers):
+    """
+    Decorator caching compose_layers of a MapLayout by the view's layer_cache_params.
+
+    The view lists the query parameters its layers depend on in layer_cache_params and the objects they are
+    built from, besides the per-state objects, in layer_cache_sources. Local files the layers of a request are
+    built from are returned by the view's layer_cache_files, called with the arguments of
+    compose_layers.
+    """
+    @functools.wraps(compose_layers)
+    def wrapper(self, request, map_view, *args, **kwargs):
+        key = cache_key(self, request)
+        #one build per key at a time, concurrent requests wait for it and reuse the entry
+        with _build_lock(key):
+            entry = fresh_entry(self, request)
+            if entry is None:
+                request._skip_layer_cache = False
+                layer_groups = compose_layers(self, request, map_view, *args, **kwargs)
+                sources = list(self.layer_cache_sources) + [
+                    source.format(state=state) for state in _states(request, layer_groups) for source in STATE_SOURCES]
+                versions = _versions(get_storage(), sources)
+                files_of = getattr(self, 'layer_cache_files', None)
+                files = list(files_of(request, map_view, *args, **kwargs)) if files_of is not None else []
+                file_versions = _file_versions(files)
+                digest = hashlib.sha1(repr((key, versions, file_versions)).encode()).hexdigest()
+                entry = {
+                    'layer_groups': layer_groups,
+                    'extent': map_view['view'].get('extent'),
+                    'sources': sources,
+                    'versions': versions,
+                    'files': files,
+                    'file_versions': file_versions,
+                    'digest': digest,
+                }
+                #the default map of a request without parameters is the map it asked for
+                if not request._skip_layer_cache or all(value is None for name, value in key[1:]):
+                    LAYER_CACHE.set(key, entry)
+            elif entry['extent'] is not None:
+                map_view['view']['extent'] = entry['extent']
+
+        #MapLayout appends the custom layer group to the returned list
+        return [dict(group) for group in entry['layer_groups']]
+    return wrapper
+
+
+def page_etag(request, entry):
+    """
+    ETag of a map page built from a cache entry, specific to the user and CSRF cookie embedded in the page.
+    """
+    from django.conf import settings
+
+    user = getattr(getattr(request, 'user', None), 'pk', None)
+    csrf = request.COOKIES.get(settings.CSRF_COOKIE_NAME, '')
+    return '"' + hashlib.sha1(f"{entry['digest']}:{user}:{csrf}:{RELEASE}".encode()).hexdigest() + '"'
+
+
+class ConditionalLayoutMixin:
+    """
+    MapLayout mixin answering conditional page requests from the layer cache with 304 Not Modified.
+    Put it before MapLayout in the bases and decorate compose_layers with cached_layers.
+    """
+
+    layer_cache_params = ()
+    layer_cache_sources = ()
+
+    def layer_cache_files(self, request, map_view, *args, **kwargs):
+        return ()
+
+    def get(self, request, *args, **kwargs):
+        from django.http import HttpResponseNotModified
+
+        #plot, legend and other method requests are not cached
+        if request.GET.get('method'):
+            return super().get(request, *args, **kwargs)
+
+        entry = fresh_entry(self, request)
+        if entry is not None:
+            etag = page_etag(request, entry)
+            if etag in [tag.strip() for tag in request.headers.get('If-None-Match', '').split(',')]:
+                response = HttpResponseNotModified()
+                response['ETag'] = etag
+                return response
+
+        response = super().get(request, *args, **kwargs)
+        entry = fresh_entry(self, request)
+        if entry is not None and response.status_code == 200:
+            response['ETag'] = page_etag(request, entry)
+            #the browser keeps the page but revalidates it on every visit
+            response['Cache-Control'] = 'private, no-cache'
+        return response
@@ -0,0 +1,101 @@
+import numpy as np
+
+
+#metrics returned by evaluate()
+METRICS = ['n', 'rmse', 'kge', 'r', 'alpha', 'beta', 'nse', 'pbias', 'mape', 'max_error', 'r2']
+
+#smallest denominator of the absolute percentage error, matches sklearn's mean_absolute_percentage_error
+_EPS = np.finfo(np.float64).eps
+
+
+def evaluate(obs, sim):
+    """
+    Model skill of simulated against observed streamflow for one or many sites at once.
+
+    Missing values (NaN/inf) in either series are masked pair-wise, every site is scored on the time steps where
+    both series have data. Sites without any valid pair get NaN metrics.
+
+    KGE and its components follow hydroeval: r is the Pearson correlation, alpha the ratio of the standard
+    deviations and beta the ratio of the sums (means) of the simulated and observed series. PBIAS is
+    100 * sum(obs - sim) / sum(obs), MAPE is in percent and r2 is the squared Pearson correlation.
+
+    Args:
+        obs (array-like): observed values, shape (time,) or (sites, time).
+        sim (array-like): simulated values, same shape as obs.
+
+    Returns:
+        dict: metric name to float for 1-D inputs or to an array of shape (sites,) for 2-D inputs.
+    """
+    obs = np.asarray(obs, dtype=np.float64)
+    sim = np.asarray(sim, dtype=np.float64)
+    if obs.shape != sim.shape:
+        raise ValueError(f'obs and sim must have the same shape, got {obs.shape} and {sim.shape}')
+
+    single = obs.ndim == 1
+    obs = np.atleast_2d(obs)
+    sim = np.atleast_2d(sim)
+
+    mask = np.isfinite(obs) & np.isfinite(sim)
+    n = mask.sum(axis=1)
+    o = np.where(mask, obs, 0.0)
+    s = np.where(mask, sim, 0.0)
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        count = np.where(n > 0, n, np.nan)
+        sum_o = o.sum(axis=1)
+        sum_s = s.sum(axis=1)
+        mean_o = sum_o / count
+        mean_s = sum_s / count
+
+        dev_o = np.where(mask, obs - mean_o[:, None], 0.0)
+        dev_s = np.where(mask, sim - mean_s[:, None], 0.0)
+        ss_o = (dev_o ** 2).sum(axis=1)
+        ss_s = (dev_s ** 2).sum(axis=1)
+
+        r = (dev_o * dev_s).sum(axis=1) / np.sqrt(ss_o * ss_s)
+        alpha = np.sqrt(ss_s / ss_o)
+        beta = sum_s / sum_o
+        kge = 1 - np.sqrt((r - 1) ** 2 + (alpha - 1) ** 2 + (beta - 1) ** 2)
+
+        err = s - o
+        sse = (err ** 2).sum(axis=1)
+        rmse = np.sqrt(sse / count)
+        nse = 1 - sse / ss_o
+        pbias = 100 * (sum_o - sum_s) / sum_o
+        mape = 100 * (np.abs(err) / np.maximum(np.abs(o), _EPS)).sum(axis=1) / count
+        max_error = np.where(n > 0, np.where(mask, np.abs(err), -np.inf).max(axis=1, initial=-np.inf), np.nan)
+
+    results = {
+        'n': n,
+        'rmse': rmse,
+        'kge': kge,
+        'r': r,
+        'alpha': alpha,
+        'beta': beta,
+        'nse': nse,
+        'pbias': pbias,
+        'mape': mape,
+        'max_error': max_error,
+        'r2': r ** 2,
+    }
+
+    if single:
+        return {name: (int(value[0]) if name == 'n' else float(value[0])) for name, value in results.items()}
+    return results
+
+
+def evaluate_frame(obs, sim):
+    """
+    Score aligned observed and simulated frames (time x sites) column by column.
+
+    Args:
+        obs (pd.DataFrame): observed values, one column per site.
+        sim (pd.DataFrame): simulated values with the same index and columns as obs.
+
+    Returns:
+        pd.DataFrame: one row per site, one column per metric.
+    """
+    import pandas as pd
+
+    results = evaluate(obs.to_numpy().T, sim.to_numpy().T)
+    return pd.DataFrame(results, index=obs.columns)[METRICS]
@@ -0,0 +1,227 @@
+"""
+Upstream/downstream index of the NextGen hydrofabric network.
+
+The hydrofabric flowpath_edge_list.json lists the network as {id, toid} edges between waterbodies (wb-) and
+nexuses (nex-). The ids are mapped to integers once and the edges are kept as two CSR adjacency arrays, one
+per direction, so a traversal is a breadth first search over integer arrays that visits every reachable node
+and edge once. The crosswalk.json of the same hydrofabric maps waterbodies to USGS gauges, which turns an
+upstream traversal into the list of gauges upstream of a reach.
+
+The index is built once per worker process and rebuilt when the files change.
+"""
+import json
+import os
+import threading
+
+import numpy as np
+import pandas as pd
+
+from .cache import LRUCache
+
+
+#hydrofabric files in the app workspace
+NEXTGEN_CONFIG = os.path.join('sample_nextgen_data', 'config')
+EDGE_LIST_FILE = os.path.join(NEXTGEN_CONFIG, 'flowpath_edge_list.json')
+CROSSWALK_FILE = os.path.join(NEXTGEN_CONFIG, 'crosswalk.json')
+
+GAGE_COL = 'Gage_no'
+
+#columns of the crosswalk pairs
+WATERBODY = 'waterbody'
+GAGE = 'gage'
+
+#loaded networks per file and modification time
+NETWORKS = LRUCache(maxsize=8)
+_NETWORKS_LOCK = threading.Lock()
+
+
+def _csr(src, dst, n):
+    #neighbors of node i are indices[indptr[i]:indptr[i + 1]]
+    order = np.argsort(src, kind='stable')
+    indptr = np.zeros(n + 1, dtype=np.int64)
+    np.cumsum(np.bincount(src, minlength=n), out=indptr[1:])
+    return indptr, dst[order].astype(np.int32)
+
+
+class FlowNetwork:
+    """
+    Directed hydrofabric network as CSR integer arrays with an id to index map.
+    """
+
+    def __init__(self, ids, toids):
+        """
+        Args:
+            ids (array-like): source id of every edge, e.g. wb-113060.
+            toids (array-like): downstream id of every edge, e.g. nex-113061.
+        """
+        ids = np.asarray(ids, dtype=str)
+        toids = np.asarray(toids, dtype=str)
+        self.ids, codes = np.unique(np.concatenate([ids, toids]), return_inverse=True)
+        codes = codes.ravel()
+        src, dst = codes[:len(ids)], codes[len(ids):]
+        self.index = {node: i for i, node in enumerate(self.ids.tolist())}
+
+        n = len(self.ids)
+        self.down_ptr, self.down = _csr(src, dst, n)
+        self.up_ptr, self.up = _csr(dst, src, n)
+
+    @classmethod
+    def from_edge_list(cls, edges):
+        """
+        Build the network from the parsed flowpath_edge_list.json, a list of {id, toid} dicts.
+        """
+        return cls([edge['id'] for edge in edges], [edge['toid'] for edge in edges])
+
+    @classmethod
+    def from_json(cls, path):
+        with open(path) as f:
+            return cls.from_edge_list(json.load(f))
+
+    def __len__(self):
+        return len(self.ids)
+
+    def __contains__(self, node):
+        return node in self.index
+
+    def _traverse(self, starts, indptr, indices, include_start):
+        visited = np.zeros(len(self.ids), dtype=bool)
+        frontier = np.unique(np.asarray([self.index[node] for node in starts], dtype=np.int64))
+        visited[frontier] = True
+        found = [frontier] if include_start else []
+        while len(frontier) > 0:
+            #all neighbors of the frontier in one gather
+            begin, end = indptr[frontier], indptr[frontier + 1]
+            counts = end - begin
+            total = int(counts.sum())
+            if total == 0:
+                break
+            offsets = np.repeat(begin - np.concatenate([[0], np.cumsum(counts)[:-1]]), counts)
+            neighbors = indices[offsets + np.arange(total)]
+            frontier = np.unique(neighbors[~visited[neighbors]])
+            visited[frontier] = True
+            found.append(frontier)
+        if len(found) == 0:
+            return []
+        return self.ids[np.concatenate(found)].tolist()
+
+    def upstream(self, *nodes, include_start=True):
+        """
+        Every waterbody and nexus draining to the given nodes, nearest first.
+
+        Args:
+            nodes (str): wb- or nex- ids, unknown ids raise KeyError.
+            include_start (bool): include the given nodes in the result.
+
+        Returns:
+            list: ids in breadth first order.
+        """
+        return self._traverse(nodes, self.up_ptr, self.up, include_start)
+
+    def downstream(self, *nodes, include_start=True):
+        """
+        Every waterbody and nexus the given nodes drain to, nearest first.
+        """
+        return self._traverse(nodes, self.down_ptr, self.down, include_start)
+
+
+class Crosswalk:
+    """
+    Hydrofabric waterbody to USGS gauge crosswalk, in both directions. Several waterbodies can share a gauge.
+    """
+
+    def __init__(self, gages):
+        """
+        Args:
+            gages (dict): waterbody id to list of USGS gauge ids, as in crosswalk.json.
+        """
+        self.gages = {wb: [str(gage) for gage in entry] for wb, entry in gages.items()}
+        self.waterbodies = {}
+        for wb, entry in self.gages.items():
+            for gage in entry:
+                self.waterbodies.setdefault(gage, []).append(wb)
+        #one row per waterbody and gauge, joined against whole output tables at once
+        self.pairs = pd.DataFrame([(wb, gage) for wb, entry in self.gages.items() for gage in entry],
+                                  columns=[WATERBODY, GAGE])
+
+    @classmethod
+    def from_json(cls, path):
+        with open(path) as f:
+            crosswalk = json.load(f)
+        return cls({wb: entry.get(GAGE_COL, []) for wb, entry in crosswalk.items()})
+
+    def gages_of(self, nodes):
+        """
+        USGS gauges of the given waterbodies, in order and without duplicates.
+        """
+        gages = []
+        for node in nodes:
+            gages.extend(self.gages.get(node, []))
+        return list(dict.fromkeys(gages))
+
+
+def _load(path, build):
+    key = (path, os.stat(path).st_mtime_ns)
+    with _NETWORKS_LOCK:
+        value = NETWORKS.get(key)
+        if value is None:
+            value = build(path)
+            NETWORKS.set(key, value)
+        return value
+
+
+def get_network(app_workspace):
+    """
+    Process-wide network of the hydrofabric in the app workspace, rebuilt when the edge list changes.
+    """
+    return _load(os.path.join(app_workspace.path, EDGE_LIST_FILE), FlowNetwork.from_json)
+
+
+def get_crosswalk(app_workspace):
+    """
+    Process-wide crosswalk of the hydrofabric in the app workspace, reloaded when the file changes.
+    """
+    return _load(os.path.join(app_workspace.path, CROSSWALK_FILE), Crosswalk.from_json)
+
+
+def hydrofabric_files(app_workspace):
+    """
+    Paths of the edge list and crosswalk in the app workspace, the files get_network and get_crosswalk read.
+    """
+    return [os.path.join(app_workspace.path, EDGE_LIST_FILE), os.path.join(app_workspace.path, CROSSWALK_FILE)]
+
+
+def upstream_gages(network, crosswalk, node):
+    """
+    USGS gauges upstream of a reach, the gauges of the reach itself first.
+
+    Args:
+        network (FlowNetwork): hydrofabric network.
+        crosswalk (Crosswalk): waterbody to gauge crosswalk.
+        node (str): wb- or nex- id, or a USGS gauge id of the crosswalk.
+
+    Returns:
+        list: USGS gauge ids. Raises KeyError for ids that are not in the network or crosswalk.
+    """
+    node = str(node).strip()
+    starts = crosswalk.waterbodies[node] if node in crosswalk.waterbodies else [node]
+    starts = [start for start in starts if start in network]
+    if len(starts) == 0:
+        raise KeyError(f'{node} is not in the hydrofabric network')
+    return crosswalk.gages_of(network.upstream(*starts))
+
+
+def upstream_selection(network, crosswalk, node):
+    """
+    Gauges upstream of a reach for the Reach evaluation, with the reason when there are none.
+
+    Returns:
+        list, str: USGS gauge ids and None, or no ids and the message shown instead of the stations.
+    """
+    node = str(node).strip()
+    try:
+        gages = upstream_gages(network, crosswalk, node)
+    except KeyError:
+        return [], f'{node} is not in the hydrofabric network'
+    if len(gages) == 0:
+        return [], f'No USGS gauges upstream of {node}'
+    return gages, None
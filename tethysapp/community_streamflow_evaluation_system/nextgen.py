@@ -0,0 +1,271 @@
+"""
+Evaluation of NextGen (ngen/t-route) runs against the USGS gauges.
+
+A local run directory is read in one batched pass, with either of these outputs:
+
+* t-route stream output, parquet tables in long format with location_id, time, value and optionally
+  variable_name columns. Every table of the run is scanned together and only the flow of the crosswalked
+  waterbodies is read.
+* ngen nexus outputs nex-{id}_output.csv (step, time, flow rows). The flow at a gauge is read from the nexus
+  downstream of its waterbody, found with the hydrofabric network (network_index.py).
+
+Waterbodies are mapped to gauges with the crosswalk.json pairs in one join. When several waterbodies share a
+gauge, e.g. wb-114271 and wb-114272 for 02453000, the most downstream one is used. Flows are converted from
+m3/s to cfs, averaged to daily values like the USGS records and scored for every gauge at once with the same
+metrics as the other models::
+
+    python -m tethysapp.community_streamflow_evaluation_system.nextgen --run-dir ngen-run/outputs --out scores.csv
+"""
+import argparse
+import glob
+import os
+
+import numpy as np
+import pandas as pd
+
+from .fetch import fetch_all
+from .network_index import GAGE, NEXTGEN_CONFIG, WATERBODY, Crosswalk, FlowNetwork
+from .series_store import TIME_COL
+
+
+NEXTGEN_MODEL_ID = 'NextGen'
+
+#ngen and t-route report flow in m3/s, the USGS records are in cfs
+CMS_TO_CFS = 35.314666721
+
+#t-route stream output
+LOCATION_COL = 'location_id'
+VALUE_COL = 'value'
+VARIABLE_COL = 'variable_name'
+TIME_OUT_COL = 'time'
+FLOW_VARIABLE = 'flow'
+
+#ngen nexus output
+NEXUS_OUTPUT = 'nex-{id}_output.csv'
+NEXUS_COLS = ['step', TIME_OUT_COL, FLOW_VARIABLE]
+
+#default hydrofabric of the CLI, the sample shipped in the app workspace
+SAMPLE_CONFIG = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'workspaces', 'app_workspace', NEXTGEN_CONFIG)
+
+
+def waterbody_ids(locations):
+    """
+    Hydrofabric waterbody ids (wb-{id}) of t-route locations, which are written as integers or as wb- ids.
+    """
+    locations = pd.Series(locations).astype(str).str.strip()
+    return np.where(locations.str.startswith('wb-'), locations, 'wb-' + locations)
+
+
+def outlet_pairs(crosswalk, network=None):
+    """
+    Crosswalk pairs with one waterbody per gauge, the most downstream of the gauge's waterbodies.
+
+    Args:
+        crosswalk (Crosswalk): waterbody to gauge crosswalk.
+        network (FlowNetwork): hydrofabric network, without it every pair is kept.
+
+    Returns:
+        pd.DataFrame: waterbody and gage columns.
+    """
+    pairs = crosswalk.pairs
+    if network is None:
+        return pairs
+    shared = pairs[pairs.duplicated(GAGE, keep=False)]
+    if len(shared) == 0:
+        return pairs
+
+    drop = []
+    for gage, group in shared.groupby(GAGE):
+        candidates = [wb for wb in group[WATERBODY] if wb in network]
+        #a waterbody with another waterbody of the same gauge downstream of it is not the outlet
+        for wb in candidates:
+            downstream = set(network.downstream(wb, include_start=False))
+            if any(other in downstream for other in candidates if other != wb):
+                drop.append((wb, gage))
+    drop = pd.MultiIndex.from_tuples(drop, names=[WATERBODY, GAGE]) if len(drop) > 0 else []
+    keep = ~pd.MultiIndex.from_frame(pairs[[WATERBODY, GAGE]]).isin(drop)
+    return pairs[keep].reset_index(drop=True)
+
+
+def _troute_files(run_dir):
+    return sorted(glob.glob(os.path.join(run_dir, '**', '*.parquet'), recursive=True))
+
+
+def read_troute(run_dir, waterbodies):
+    """
+    Flow of the given waterbodies from every t-route stream output table of a run, in one dataset scan.
+
+    Returns:
+        pd.DataFrame: waterbody, time and flow (m3/s) columns.
+    """
+    import pyarrow as pa
+    import pyarrow.dataset as ds
+
+    dataset = ds.dataset(_troute_files(run_dir), format='parquet')
+    names = dataset.schema.names
+    columns = [LOCATION_COL, TIME_OUT_COL, VALUE_COL]
+    #only the flow of the crosswalked waterbodies is read, the location ids are written as int or wb- ids
+    numbers = [int(wb[len('wb-'):]) for wb in waterbodies if wb[len('wb-'):].isdigit()]
+    location_type = dataset.schema.field(LOCATION_COL).type
+    wanted = numbers if pa.types.is_integer(location_type) else list(waterbodies) + [str(n) for n in numbers]
+    expression = ds.field(LOCATION_COL).isin(wanted)
+    if VARIABLE_COL in names:
+        expression = expression & (ds.field(VARIABLE_COL) == FLOW_VARIABLE)
+
+    frame = dataset.to_table(columns=columns, filter=expression).to_pandas()
+    return pd.DataFrame({
+        WATERBODY: waterbody_ids(frame[LOCATION_COL]),
+        TIME_OUT_COL: pd.to_datetime(frame[TIME_OUT_COL]),
+        FLOW_VARIABLE: frame[VALUE_COL].to_numpy(dtype='float64'),
+    })
+
+
+def read_nexus_outputs(run_dir, nexuses):
+    """
+    Flow of the given nexuses from the ngen nexus outputs, missing outputs are skipped.
+
+    Returns:
+        pd.DataFrame: nexus, time and flow (m3/s) columns.
+    """
+    def read(nexus):
+        path = os.path.join(run_dir, NEXUS_OUTPUT.format(id=nexus[len('nex-'):]))
+        if not os.path.exists(path):
+            return None
+        frame = pd.read_csv(path, header=None, names=NEXUS_COLS, usecols=[1, 2], skipinitialspace=True)
+        frame.insert(0, 'nexus', nexus)
+        return frame
+
+    #the outputs are one file per nexus, read concurrently
+    frames = [frame for frame in fetch_all(read, nexuses) if frame is not None]
+    if len(frames) == 0:
+        return pd.DataFrame(columns=['nexus', TIME_OUT_COL, FLOW_VARIABLE])
+    frame = pd.concat(frames, ignore_index=True)
+    frame[TIME_OUT_COL] = pd.to_datetime(frame[TIME_OUT_COL])
+    return frame
+
+
+def gage_series(run_dir, crosswalk, network=None):
+    """
+    Daily NextGen streamflow of every crosswalked gauge of a run.
+
+    Args:
+        run_dir (str): ngen/t-route output directory.
+        crosswalk (Crosswalk): waterbody to gauge crosswalk of the run's hydrofabric.
+        network (FlowNetwork): network of the hydrofabric, required for nexus outputs.
+
+    Returns:
+        pd.DataFrame: daily mean flow in cfs, one column per gauge id, indexed by Datetime.
+    """
+    pairs = outlet_pairs(crosswalk, network)
+
+    if len(_troute_files(run_dir)) > 0:
+        flows = read_troute(run_dir, pairs[WATERBODY].unique())
+    else:
+        if network is None:
+            raise ValueError('Reading ngen nexus outputs needs the hydrofabric network')
+        #flow at a gauge is the outflow of its waterbody, the nexus right downstream of it
+        outlets = []
+        for wb in pairs[WATERBODY].unique():
+            if wb in network:
+                nexuses = [node for node in network.downstream(wb, include_start=False)[:1] if node.startswith('nex-')]
+                outlets.extend((nexus, wb) for nexus in nexuses)
+        #several waterbodies can drain to the same nexus
+        outlets = pd.DataFrame(outlets, columns=['nexus', WATERBODY])
+        flows = read_nexus_outputs(run_dir, list(outlets['nexus'].unique()))
+        flows = flows.merge(outlets, on='nexus').drop(columns='nexus')
+
+    #waterbodies to gauges in one join
+    flows = flows.merge(pairs, on=WATERBODY)
+    if len(flows) == 0:
+        return pd.DataFrame(index=pd.DatetimeIndex([], name=TIME_COL))
+    if network is None:
+        #without the network the waterbody with the largest flow stands for a shared gauge
+        means = flows.groupby([GAGE, WATERBODY])[FLOW_VARIABLE].mean().reset_index()
+        outlets = means.sort_values(FLOW_VARIABLE).drop_duplicates(GAGE, keep='last')
+        flows = flows.merge(outlets[[GAGE, WATERBODY]], on=[GAGE, WATERBODY])
+
+    frame = flows.pivot_table(index=TIME_OUT_COL, columns=GAGE, values=FLOW_VARIABLE, aggfunc='mean')
+    frame = frame.resample('D').mean() * CMS_TO_CFS
+    frame.index.name = TIME_COL
+    frame.columns.name = None
+    return frame
+
+
+def _observations(storage, gages, startdate, enddate):
+    #one columnar read per converted state, concurrent per-site reads otherwise
+    from .series_store import read_observations, read_observations_bulk
+    from .site_index import STATE_COL, get_site_index
+    from .storage import StorageError
+
+    sites = get_site_index(storage).lookup(gages, columns=[STATE_COL])
+
+    def read_state(item):
+        state, group = item
+        try:
+            return read_observations_bulk(storage, state, list(group.index), startdate, enddate)
+        except OSError:
+            def read_site(site_id):
+                try:
+                    return read_observations(storage, state, site_id, startdate, enddate).iloc[:, 0].rename(site_id)
+                except StorageError:
+                    return None
+            series = [s for s in fetch_all(read_site, list(group.index)) if s is not None]
+            return pd.concat(series, axis=1) if len(series) > 0 else None
+
+    frames = [frame for frame in fetch_all(read_state, list(sites.groupby(STATE_COL))) if frame is not None]
+    if len(frames) == 0:
+        return pd.DataFrame(index=pd.DatetimeIndex([], name=TIME_COL))
+    return pd.concat(frames, axis=1)
+
+
+def evaluate_run(storage, run_dir, crosswalk, network=None, startdate=None, enddate=None):
+    """
+    Score a NextGen run against the USGS observations of all its gauges in one batched pass.
+
+    Args:
+        storage (Storage): storage backend holding the observations.
+        run_dir (str): ngen/t-route output directory.
+        crosswalk (Crosswalk): waterbody to gauge crosswalk of the run's hydrofabric.
+        network (FlowNetwork): network of the hydrofabric, required for nexus outputs.
+        startdate (str): first date (YYYY-MM-DD), None for the start of the run.
+        enddate (str): last date (YYYY-MM-DD), None for the end of the run.
+
+    Returns:
+        pd.DataFrame: one row per gauge id, one column per metric.
+    """
+    from .skill import ID_COL, NHD_COL, score_matrix
+
+    sim = gage_series(run_dir, crosswalk, network).loc[startdate:enddate]
+    if startdate is None and len(sim) > 0:
+        startdate, enddate = sim.index.min().strftime('%Y-%m-%d'), sim.index.max().strftime('%Y-%m-%d')
+    obs = _observations(storage, list(sim.columns), startdate, enddate)
+
+    #the simulated columns are keyed by gauge, like the observed ones
+    gages = [gage for gage in sim.columns if gage in obs.columns]
+    stations = pd.DataFrame({ID_COL: gages, NHD_COL: gages})
+    return score_matrix(stations, obs, sim)
+
+
+def main(argv=None):
+    from .storage import get_storage
+
+    parser = argparse.ArgumentParser(description='Score a NextGen (ngen/t-route) run against the USGS gauges.')
+    parser.add_argument('--run-dir', required=True, help='ngen/t-route output directory')
+    parser.add_argument('--config', default=SAMPLE_CONFIG, help='directory with crosswalk.json and flowpath_edge_list.json')
+    parser.add_argument('--start', default=None, help='first date, YYYY-MM-DD')
+    parser.add_argument('--end', default=None, help='last date, YYYY-MM-DD')
+    parser.add_argument('--out', default='nextgen_scores.csv', help='output csv')
+    args = parser.parse_args(argv)
+
+    crosswalk = Crosswalk.from_json(os.path.join(args.config, 'crosswalk.json'))
+    edges = os.path.join(args.config, 'flowpath_edge_list.json')
+    network = FlowNetwork.from_json(edges) if os.path.exists(edges) else None
+
+    scores = evaluate_run(get_storage(), args.run_dir, crosswalk, network, args.start, args.end)
+    scores.insert(0, 'model_id', NEXTGEN_MODEL_ID)
+    scores.to_csv(args.out, index_label='id')
+    print(f'Scored {len(scores)} gauges of {args.run_dir}, wrote {args.out}')
+
+
+if __name__ == '__main__':
+    main()
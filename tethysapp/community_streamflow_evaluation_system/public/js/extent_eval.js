@@ -0,0 +1,78 @@
+// Evaluation of every gauge in the visible map extent, without reloading the page.
+// The Evaluate Map Extent button sends the extent and the model and dates of the form to the extent/stations/
+// endpoint and replaces the stations of the map with the scored stations it returns. Each feature names the
+// station layer of its skill class, so the popups and plots work as for the stations of the page. On a clustered
+// state map the cluster refresh is paused, so moving the map keeps the extent results until the page is reloaded.
+var EXTENT_EVAL = (function() {
+    function station_layers(map) {
+        let layers = {};
+        map.getLayers().forEach(function(layer) {
+            if (layer.tethys_data && layer.tethys_data.plottable && String(layer.tethys_data.layer_id).startsWith('USGS Stations')) {
+                layers[layer.tethys_data.layer_id] = layer;
+            }
+        });
+        return layers;
+    }
+
+    function form_date(name) {
+        // date pickers use mm-dd-yyyy, the endpoint YYYY-MM-DD
+        let value = $('input[name="' + name + '"]').val();
+        let parts = value ? value.split('-') : [];
+        return parts.length === 3 ? parts[2] + '-' + parts[0] + '-' + parts[1] : '';
+    }
+
+    function evaluate(button) {
+        let map = TETHYS_MAP_VIEW.getMap();
+        let view = map.getView();
+        let extent = ol.proj.transformExtent(view.calculateExtent(map.getSize()), view.getProjection(), 'EPSG:4326');
+        let params = new URLSearchParams({
+            bbox: extent.map(function(value) { return value.toFixed(4); }).join(','),
+            model_id: $('select[name="model_id"]').val() || '',
+            startdate: form_date('start-date'),
+            enddate: form_date('end-date'),
+        });
+
+        $(button).addClass('disabled');
+        fetch($(button).data('url') + '?' + params.toString()).then(function(response) {
+            return response.json().then(function(data) { return {ok: response.ok, data: data}; });
+        }).then(function(result) {
+            if (!result.ok) {
+                alert(result.data.error);
+                return;
+            }
+            let layers = station_layers(map);
+            let names = Object.keys(layers);
+            if (names.length === 0) {
+                return;
+            }
+            if (typeof STATION_CLUSTERS !== 'undefined') {
+                STATION_CLUSTERS.pause();
+            }
+            Object.values(layers).forEach(function(layer) { layer.getSource().clear(true); });
+
+            let features = new ol.format.GeoJSON().readFeatures(result.data, {featureProjection: view.getProjection()});
+            features.forEach(function(feature) {
+                // skill classes without a layer on this page are drawn in the first station layer
+                let name = feature.get('layer_name');
+                if (!(name in layers)) {
+                    name = names[0];
+                    feature.set('layer_name', name);
+                }
+                layers[name].getSource().addFeature(feature);
+            });
+        }).finally(function() {
+            $(button).removeClass('disabled');
+        });
+    }
+
+    $(function() {
+        $('[name="evaluate-map-extent"]').on('click', function(event) {
+            event.preventDefault();
+            evaluate(this);
+        });
+    });
+
+    return {
+        evaluate: evaluate,
+    };
+}());
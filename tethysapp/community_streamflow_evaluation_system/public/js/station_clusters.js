@@ -0,0 +1,133 @@
+// Clustered station layers of the state map.
+// Layers built with a cluster_url hold the stations of large states as clusters, they are fetched again
+// for the visible extent and zoom whenever the map stops moving. Clicking a cluster zooms in on it.
+// While paused, e.g. when extent_eval.js shows its results in the station layers, the layers are not refreshed.
+var STATION_CLUSTERS = (function() {
+    let refresh_timer = null;
+    let requests = {};
+    let paused = false;
+
+    function cluster_layers(map) {
+        let layers = [];
+        map.getLayers().forEach(function(layer) {
+            if (layer.tethys_data && layer.tethys_data.cluster_url) {
+                layers.push(layer);
+            }
+        });
+        return layers;
+    }
+
+    function base_color(style) {
+        // fill of the station circle, the skill class color, used for the clusters of the same layer
+        try {
+            let image = style.getImage();
+            let fill = image.getFill();
+            return fill ? fill.getColor() : image.getStroke().getColor();
+        } catch (e) {
+            return '#3399cc';
+        }
+    }
+
+    function cluster_style(base_style) {
+        let styles = {};
+        return function(feature, resolution) {
+            let station_style = typeof base_style === 'function' ? base_style(feature, resolution) : base_style;
+            if (!feature.get('cluster')) {
+                return station_style;
+            }
+            let count = feature.get('count');
+            if (!(count in styles)) {
+                let color = base_color(Array.isArray(station_style) ? station_style[0] : station_style);
+                styles[count] = new ol.style.Style({
+                    image: new ol.style.Circle({
+                        radius: 8 + 4 * Math.log10(count),
+                        fill: new ol.style.Fill({color: color}),
+                        stroke: new ol.style.Stroke({color: 'white', width: 2}),
+                    }),
+                    text: new ol.style.Text({
+                        text: String(count),
+                        fill: new ol.style.Fill({color: 'black'}),
+                    }),
+                });
+            }
+            return styles[count];
+        };
+    }
+
+    function refresh(map) {
+        if (paused) {
+            return;
+        }
+        let view = map.getView();
+        let zoom = Math.round(view.getZoom());
+        let extent = ol.proj.transformExtent(view.calculateExtent(map.getSize()), view.getProjection(), 'EPSG:4326');
+        let bbox = extent.map(function(value) { return value.toFixed(4); }).join(',');
+
+        cluster_layers(map).forEach(function(layer) {
+            let url = layer.tethys_data.cluster_url + '&zoom=' + zoom + '&bbox=' + bbox;
+            let layer_url = layer.tethys_data.cluster_url;
+            // only the response of the latest request of a layer is drawn
+            requests[layer_url] = url;
+            fetch(url).then(function(response) {
+                return response.ok ? response.json() : null;
+            }).then(function(geojson) {
+                if (!geojson || requests[layer_url] !== url) {
+                    return;
+                }
+                let features = new ol.format.GeoJSON().readFeatures(geojson, {featureProjection: view.getProjection()});
+                let source = layer.getSource();
+                source.clear(true);
+                source.addFeatures(features);
+            });
+        });
+    }
+
+    function zoom_to_cluster(map, event) {
+        map.forEachFeatureAtPixel(event.pixel, function(feature) {
+            if (feature.get('cluster')) {
+                let view = map.getView();
+                view.animate({center: feature.getGeometry().getCoordinates(), zoom: view.getZoom() + 2});
+                return true;
+            }
+        });
+    }
+
+    function init() {
+        let map = TETHYS_MAP_VIEW.getMap();
+        let layers = cluster_layers(map);
+        if (layers.length === 0) {
+            return;
+        }
+        layers.forEach(function(layer) {
+            layer.setStyle(cluster_style(layer.getStyle()));
+        });
+        map.on('moveend', function() {
+            clearTimeout(refresh_timer);
+            refresh_timer = setTimeout(function() { refresh(map); }, 150);
+        });
+        map.on('singleclick', function(event) { zoom_to_cluster(map, event); });
+    }
+
+    $(function() {
+        init();
+    });
+
+    function pause() {
+        // responses of the requests in flight are dropped as well
+        paused = true;
+        clearTimeout(refresh_timer);
+        requests = {};
+    }
+
+    function resume() {
+        paused = false;
+        refresh(TETHYS_MAP_VIEW.getMap());
+    }
+
+    return {
+        refresh: function() { refresh(TETHYS_MAP_VIEW.getMap()); },
+        pause: pause,
+        resume: resume,
+        cluster_style: cluster_style,
+    };
+}());
@@ -0,0 +1,239 @@
+"""
+Precomputed skill scorecards for the standard evaluation windows.
+
+Most evaluations ask for a whole water year (October 1 to September 30) or the full 1980-2020 record the
+date pickers allow. The scorecard of a state holds the metrics of every station and model for each of
+these windows in one small Parquet file, so a map or plot request for a standard window is a table lookup
+and only custom windows are scored on the fly.
+
+Build the scorecards offline, after converting the series stores, and sync the output folder to the bucket (or the local mirror)::
+
+    python -m tethysapp.community_streamflow_evaluation_system.scorecards --states AL UT --out ./mirror
+"""
+import argparse
+import io
+import os
+import threading
+
+import numpy as np
+import pandas as pd
+
+from .cache import CachedObject, LRUCache
+from .metrics import METRICS
+from .series_store import MODEL_IDS, RECORD_END, RECORD_START
+from .skill import ID_COL, STATE_COL, read_state_series, score_matrix, score_stations, station_table
+from .storage import StorageError, get_storage
+
+
+SCORECARD_STORE = 'Scorecards/scorecards_{state}.parquet'
+SCORECARD_TTL = 3600
+STATIONS_KEY = 'GeoJSON/StreamStats_{state}_4326.geojson'
+
+MODEL_COL = 'model_id'
+WINDOW_COL = 'window'
+
+#window covering the whole record, selected when the request spans the full date picker range
+FULL_RECORD = 'POR'
+FULL_RECORD_START = f'{RECORD_START}-01-01'
+FULL_RECORD_END = f'{RECORD_END}-12-30'
+
+#one parsed scorecard per state
+SCORECARDS = LRUCache(maxsize=64)
+_SCORECARDS_LOCK = threading.Lock()
+
+
+def standard_windows():
+    """
+    Water years of the record and the full record.
+
+    Returns:
+        list: (window, startdate, enddate) tuples with YYYY-MM-DD dates.
+    """
+    windows = [(f'WY{wy}', f'{wy - 1}-10-01', f'{wy}-09-30') for wy in range(RECORD_START + 1, RECORD_END + 1)]
+    windows.append((FULL_RECORD, FULL_RECORD_START, FULL_RECORD_END))
+    return windows
+
+
+def window_label(startdate, enddate):
+    """
+    Scorecard window of an evaluation request, None for custom windows.
+
+    Args:
+        startdate (str): first date of the request.
+        enddate (str): last date of the request.
+    """
+    try:
+        start = pd.Timestamp(startdate)
+        end = pd.Timestamp(enddate)
+    except (TypeError, ValueError):
+        return None
+
+    if start <= pd.Timestamp(FULL_RECORD_START) and end >= pd.Timestamp(FULL_RECORD_END):
+        return FULL_RECORD
+    if start.month == 10 and start.day == 1 and end.month == 9 and end.day == 30 and end.year == start.year + 1:
+        if RECORD_START < end.year <= RECORD_END:
+            return f'WY{end.year}'
+    return None
+
+
+def _parse_scorecard(body, etag=None):
+    card = pd.read_parquet(io.BytesIO(body.read()))
+    return card.set_index([MODEL_COL, WINDOW_COL, ID_COL]).sort_index()
+
+
+def get_scorecard(storage, state):
+    """
+    Process-wide scorecard of a state, raises ObjectNotFound when it has not been built.
+
+    Returns:
+        pd.DataFrame: metrics indexed by model_id, window and station id.
+    """
+    with _SCORECARDS_LOCK:
+        scorecard = SCORECARDS.get(state)
+        if scorecard is None:
+            scorecard = CachedObject(SCORECARD_STORE.format(state=state), _parse_scorecard, ttl=SCORECARD_TTL)
+            SCORECARDS.set(state, scorecard)
+    return scorecard.get(storage)
+
+
+def scorecard_scores(storage, stations, model_id, startdate, enddate):
+    """
+    Metrics of the stations from the scorecards when the request is a standard window.
+
+    Args:
+        storage (Storage): storage backend holding the scorecards.
+        stations (pd.DataFrame): id, NHD_id and state columns of the stations.
+        model_id (str): model to evaluate.
+        startdate (str): first date (YYYY-MM-DD) of the evaluation window.
+        enddate (str): last date (YYYY-MM-DD) of the evaluation window.
+
+    Returns:
+        pd.DataFrame, pd.DataFrame: metrics by station id, and the stations that still need scoring
+        (custom window, or states without a scorecard).
+    """
+    stations = station_table(stations)
+    window = window_label(startdate, enddate)
+    if window is None:
+        return pd.DataFrame(columns=METRICS), stations
+
+    scores, missing = [], []
+    for state, group in stations.groupby(STATE_COL):
+        try:
+            card = get_scorecard(storage, state)
+        except StorageError:
+            missing.append(group)
+            continue
+        try:
+            card = card.loc[(model_id, window)]
+        except KeyError:
+            missing.append(group)
+            continue
+        scores.append(card.reindex(index=list(group[ID_COL]), columns=METRICS))
+
+    scores = pd.concat(scores) if len(scores) > 0 else pd.DataFrame(columns=METRICS)
+    missing = pd.concat(missing) if len(missing) > 0 else stations.iloc[0:0]
+    return scores, missing
+
+
+def station_scores(storage, stations, model_id, startdate, enddate, cache=None):
+    """
+    Metrics of the stations for a model and window, from the scorecards for standard windows and scored in one
+    batched pass for the remaining stations.
+
+    Returns:
+        pd.DataFrame: one row per station id, one column per metric.
+    """
+    scores, missing = scorecard_scores(storage, stations, model_id, startdate, enddate)
+    if len(missing) > 0:
+        computed = score_stations(storage, missing, model_id, startdate, enddate, cache=cache)
+        scores = pd.concat([scores, computed]) if len(scores) > 0 else computed
+    return scores
+
+
+def scorecard_skill(storage, state, site_id, model_id, startdate, enddate):
+    """
+    Metrics of one station from its state scorecard, None when they have to be computed.
+
+    Returns:
+        dict: metric name to value, or None.
+    """
+    if window_label(startdate, enddate) is None:
+        return None
+    stations = pd.DataFrame({ID_COL: [site_id], 'NHD_id': [''], STATE_COL: [state]})
+    scores, missing = scorecard_scores(storage, stations, model_id, startdate, enddate)
+    if len(missing) > 0 or len(scores) == 0 or np.isnan(scores.iloc[0]['n']):
+        return None
+    skill = scores.iloc[0].to_dict()
+    skill['n'] = int(skill['n'])
+    return skill
+
+
+def build_scorecard(storage, state, stations, models=MODEL_IDS, cache=None):
+    """
+    Score every station of a state for each model and standard window.
+
+    The full record of each model is read once, every window is a slice of it.
+
+    Args:
+        storage (Storage): storage backend holding the series.
+        state (str): two letter state id.
+        stations (pd.DataFrame): id, NHD_id and state columns of the state's stations.
+        models (list): model ids to score.
+        cache (SeriesCache): optional disk cache used by the per-station reads.
+
+    Returns:
+        pd.DataFrame: model_id, window, id and metric columns.
+    """
+    stations = station_table(stations)
+    windows = standard_windows()
+
+    cards = []
+    for model_id in models:
+        obs, sim = read_state_series(storage, state, stations, model_id, FULL_RECORD_START, FULL_RECORD_END, cache)
+        for window, startdate, enddate in windows:
+            scores = score_matrix(stations, obs.loc[startdate:enddate], sim.loc[startdate:enddate])
+            scores = scores[scores['n'] > 0]
+            scores.index.name = ID_COL
+            scores = scores.reset_index()
+            scores.insert(0, WINDOW_COL, window)
+            scores.insert(0, MODEL_COL, model_id)
+            cards.append(scores)
+
+    columns = [MODEL_COL, WINDOW_COL, ID_COL] + METRICS
+    if len(cards) == 0:
+        return pd.DataFrame(columns=columns)
+    return pd.concat(cards, ignore_index=True)[columns]
+
+
+def write_scorecard(card, path):
+    """
+    Write a scorecard as one zstd compressed Parquet file with float32 metrics.
+    """
+    card = card.astype({metric: 'float32' for metric in METRICS if metric != 'n'})
+    card = card.astype({'n': 'int32'})
+    os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+    card.to_parquet(path, index=False, compression='zstd')
+
+
+def main(argv=None):
+    import geopandas as gpd
+
+    parser = argparse.ArgumentParser(description='Precompute station skill scorecards for the standard windows.')
+    parser.add_argument('--states', nargs='+', required=True, help='two letter state ids')
+    parser.add_argument('--models', nargs='+', default=MODEL_IDS, help='model ids to score')
+    parser.add_argument('--out', default='.', help='output folder mirroring the bucket layout')
+    args = parser.parse_args(argv)
+
+    storage = get_storage()
+
+    for state in args.states:
+        body = storage.get(STATIONS_KEY.format(state=state)).body
+        stations = pd.DataFrame(gpd.read_file(body, driver='GeoJSON'))
+        card = build_scorecard(storage, state, stations, models=args.models)
+        path = os.path.join(args.out, SCORECARD_STORE.format(state=state))
+        write_scorecard(card, path)
+        print(f'{state}: wrote {len(card)} scores to {SCORECARD_STORE.format(state=state)}')
+
+
+if __name__ == '__main__':
+    main()
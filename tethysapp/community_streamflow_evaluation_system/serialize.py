@@ -0,0 +1,94 @@
+"""
+Lean GeoJSON of the station layers.
+
+The station features are built once from the GeoDataFrame columns instead of going through
+GeoDataFrame.to_json and json.loads. Only the properties used by the popup, the skill colors and the plot
+are kept, and coordinates are rounded to COORD_PRECISION decimals (about 1 m), which is below the accuracy
+of the gauge locations. The station id is also set as the top level feature id, which the plot requests read.
+"""
+import json
+
+import numpy as np
+import pandas as pd
+
+from .skill import ID_COL
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+
+#properties sent to the browser, in popup order
+STATION_PROPS = ['id', 'name', 'NHD_id', 'state', 'startdate', 'enddate', 'model_id', 'kge', 'rmse', 'skill_class']
+
+#StreamStats columns holding the station name, the first one present is sent as name
+NAME_COLS = ['name', 'NWIS_sitename', 'station_nm']
+
+COORD_PRECISION = 5
+
+CRS84 = {"type": "name", "properties": {"name": "urn:ogc:def:crs:OGC:1.3:CRS84"}}
+
+
+def _properties(gdf, properties):
+    frame = pd.DataFrame(index=gdf.index)
+    for prop in properties:
+        if prop in gdf.columns:
+            frame[prop] = gdf[prop]
+        elif prop == 'name':
+            source = next((col for col in NAME_COLS if col in gdf.columns), None)
+            if source is not None:
+                frame[prop] = gdf[source]
+    #plain Python values, missing values as null
+    frame = frame.astype(object).where(frame.notna(), None)
+    return frame.to_dict('records')
+
+
+def _geometries(gdf, precision):
+    geometry = gdf.geometry
+    if len(geometry) > 0 and (geometry.geom_type == 'Point').all():
+        coords = np.round(np.column_stack([geometry.x.to_numpy(), geometry.y.to_numpy()]), precision).tolist()
+        return [{'type': 'Point', 'coordinates': xy} for xy in coords]
+
+    from shapely import set_precision
+    from shapely.geometry import mapping
+    return [None if geom is None else mapping(set_precision(geom, 10 ** -precision)) for geom in geometry]
+
+
+def station_features(gdf, properties=STATION_PROPS, precision=COORD_PRECISION):
+    """
+    GeoJSON features of stations with only the given properties.
+
+    Args:
+        gdf (gpd.GeoDataFrame): station features in EPSG:4326.
+        properties (list): properties to keep, missing columns are skipped.
+        precision (int): decimals of the coordinates.
+
+    Returns:
+        list: GeoJSON feature dicts, with the ID_COL value as feature id when the frame has that column.
+    """
+    features = [{'type': 'Feature', 'geometry': geometry, 'properties': props}
+                for geometry, props in zip(_geometries(gdf, precision), _properties(gdf, properties))]
+    if ID_COL in gdf.columns:
+        for feature, station_id in zip(features, gdf[ID_COL].astype(object).where(gdf[ID_COL].notna(), None)):
+            feature['id'] = station_id
+    return features
+
+
+def station_geojson(gdf, properties=STATION_PROPS, precision=COORD_PRECISION):
+    """
+    GeoJSON FeatureCollection of stations, see station_features.
+
+    Returns:
+        dict: FeatureCollection with the CRS84 crs block expected by the map layers.
+    """
+    return {'type': 'FeatureCollection', 'crs': CRS84, 'features': station_features(gdf, properties, precision)}
+
+
+def dumps(data):
+    """
+    Compact JSON bytes, with orjson when it is installed.
+    """
+    if orjson is not None:
+        return orjson.dumps(data)
+    return json.dumps(data, separators=(',', ':')).encode()
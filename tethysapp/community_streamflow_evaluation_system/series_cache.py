@@ -0,0 +1,208 @@
+import hashlib
+import json
+import os
+import threading
+import uuid
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+
+#default byte budget when the series_cache_mb custom setting is not set
+SERIES_CACHE_MB = 512
+
+#cache folder in the app workspace
+SERIES_CACHE_DIR = 'series_cache'
+
+#bytes used by the cache folder, kept up to date by all the worker processes
+SIZE_FILE = '_size'
+
+
+class SeriesCache:
+    """
+    Disk-backed time series cache shared by all worker processes through the app workspace.
+
+    Each entry is stored once as a datetime64 .npy index, a float32 .npy value matrix and a small json
+    with the column names and the version (ETag) of the source it was read from. Entries are memory-mapped
+    on read, evicted least recently used first when the cache grows past its byte budget. The bytes used are
+    counted in a size file of the folder, updated under a file lock, so the budget holds for the workers together.
+    """
+
+    def __init__(self, root, max_bytes=SERIES_CACHE_MB * 2**20):
+        """
+        Args:
+            root (str): cache folder, created when missing.
+            max_bytes (int): byte budget of the cache folder.
+        """
+        self.root = Path(root)
+        self.root.mkdir(parents=True, exist_ok=True)
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+
+    def _base(self, key):
+        digest = hashlib.sha1(key.encode()).hexdigest()
+        return self.root / digest[:2] / digest
+
+    def get(self, key, version=None):
+        """
+        Return the cached frame for key, None on a miss or when the entry was read from another version.
+
+        Args:
+            key (str): entry key.
+            version (str): version of the source object, e.g. its ETag.
+
+        Returns:
+            pd.DataFrame: memory-mapped float32 values indexed by Datetime, or None.
+        """
+        base = self._base(key)
+        meta_path = base.with_suffix('.json')
+        try:
+            with open(meta_path) as f:
+                meta = json.load(f)
+            if meta['key'] != key or meta['version'] != version:
+                return None
+            dates = np.load(base.with_suffix('.dates.npy'), mmap_mode='r')
+            values = np.load(base.with_suffix('.values.npy'), mmap_mode='r')
+            #mark as recently used for the eviction
+            os.utime(meta_path)
+        except (OSError, ValueError, KeyError):
+            return None
+
+        index = pd.DatetimeIndex(dates, name='Datetime')
+        return pd.DataFrame(values, index=index, columns=meta['columns'], copy=False)
+
+    def put(self, key, frame, version=None):
+        """
+        Store a frame of float columns indexed by date.
+
+        Args:
+            key (str): entry key.
+            frame (pd.DataFrame): value columns indexed by Datetime.
+            version (str): version of the source object, e.g. its ETag.
+        """
+        base = self._base(key)
+        base.parent.mkdir(parents=True, exist_ok=True)
+        tmp = f".{uuid.uuid4().hex}.tmp"
+
+        dates = frame.index.to_numpy(dtype='datetime64[s]')
+        values = np.ascontiguousarray(frame.to_numpy(dtype='float32'))
+        meta = {'key': key, 'version': version, 'columns': [str(c) for c in frame.columns]}
+
+        #bytes of the replaced files of an existing entry are no longer used
+        written = 0
+        replaced = 0
+        try:
+            for suffix, array in (('.dates.npy', dates), ('.values.npy', values)):
+                path = base.with_suffix(suffix)
+                with open(str(path) + tmp, 'wb') as f:
+                    np.save(f, array)
+                written += os.path.getsize(str(path) + tmp)
+                replaced += self._file_size(path)
+                os.replace(str(path) + tmp, path)
+            #the json is written last, readers only trust entries that have one
+            with open(str(base.with_suffix('.json')) + tmp, 'w') as f:
+                json.dump(meta, f)
+            written += os.path.getsize(str(base.with_suffix('.json')) + tmp)
+            replaced += self._file_size(base.with_suffix('.json'))
+            os.replace(str(base.with_suffix('.json')) + tmp, base.with_suffix('.json'))
+        except OSError as e:
+            print(f'Unable to cache {key}: {e}')
+            return
+
+        change = written - replaced
+        self._update_size(lambda size: size + change if size + change <= self.max_bytes else self._evict())
+
+    @staticmethod
+    def _file_size(path):
+        try:
+            return path.stat().st_size
+        except OSError:
+            return 0
+
+    def _update_size(self, update):
+        #update(bytes used) returns the new count, the size file stays locked across processes meanwhile
+        with self._lock, open(self.root / SIZE_FILE, 'a+') as f:
+            if fcntl is not None:
+                fcntl.flock(f, fcntl.LOCK_EX)
+            f.seek(0)
+            try:
+                size = int(f.read())
+            except ValueError:
+                size = self.size()
+            size = update(size)
+            f.truncate(0)
+            f.write(str(size))
+
+    def _entries(self):
+        #(last used, bytes, files) for every entry, other processes may delete files at any time
+        entries = []
+        for meta_path in self.root.glob('*/*.json'):
+            base = meta_path.with_suffix('')
+            files = [meta_path, base.with_suffix('.dates.npy'), base.with_suffix('.values.npy')]
+            try:
+                used = meta_path.stat().st_mtime
+                size = sum(path.stat().st_size for path in files if path.exists())
+            except OSError:
+                continue
+            entries.append((used, size, files))
+        return entries
+
+    def _evict(self):
+        entries = sorted(self._entries(), key=lambda entry: entry[0])
+        size = sum(entry[1] for entry in entries)
+        for used, entry_size, files in entries:
+            if size <= self.max_bytes:
+                break
+            for path in files:
+                try:
+                    path.unlink()
+                except OSError:
+                    pass
+            size -= entry_size
+        return size
+
+    def size(self):
+        """
+        Bytes currently used by the cache folder.
+        """
+        return sum(entry[1] for entry in self._entries())
+
+    def clear(self):
+        self._update_size(lambda size: self._remove(self._entries()))
+
+    def _remove(self, entries):
+        for used, size, files in entries:
+            for path in files:
+                try:
+                    path.unlink()
+                except OSError:
+                    pass
+        return 0
+
+
+_CACHES = {}
+_CACHES_LOCK = threading.Lock()
+
+
+def get_series_cache(root, max_mb=None):
+    """
+    One SeriesCache per folder and process.
+
+    Args:
+        root (str): cache folder, e.g. inside the app workspace.
+        max_mb (int): byte budget in MB, None for SERIES_CACHE_MB.
+    """
+    max_bytes = int(max_mb if max_mb is not None else SERIES_CACHE_MB) * 2**20
+    with _CACHES_LOCK:
+        cache = _CACHES.get(str(root))
+        if cache is None:
+            cache = SeriesCache(root, max_bytes=max_bytes)
+            _CACHES[str(root)] = cache
+        cache.max_bytes = max_bytes
+        return cache
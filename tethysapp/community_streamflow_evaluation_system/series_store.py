@@ -0,0 +1,600 @@
+"""
+Observed and modeled streamflow time series.
+
+The original data model stores one csv per site, e.g. NWIS/NWIS_sites_{state}.h5/NWIS_{site_id}.csv, which is
+downloaded and parsed in full for every plot. The columnar store packs all sites of a state into one Parquet
+dataset partitioned by year, with typed timestamp/float32 columns sorted by site, so a read only touches the
+year partitions and row groups inside the requested window.
+
+Model predictions are consolidated the same way into one store per state indexed by NHD reach and date,
+with one float32 column per model, so all models of a reach load in one read and switching between them
+is a column selection on the cached frame.
+
+States that are not converted yet can still read only the requested window: a sidecar {csv}.idx.json next to
+each csv holds the header line and the byte offsets of every calendar year (the rows are sorted by date), so
+the reader fetches the years of the window with one Range GET instead of the whole record.
+
+Convert a state's csv files offline and sync the output folder to the bucket::
+
+    python -m tethysapp.community_streamflow_evaluation_system.series_store obs --states AL UT --out ./mirror
+    python -m tethysapp.community_streamflow_evaluation_system.series_store models --states AL UT --out ./mirror
+    python -m tethysapp.community_streamflow_evaluation_system.series_store index --states AL UT --out ./mirror
+"""
+import argparse
+import io
+import json
+import os
+from datetime import datetime, timezone
+
+import pandas as pd
+
+from .cache import LRUCache
+from .fetch import fetch_all
+from .storage import StorageError, get_storage
+
+
+#legacy one-csv-per-site layout
+OBS_CSV = 'NWIS/NWIS_sites_{state}.h5/NWIS_{site_id}.csv'
+MODEL_CSV = '{model_id}/NHD_segments_{state}.h5/{model_id}_{NHD_id}.csv'
+
+#sidecar byte offset index of a legacy csv
+CSV_INDEX = '{key}.idx.json'
+
+#columnar per-state layout, hive partitioned by year
+OBS_STORE = 'NWIS/NWIS_sites_{state}.parquet'
+OBS_ID_COL = 'USGS_id'
+OBS_COL = 'USGS_flow'
+
+MODEL_STORE = 'Models/NHD_segments_{state}.parquet'
+MODEL_ID_COL = 'NHD_id'
+MODEL_IDS = ['NWM_v2.1', 'NWM_v3.0', 'MLP', 'XGBoost', 'CNN', 'LSTM']
+
+TIME_COL = 'Datetime'
+YEAR_COL = 'year'
+
+#written next to the partitions by the converters, ignored by the dataset discovery
+VERSION_FILE = '_version.json'
+
+#first and last year of the evaluation record
+RECORD_START = 1980
+RECORD_END = 2020
+
+#about 16 sites per row group for daily data, keeps row group statistics selective on the site id
+ROW_GROUP_ROWS = 366 * 16
+
+#discovered datasets are reused for an hour before the partition listing is refreshed
+DATASETS = LRUCache(maxsize=128, ttl=3600)
+
+#full-record model frames per reach, so model and date changes do not go back to the bucket
+MODEL_FRAMES = LRUCache(maxsize=256, ttl=3600)
+
+#object ETags used to validate the disk cache, '' marks a missing object
+VERSION_TTL = 600
+VERSIONS = LRUCache(maxsize=8192, ttl=VERSION_TTL)
+
+#parsed csv sidecar indexes, {} marks a csv without one
+CSV_INDEXES = LRUCache(maxsize=8192, ttl=VERSION_TTL)
+
+def _dataset(storage, key):
+    """
+    Open the Parquet dataset stored under key, raises FileNotFoundError (an OSError) when it does not exist.
+    """
+    dataset = DATASETS.get(storage.path(key))
+    if dataset is None:
+        import pyarrow.dataset as ds
+        filesystem, path = storage.dataset_path(key)
+        dataset = ds.dataset(path, format='parquet', partitioning='hive', filesystem=filesystem)
+        DATASETS.set(storage.path(key), dataset)
+    return dataset
+
+
+def read_store(storage, key, id_col, ids, columns, startdate=None, enddate=None):
+    """
+    Read a columnar store with the site and date filters pushed down to the partitions and row groups.
+
+    Args:
+        storage (Storage): storage backend holding the store.
+        key (str): dataset key in the storage backend.
+        id_col (str): name of the site/reach id column.
+        ids (list): ids to read.
+        columns (list): value columns to read.
+        startdate (str): first date (YYYY-MM-DD) to read, None reads from the start of the record.
+        enddate (str): last date (YYYY-MM-DD) to read, None reads to the end of the record.
+
+    Returns:
+        pd.DataFrame: id column, Datetime and the value columns sorted by id and date.
+    """
+    import pyarrow.dataset as ds
+
+    dataset = _dataset(storage, key)
+    expression = ds.field(id_col).isin([str(i) for i in ids])
+    if startdate is not None:
+        start = pd.Timestamp(startdate)
+        expression = expression & (ds.field(YEAR_COL) >= start.year) & (ds.field(TIME_COL) >= start)
+    if enddate is not None:
+        end = pd.Timestamp(enddate)
+        expression = expression & (ds.field(YEAR_COL) <= end.year) & (ds.field(TIME_COL) <= end)
+
+    table = dataset.to_table(columns=[id_col, TIME_COL] + list(columns), filter=expression)
+    frame = table.to_pandas()
+    return frame.sort_values([id_col, TIME_COL]).reset_index(drop=True)
+
+
+def write_store(frame, path, id_col, filesystem=None):
+    """
+    Write a long frame (id, Datetime, values) as a year partitioned Parquet dataset.
+
+    Args:
+        frame (pd.DataFrame): id column, Datetime column and float value columns.
+        path (str): output directory, replaced partitions are overwritten.
+        id_col (str): name of the site/reach id column.
+        filesystem (pyarrow.fs.FileSystem): None writes to the local disk.
+    """
+    import pyarrow as pa
+    import pyarrow.dataset as ds
+
+    frame = frame.copy()
+    frame[id_col] = frame[id_col].astype(str)
+    frame[TIME_COL] = pd.to_datetime(frame[TIME_COL])
+    frame[YEAR_COL] = frame[TIME_COL].dt.year.astype('int16')
+    value_cols = [c for c in frame.columns if c not in (id_col, TIME_COL, YEAR_COL)]
+    frame[value_cols] = frame[value_cols].astype('float32')
+    frame = frame.sort_values([YEAR_COL, id_col, TIME_COL])
+
+    schema = pa.schema([(id_col, pa.string()), (TIME_COL, pa.timestamp('ms'))]
+                       + [(c, pa.float32()) for c in value_cols] + [(YEAR_COL, pa.int16())])
+    table = pa.Table.from_pandas(frame[[id_col, TIME_COL] + value_cols + [YEAR_COL]], schema=schema,
+                                 preserve_index=False)
+
+    ds.write_dataset(
+        table, path, format='parquet', filesystem=filesystem,
+        partitioning=ds.partitioning(pa.schema([(YEAR_COL, pa.int16())]), flavor='hive'),
+        basename_template='part-{i}.parquet',
+        max_rows_per_group=ROW_GROUP_ROWS,
+        min_rows_per_group=min(ROW_GROUP_ROWS, len(table)),
+        existing_data_behavior='delete_matching',
+        file_options=ds.ParquetFileFormat().make_write_options(compression='zstd'),
+    )
+
+
+def store_version(storage, key):
+    """
+    Version of a columnar store, the ETag of the _version.json written by the converter.
+    None when the store does not exist.
+    """
+    return object_version(storage, f"{key}/{VERSION_FILE}")
+
+
+def write_version(path):
+    """
+    Write the _version.json marker of a converted store, its ETag changes with every conversion.
+    """
+    with open(os.path.join(path, VERSION_FILE), 'w') as f:
+        json.dump({'built': datetime.now(timezone.utc).isoformat()}, f)
+
+
+def build_csv_index(data):
+    """
+    Byte offsets of the calendar years of a csv whose rows are sorted by date.
+
+    Args:
+        data (bytes): the csv object, with a Datetime column of YYYY-MM-DD dates.
+
+    Returns:
+        dict: object size, header line and the [start, end) byte range of every year, None when the csv
+        cannot be indexed (no Datetime column, other date formats or rows out of order).
+    """
+    header_end = data.find(b'\n') + 1
+    if header_end == 0:
+        return None
+    header = data[:header_end].decode()
+    columns = [column.strip().strip('"') for column in header.rstrip('\r\n').split(',')]
+    if TIME_COL not in columns:
+        return None
+    time_pos = columns.index(TIME_COL)
+
+    years = {}
+    previous = None
+    offset = header_end
+    for line in data[header_end:].splitlines(keepends=True):
+        fields = line.split(b',')
+        if line.strip() and len(fields) > time_pos:
+            value = fields[time_pos].strip().strip(b'"')
+            if not (value[:4].isdigit() and value[4:5] in (b'-', b'')):
+                return None
+            year = int(value[:4])
+            if previous is not None and year < previous:
+                return None
+            years.setdefault(year, [offset, offset])[1] = offset + len(line)
+            previous = year
+        offset += len(line)
+
+    return {'size': len(data), 'header': header, 'years': {str(year): span for year, span in years.items()}}
+
+
+def csv_index(storage, key):
+    """
+    Sidecar offset index of a legacy csv, None when it has not been indexed. Cached for VERSION_TTL seconds.
+    """
+    index = CSV_INDEXES.get(key)
+    if index is None:
+        try:
+            index = json.loads(storage.get(CSV_INDEX.format(key=key)).body.read())
+        except (StorageError, ValueError):
+            index = {}
+        CSV_INDEXES.set(key, index)
+    return index or None
+
+
+def _read_csv_range(storage, key, index, startdate, enddate):
+    #header and the rows of the years in the window, None when the index no longer matches the object
+    first = pd.Timestamp(startdate).year if startdate is not None else None
+    last = pd.Timestamp(enddate).year if enddate is not None else None
+    spans = [span for year, span in index['years'].items()
+             if (first is None or int(year) >= first) and (last is None or int(year) <= last)]
+    if len(spans) == 0:
+        return index['header'].encode()
+
+    stored = storage.get_range(key, min(span[0] for span in spans), max(span[1] for span in spans))
+    if stored.size != index['size']:
+        #the csv was replaced after it was indexed
+        CSV_INDEXES.set(key, {})
+        return None
+    return index['header'].encode() + stored.body.read()
+
+
+def _read_csv_series(storage, key, value_col, startdate=None, enddate=None):
+    data = None
+    if startdate is not None or enddate is not None:
+        index = csv_index(storage, key)
+        if index is not None:
+            data = _read_csv_range(storage, key, index, startdate, enddate)
+    frame = pd.read_csv(io.BytesIO(data) if data is not None else storage.get(key).body)
+    frame = frame[[TIME_COL, value_col]]
+    frame[TIME_COL] = pd.to_datetime(frame[TIME_COL])
+    return frame
+
+
+def _as_series_frame(frame, value_cols):
+    #one row per date, indexed by date
+    frame = frame.drop_duplicates(subset=[TIME_COL]).set_index(TIME_COL).sort_index()
+    return frame[value_cols]
+
+
+def object_version(storage, key):
+    """
+    ETag of a stored object, None when it does not exist. Versions are cached for VERSION_TTL seconds.
+    """
+    version = VERSIONS.get(key)
+    if version is None:
+        try:
+            version = storage.etag(key)
+        except StorageError:
+            version = ''
+        VERSIONS.set(key, version)
+    return version or None
+
+
+def cached_series(cache, key, columns, startdate, enddate, version, fetch):
+    """
+    Read a series through the disk cache in calendar year chunks, fetching only the years that are missing. An open
+    ended window is read from the source uncached, so it returns the whole record like the uncached path.
+
+    Args:
+        cache (SeriesCache): disk cache.
+        key (str): cache key of the series, the year is appended per chunk.
+        columns (list): value columns of the series.
+        startdate (str): first date (YYYY-MM-DD), None for the start of the record.
+        enddate (str): last date (YYYY-MM-DD), None for the end of the record.
+        version (str): version of the source, chunks of other versions are refetched.
+        fetch (callable): fetch(startdate, enddate) reads the source, may return more than asked for.
+
+    Returns:
+        pd.DataFrame: value columns indexed by Datetime for the window.
+    """
+    if startdate is None or enddate is None:
+        #the years of an open ended window are not known before reading the source
+        return fetch(startdate, enddate).reindex(columns=columns).loc[startdate:enddate]
+
+    start = pd.Timestamp(startdate)
+    end = pd.Timestamp(enddate)
+    years = list(range(start.year, end.year + 1))
+
+    chunks = {}
+    missing = []
+    for year in years:
+        chunk = cache.get(f"{key}/{year}", version)
+        if chunk is None or list(chunk.columns) != list(columns):
+            missing.append(year)
+        else:
+            chunks[year] = chunk
+
+    if len(missing) > 0:
+        fetched = fetch(f"{missing[0]}-01-01", f"{missing[-1]}-12-31").reindex(columns=columns)
+        fetched_years = fetched.index.year
+        for year in sorted(set(missing) | set(fetched_years)):
+            chunk = fetched[fetched_years == year]
+            cache.put(f"{key}/{year}", chunk, version)
+            chunks[year] = chunk
+
+    frame = pd.concat([chunks[year] for year in years])
+    return frame.loc[startdate:enddate]
+
+
+def _read_obs_store(storage, state, site_id, startdate=None, enddate=None):
+    frame = read_store(storage, OBS_STORE.format(state=state), OBS_ID_COL, [site_id], [OBS_COL], startdate, enddate)
+    return _as_series_frame(frame, [OBS_COL])
+
+
+def _read_obs_csv(storage, state, site_id, startdate=None, enddate=None):
+    frame = _read_csv_series(storage, OBS_CSV.format(state=state, site_id=site_id), OBS_COL, startdate, enddate)
+    return _as_series_frame(frame, [OBS_COL])
+
+
+def read_observations(storage, state, site_id, startdate=None, enddate=None, cache=None):
+    """
+    USGS observed streamflow for one site, from the columnar store when the state has been converted.
+
+    Args:
+        storage (Storage): storage backend holding the stores and the legacy csvs.
+        state (str): two letter state id.
+        site_id (str): USGS site id.
+        startdate (str): first date (YYYY-MM-DD), None for the start of the record.
+        enddate (str): last date (YYYY-MM-DD), None for the end of the record.
+        cache (SeriesCache): optional disk cache shared by the worker processes.
+
+    Returns:
+        pd.DataFrame: USGS_flow column indexed by Datetime.
+    """
+    if cache is not None:
+        version = store_version(storage, OBS_STORE.format(state=state))
+        if version is not None:
+            return cached_series(cache, f"obs/{state}/{site_id}", [OBS_COL], startdate, enddate, version,
+                                 lambda start, end: _read_obs_store(storage, state, site_id, start, end))
+
+        version = object_version(storage, OBS_CSV.format(state=state, site_id=site_id))
+        if version is not None:
+            return cached_series(cache, f"obs-csv/{state}/{site_id}", [OBS_COL], startdate, enddate, version,
+                                 lambda start, end: _read_obs_csv(storage, state, site_id, start, end))
+
+    try:
+        return _read_obs_store(storage, state, site_id, startdate, enddate)
+    except OSError:
+        #state not converted yet (or store unreachable), read the per-site csv
+        return _read_obs_csv(storage, state, site_id, startdate, enddate).loc[startdate:enddate]
+
+
+def read_model(storage, model_id, state, NHD_id, startdate=None, enddate=None):
+    """
+    Modeled streamflow for one NHD reach from the per-reach csv.
+    Only the years of the window are read when the csv has a sidecar index, otherwise the whole record.
+
+    Returns:
+        pd.DataFrame: column named after model_id indexed by Datetime.
+    """
+    #model csvs name the flow column with the first 3 characters of the model id, e.g. NWM_flow
+    key = MODEL_CSV.format(model_id=model_id, state=state, NHD_id=NHD_id)
+    frame = _read_csv_series(storage, key, f"{model_id[:3]}_flow", startdate, enddate)
+    frame = frame.rename(columns={f"{model_id[:3]}_flow": model_id})
+    return _as_series_frame(frame, [model_id])
+
+
+def _read_models_store(storage, state, NHD_id, startdate=None, enddate=None):
+    frame = read_store(storage, MODEL_STORE.format(state=state), MODEL_ID_COL, [NHD_id], MODEL_IDS, startdate, enddate)
+    return _as_series_frame(frame, MODEL_IDS)
+
+
+def _read_models_csv(storage, state, NHD_id, models, startdate=None, enddate=None, cache=None):
+    #state not converted yet, one csv per model read concurrently, missing models are skipped
+    def read(model):
+        key = MODEL_CSV.format(model_id=model, state=state, NHD_id=NHD_id)
+        if cache is not None:
+            version = object_version(storage, key)
+            if version is None:
+                return None
+            return cached_series(cache, f"model-csv/{model}/{state}/{NHD_id}", [model], startdate, enddate,
+                                 version, lambda start, end: read_model(storage, model, state, NHD_id, start, end))
+
+        model_df = MODEL_FRAMES.get((state, str(NHD_id), model))
+        if model_df is None:
+            try:
+                if csv_index(storage, key) is not None:
+                    #indexed csv, only the window is read and the full record is never cached
+                    return read_model(storage, model, state, NHD_id, startdate, enddate).loc[startdate:enddate]
+                model_df = read_model(storage, model, state, NHD_id)
+            except StorageError:
+                return None
+            MODEL_FRAMES.set((state, str(NHD_id), model), model_df)
+        return model_df.loc[startdate:enddate]
+
+    frames = [frame for frame in fetch_all(read, models) if frame is not None]
+
+    if len(frames) == 0:
+        return pd.DataFrame(index=pd.DatetimeIndex([], name=TIME_COL))
+    return pd.concat(frames, axis = 1)
+
+
+def read_models(storage, state, NHD_id, models=None, startdate=None, enddate=None, cache=None):
+    """
+    Modeled streamflow of several models for one NHD reach.
+    The consolidated store returns every model in one read, the frame is cached per reach.
+
+    Args:
+        storage (Storage): storage backend holding the stores and the legacy csvs.
+        state (str): two letter state id.
+        NHD_id (str): NHD reach id.
+        models (list): model ids to return, None for all models.
+        startdate (str): first date (YYYY-MM-DD), None for the start of the record.
+        enddate (str): last date (YYYY-MM-DD), None for the end of the record.
+        cache (SeriesCache): optional disk cache shared by the worker processes.
+
+    Returns:
+        pd.DataFrame: one column per model with data for this reach, indexed by Datetime.
+    """
+    models = MODEL_IDS if models is None else list(models)
+
+    if cache is not None:
+        version = store_version(storage, MODEL_STORE.format(state=state))
+        if version is None:
+            return _read_models_csv(storage, state, NHD_id, models, startdate, enddate, cache)
+        frame = cached_series(cache, f"models/{state}/{NHD_id}", MODEL_IDS, startdate, enddate, version,
+                              lambda start, end: _read_models_store(storage, state, NHD_id, start, end))
+    else:
+        frame = MODEL_FRAMES.get((state, str(NHD_id)))
+        if frame is None:
+            try:
+                frame = _read_models_store(storage, state, NHD_id)
+            except OSError:
+                return _read_models_csv(storage, state, NHD_id, models, startdate, enddate)
+            MODEL_FRAMES.set((state, str(NHD_id)), frame)
+        frame = frame.loc[startdate:enddate]
+
+    frame = frame.dropna(axis=1, how='all')
+    return frame[[model for model in models if model in frame.columns]]
+
+
+def read_observations_bulk(storage, state, site_ids, startdate=None, enddate=None):
+    """
+    Observed streamflow of many sites of a state in one read of the columnar store.
+    Raises OSError when the state has not been converted.
+
+    Returns:
+        pd.DataFrame: one column per site id, indexed by Datetime.
+    """
+    frame = read_store(storage, OBS_STORE.format(state=state), OBS_ID_COL, site_ids, [OBS_COL], startdate, enddate)
+    frame = frame.drop_duplicates(subset=[OBS_ID_COL, TIME_COL])
+    return frame.pivot(index=TIME_COL, columns=OBS_ID_COL, values=OBS_COL)
+
+
+def read_models_bulk(storage, state, NHD_ids, model_id, startdate=None, enddate=None):
+    """
+    Modeled streamflow of one model for many reaches of a state in one read of the consolidated store.
+    Raises OSError when the state has not been converted.
+
+    Returns:
+        pd.DataFrame: one column per NHD id, indexed by Datetime.
+    """
+    frame = read_store(storage, MODEL_STORE.format(state=state), MODEL_ID_COL, NHD_ids, [model_id], startdate, enddate)
+    frame = frame.drop_duplicates(subset=[MODEL_ID_COL, TIME_COL])
+    return frame.pivot(index=TIME_COL, columns=MODEL_ID_COL, values=model_id)
+
+
+def align(USGS_df, model_df, startdate=None, enddate=None):
+    """
+    Inner join observed and modeled series on date and select the evaluation window.
+
+    Returns:
+        pd.DataFrame: USGS_flow and model columns indexed by Datetime.
+    """
+    DF = pd.concat([USGS_df, model_df], axis = 1, join = 'inner')
+    return DF.loc[startdate:enddate]
+
+
+def convert_observations(storage, state, out_dir):
+    """
+    Pack every NWIS_{site_id}.csv of a state into the columnar store under out_dir.
+
+    Returns:
+        int: number of sites converted.
+    """
+    prefix = f"NWIS/NWIS_sites_{state}.h5/"
+    frames = []
+    for key in storage.keys(prefix):
+        name = os.path.basename(key)
+        if not (name.startswith('NWIS_') and name.endswith('.csv')):
+            continue
+        site_id = name[len('NWIS_'):-len('.csv')]
+        frame = _read_csv_series(storage, key, OBS_COL)
+        frame.insert(0, OBS_ID_COL, site_id)
+        frames.append(frame.drop_duplicates(subset=[TIME_COL]))
+
+    if len(frames) == 0:
+        return 0
+    path = os.path.join(out_dir, OBS_STORE.format(state=state))
+    write_store(pd.concat(frames, ignore_index=True), path, OBS_ID_COL)
+    write_version(path)
+    return len(frames)
+
+
+def convert_models(storage, state, out_dir, models=MODEL_IDS):
+    """
+    Consolidate every {model_id}_{NHD_id}.csv of a state into one store with a column per model.
+
+    Returns:
+        int: number of NHD reaches converted.
+    """
+    frames = []
+    for model in models:
+        prefix = f"{model}/NHD_segments_{state}.h5/"
+        for key in storage.keys(prefix):
+            name = os.path.basename(key)
+            if not (name.startswith(f"{model}_") and name.endswith('.csv')):
+                continue
+            NHD_id = name[len(model) + 1:-len('.csv')]
+            frame = _read_csv_series(storage, key, f"{model[:3]}_flow")
+            frame = frame.drop_duplicates(subset=[TIME_COL]).rename(columns={f"{model[:3]}_flow": 'flow'})
+            frame[MODEL_ID_COL] = NHD_id
+            frame['model'] = model
+            frames.append(frame)
+
+    if len(frames) == 0:
+        return 0
+    long = pd.concat(frames, ignore_index=True)
+    wide = long.pivot_table(index=[MODEL_ID_COL, TIME_COL], columns='model', values='flow', aggfunc='first')
+    wide = wide.reindex(columns=models).reset_index()
+    wide.columns.name = None
+    path = os.path.join(out_dir, MODEL_STORE.format(state=state))
+    write_store(wide, path, MODEL_ID_COL)
+    write_version(path)
+    return wide[MODEL_ID_COL].nunique()
+
+
+def index_csvs(storage, state, out_dir, models=MODEL_IDS):
+    """
+    Write the sidecar offset index of every legacy observed and model csv of a state under out_dir.
+
+    Returns:
+        int: number of csvs indexed, csvs that are not sorted by date are skipped.
+    """
+    prefixes = [f"NWIS/NWIS_sites_{state}.h5/"] + [f"{model}/NHD_segments_{state}.h5/" for model in models]
+    keys = [key for prefix in prefixes for key in storage.keys(prefix) if key.endswith('.csv')]
+
+    def write(key):
+        index = build_csv_index(storage.get(key).body.read())
+        if index is None:
+            print(f'{key} is not sorted by date, not indexed')
+            return 0
+        path = os.path.join(out_dir, CSV_INDEX.format(key=key))
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, 'w') as f:
+            json.dump(index, f)
+        return 1
+
+    return sum(fetch_all(write, keys))
+
+
+def main(argv=None):
+
+    parser = argparse.ArgumentParser(description='Convert per-site streamflow csv files into columnar per-state stores, or index them for ranged reads.')
+    parser.add_argument('kind', choices=['obs', 'models', 'index'], help='series to convert, index writes the csv sidecars')
+    parser.add_argument('--states', nargs='+', required=True, help='two letter state ids')
+    parser.add_argument('--models', nargs='+', default=MODEL_IDS, help='model ids to consolidate')
+    parser.add_argument('--out', default='.', help='output folder mirroring the bucket layout')
+    args = parser.parse_args(argv)
+
+    storage = get_storage()
+
+    for state in args.states:
+        if args.kind == 'obs':
+            count = convert_observations(storage, state, args.out)
+            print(f'{state}: packed {count} sites into {OBS_STORE.format(state=state)}')
+        elif args.kind == 'index':
+            count = index_csvs(storage, state, args.out, models=args.models)
+            print(f'{state}: indexed {count} csvs')
+        else:
+            count = convert_models(storage, state, args.out, models=args.models)
+            print(f'{state}: packed {count} reaches into {MODEL_STORE.format(state=state)}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,193 @@
+import numpy as np
+import pandas as pd
+
+from .cache import CachedObject
+
+
+#StreamStats gauge table shared by the Reach and HUC evaluation classes
+STREAMSTATS_KEY = 'Streamstats/Streamstats.csv'
+
+#seconds between ETag checks of the cached table against the bucket
+SITE_INDEX_TTL = 300
+
+SITE_COL = 'NWIS_site_id'
+LAT_COL = 'dec_lat_va'
+LON_COL = 'dec_long_va'
+STATE_COL = 'state_id'
+NHD_COL = 'NHD_reachcode'
+
+#distance column of the radius queries
+DISTANCE_COL = 'distance_km'
+
+EARTH_RADIUS_KM = 6371.0088
+
+
+def normalize_site_ids(site_ids):
+    """
+    The csv (and some user inputs) lose the 0 in front of USGS ids, pad every id to at least 8 digits.
+
+    Args:
+        site_ids (iterable): USGS/NWIS site ids as str or int.
+
+    Returns:
+        pd.Index: normalized site ids as str.
+    """
+    ids = pd.Series(list(site_ids), dtype=object).astype(str).str.strip()
+    return pd.Index(ids.str.zfill(8))
+
+
+class StreamStatsIndex:
+    """
+    In-memory StreamStats site table keyed by the normalized NWIS site id.
+    """
+
+    def __init__(self, streamstats, etag=None):
+        frame = streamstats.drop(columns='Unnamed: 0', errors='ignore')
+        frame[SITE_COL] = normalize_site_ids(frame[SITE_COL]).to_numpy()
+        frame = frame.drop_duplicates(subset=SITE_COL)
+        frame.index = pd.Index(frame[SITE_COL].to_numpy())
+
+        self.frame = frame
+        self.etag = etag
+        self._gdf = None
+        self._tree = None
+
+    @classmethod
+    def from_csv(cls, body, etag=None):
+        """
+        Build the index from a Streamstats.csv file-like object or path.
+        """
+        streamstats = pd.read_csv(body, dtype={SITE_COL: str})
+        return cls(streamstats, etag=etag)
+
+    def __len__(self):
+        return len(self.frame)
+
+    def __contains__(self, site_id):
+        return normalize_site_ids([site_id])[0] in self.frame.index
+
+    @property
+    def gdf(self):
+        """
+        Point GeoDataFrame of all sites, built once on first use.
+        """
+        if self._gdf is None:
+            import geopandas as gpd
+            self._gdf = gpd.GeoDataFrame(self.frame.reset_index(drop=True),
+                                         geometry=gpd.points_from_xy(self.frame[LON_COL], self.frame[LAT_COL]))
+        return self._gdf
+
+    @property
+    def tree(self):
+        """
+        STRtree over the sites with coordinates, built once on first use.
+        Query results are positions in the frame.
+        """
+        if self._tree is None:
+            from shapely import STRtree, points
+            lon = self.frame[LON_COL].to_numpy(dtype='float64')
+            lat = self.frame[LAT_COL].to_numpy(dtype='float64')
+            self._lon, self._lat = lon, lat
+            self._located = np.flatnonzero(np.isfinite(lon) & np.isfinite(lat))
+            self._tree = STRtree(points(lon[self._located], lat[self._located]))
+        return self._tree
+
+    def _query(self, minx, miny, maxx, maxy):
+        from shapely import box
+        hits = self.tree.query(box(minx, miny, maxx, maxy))
+        return np.sort(self._located[hits])
+
+    def within_bbox(self, bbox, columns=None):
+        """
+        Sites inside a bounding box.
+
+        Args:
+            bbox (list): minx, miny, maxx, maxy in EPSG:4326, e.g. the visible map extent.
+            columns (list): optional subset of columns to return.
+
+        Returns:
+            pd.DataFrame: rows of the sites inside the box, edges included.
+        """
+        minx, miny, maxx, maxy = [float(value) for value in bbox]
+        rows = self.frame.iloc[self._query(minx, miny, maxx, maxy)]
+        return rows if columns is None else rows[columns]
+
+    def within_radius(self, lon, lat, radius_km, columns=None):
+        """
+        Sites within a great circle distance of a point, nearest first.
+
+        Args:
+            lon (float): longitude of the center in degrees.
+            lat (float): latitude of the center in degrees.
+            radius_km (float): search radius in kilometers.
+            columns (list): optional subset of columns to return.
+
+        Returns:
+            pd.DataFrame: rows of the sites in the radius with their distance in the distance_km column.
+        """
+        lon, lat, radius_km = float(lon), float(lat), float(radius_km)
+        #candidates from the bounding box of the circle, widened with the latitude
+        dlat = np.degrees(radius_km / EARTH_RADIUS_KM)
+        dlon = dlat / max(np.cos(np.radians(min(abs(lat) + dlat, 89.9))), 1e-6)
+        positions = self._query(lon - dlon, lat - dlat, lon + dlon, lat + dlat)
+
+        #haversine distance of the candidates
+        phi1, phi2 = np.radians(lat), np.radians(self._lat[positions])
+        dphi, dlam = phi2 - phi1, np.radians(self._lon[positions] - lon)
+        a = np.sin(dphi / 2) ** 2 + np.cos(phi1) * np.cos(phi2) * np.sin(dlam / 2) ** 2
+        distance = 2 * EARTH_RADIUS_KM * np.arcsin(np.sqrt(np.minimum(a, 1.0)))
+
+        inside = distance <= radius_km
+        order = np.argsort(distance[inside], kind='stable')
+        rows = self.frame.iloc[positions[inside][order]]
+        if columns is not None:
+            rows = rows[columns]
+        return rows.assign(**{DISTANCE_COL: distance[inside][order]})
+
+    def lookup(self, site_ids, columns=None):
+        """
+        Vectorized lookup of many sites at once.
+
+        Args:
+            site_ids (iterable): USGS site ids, padded or not.
+            columns (list): optional subset of columns to return.
+
+        Returns:
+            pd.DataFrame: rows for the known sites, in request order, without duplicates.
+        """
+        ids = normalize_site_ids(site_ids).drop_duplicates()
+        ids = ids[ids.isin(self.frame.index)]
+        rows = self.frame.loc[ids]
+        if columns is not None:
+            rows = rows[columns]
+        return rows
+
+    def states(self, site_ids):
+        """
+        Unique state ids of the requested sites, in first-seen order.
+        """
+        return list(pd.unique(self.lookup(site_ids, columns=[STATE_COL])[STATE_COL]))
+
+
+_SITE_INDEX = CachedObject(STREAMSTATS_KEY, lambda body, etag: StreamStatsIndex.from_csv(body, etag=etag),
+                           ttl=SITE_INDEX_TTL)
+
+
+def get_site_index(storage):
+    """
+    Process-wide StreamStats index, loaded once and revalidated against the ETag at most every SITE_INDEX_TTL seconds.
+
+    Args:
+        storage (Storage): storage backend holding Streamstats/Streamstats.csv.
+
+    Returns:
+        StreamStatsIndex: the shared index.
+    """
+    return _SITE_INDEX.get(storage)
+
+
+def clear_site_index():
+    """
+    Drop the cached index, the next call to get_site_index() reloads it.
+    """
+    _SITE_INDEX.clear()
@@ -0,0 +1,180 @@
+import numpy as np
+import pandas as pd
+
+from .fetch import fetch_all
+from .metrics import METRICS, evaluate
+from .series_store import read_models, read_models_bulk, read_observations, read_observations_bulk
+from .storage import StorageError
+
+
+#station id columns of the StreamStats geojson features
+ID_COL = 'id'
+NHD_COL = 'NHD_id'
+STATE_COL = 'state'
+
+#KGE classes used to color the stations, (class, legend label, lower KGE bound, color)
+SKILL_CLASSES = [
+    ('good', 'KGE >= 0.5', 0.5, '#1a9850'),
+    ('fair', '0 <= KGE < 0.5', 0.0, '#fee08b'),
+    ('poor', 'KGE < 0', -np.inf, '#d73027'),
+]
+NO_SKILL = ('none', 'No data', None, 'white')
+
+
+def skill_class(kge):
+    """
+    Skill class of each KGE value, 'none' where the KGE could not be computed.
+
+    Args:
+        kge (array-like): KGE values.
+
+    Returns:
+        np.ndarray: class names.
+    """
+    kge = np.asarray(kge, dtype=np.float64)
+    classes = np.full(kge.shape, NO_SKILL[0], dtype=object)
+    for name, label, lower, color in reversed(SKILL_CLASSES):
+        classes[np.isfinite(kge) & (kge >= lower)] = name
+    return classes
+
+
+def skill_style_map(color):
+    """
+    Vector style map of a station layer drawn in the color of its skill class.
+    """
+    stroke = 'red' if color == NO_SKILL[3] else '#333333'
+    return {
+        'Point': {'ol.style.Style': {
+            'image': {'ol.style.Circle': {
+                'radius': 5,
+                'fill': {'ol.style.Fill': {
+                    'color': color,
+                }},
+                'stroke': {'ol.style.Stroke': {
+                    'color': stroke,
+                    'width': 3 if color == NO_SKILL[3] else 1
+                }}
+            }}
+        }},
+    }
+
+
+def _score_state_store(storage, state, stations, model_id, startdate, enddate):
+    #one read per store for every station of the state
+    obs = read_observations_bulk(storage, state, list(stations[ID_COL]), startdate, enddate)
+    sim = read_models_bulk(storage, state, list(stations[NHD_COL]), model_id, startdate, enddate)
+    return obs, sim
+
+
+def _score_state_csv(storage, state, stations, model_id, startdate, enddate, cache):
+    #concurrent per-station reads for states that have not been converted to the columnar stores
+    def read(row):
+        try:
+            USGS_df = read_observations(storage, state, row[ID_COL], startdate, enddate, cache=cache)
+        except StorageError:
+            USGS_df = None
+        try:
+            model_df = read_models(storage, state, row[NHD_COL], [model_id], startdate, enddate, cache=cache)
+        except StorageError:
+            model_df = None
+        return row, USGS_df, model_df
+
+    obs, sim = {}, {}
+    for row, USGS_df, model_df in fetch_all(read, stations.to_dict('records')):
+        if USGS_df is not None and len(USGS_df) > 0:
+            obs[row[ID_COL]] = USGS_df.iloc[:, 0]
+        if model_df is not None and model_id in model_df.columns:
+            sim[row[NHD_COL]] = model_df[model_id]
+    #keep a date index when no station has data so the frames can still be sliced by date
+    empty = pd.DatetimeIndex([], name='Datetime')
+    obs = pd.DataFrame(obs) if len(obs) > 0 else pd.DataFrame(index=empty)
+    sim = pd.DataFrame(sim) if len(sim) > 0 else pd.DataFrame(index=empty)
+    return obs, sim
+
+
+def read_state_series(storage, state, stations, model_id, startdate, enddate, cache=None):
+    """
+    Observed and modeled series of the stations of one state, from the columnar stores when the state has
+    been converted, otherwise from the per-station csvs read concurrently.
+
+    Returns:
+        pd.DataFrame, pd.DataFrame: observed flow by station id and modeled flow by NHD id, indexed by Datetime.
+    """
+    try:
+        return _score_state_store(storage, state, stations, model_id, startdate, enddate)
+    except OSError:
+        return _score_state_csv(storage, state, stations, model_id, startdate, enddate, cache)
+
+
+def score_matrix(stations, obs, sim):
+    """
+    Align observed and modeled series into (stations x days) matrices and score them in one pass.
+
+    Returns:
+        pd.DataFrame: one row per station id, one column per metric.
+    """
+    dates = obs.index.union(sim.index)
+    O = obs.reindex(index=dates, columns=list(stations[ID_COL])).to_numpy(dtype=np.float64).T
+    S = sim.reindex(index=dates, columns=list(stations[NHD_COL])).to_numpy(dtype=np.float64).T
+    return pd.DataFrame(evaluate(O, S), index=list(stations[ID_COL]))[METRICS]
+
+
+def station_table(stations):
+    """
+    id, NHD_id and state of each distinct station as strings.
+    """
+    return stations[[ID_COL, NHD_COL, STATE_COL]].dropna().astype(str).drop_duplicates(subset=ID_COL)
+
+
+def score_stations(storage, stations, model_id, startdate, enddate, cache=None):
+    """
+    Score every station against one model in a single batched pass.
+
+    Observed and modeled series are read per state (one columnar read each, or concurrent per-station reads for
+    states without a store), aligned into (stations x days) matrices and scored together with metrics.evaluate.
+
+    Args:
+        storage (Storage): storage backend holding the series.
+        stations (pd.DataFrame): id, NHD_id and state columns of the stations.
+        model_id (str): model to evaluate.
+        startdate (str): first date (YYYY-MM-DD) of the evaluation window.
+        enddate (str): last date (YYYY-MM-DD) of the evaluation window.
+        cache (SeriesCache): optional disk cache used by the per-station reads.
+
+    Returns:
+        pd.DataFrame: one row per station id, one column per metric.
+    """
+    stations = station_table(stations)
+    groups = [(state, group) for state, group in stations.groupby(STATE_COL)]
+
+    #states are read concurrently on the shared fetch pool
+    def read_state(item):
+        state, group = item
+        obs, sim = read_state_series(storage, state, group, model_id, startdate, enddate, cache)
+        return group, obs, sim
+
+    results = fetch_all(read_state, groups)
+
+    scores = [score_matrix(group, obs, sim) for group, obs, sim in results]
+    if len(scores) == 0:
+        return pd.DataFrame(columns=METRICS)
+    return pd.concat(scores)
+
+
+def add_skill(gdf, scores):
+    """
+    Add the KGE, RMSE and skill class of each station as feature properties.
+
+    Args:
+        gdf (gpd.GeoDataFrame): station features with an id column.
+        scores (pd.DataFrame): output of score_stations.
+
+    Returns:
+        gpd.GeoDataFrame: copy of gdf with kge, rmse and skill_class columns.
+    """
+    gdf = gdf.copy()
+    ids = gdf[ID_COL].astype(str)
+    gdf['kge'] = ids.map(scores['kge']).round(2).to_numpy()
+    gdf['rmse'] = ids.map(scores['rmse']).round(0).to_numpy()
+    gdf['skill_class'] = skill_class(gdf['kge'])
+    return gdf
@@ -0,0 +1,57 @@
+"""
+Per-state station layers, the StreamStats GeoJSON of the gauges of a state.
+
+A layer is downloaded with one GET and parsed once per process. Repeat requests are served from an LRU cache and
+revalidated with a conditional GET on the ETag at most every STATION_CACHE_TTL seconds, like cache.CachedObject.
+"""
+import time
+
+from .cache import LRUCache
+from .instrumentation import span
+from .storage import StorageError
+
+
+#parsed per-state station layers, revalidated against the ETag at most every STATION_CACHE_TTL seconds
+STATION_CACHE_SIZE = 16
+STATION_CACHE_TTL = 300
+STATION_LAYERS = LRUCache(maxsize=STATION_CACHE_SIZE)
+
+
+def load_station_layer(json_file, storage):
+    """
+    Load a station GeoJSON with one GET, serving repeat requests from the LRU cache.
+    The returned GeoDataFrame is shared between requests, copy it before adding columns.
+    Errors on the first load are raised, errors on a refresh keep the cached layer.
+
+    Args:
+        json_file (str): object key, e.g. GeoJSON/StreamStats_AL_4326.geojson
+        storage (Storage): storage backend holding the object.
+
+    Returns:
+        gpd.GeoDataFrame: station points in EPSG:4326.
+    """
+    entry = STATION_LAYERS.get(json_file)
+    now = time.monotonic()
+    if entry is not None and now - entry['checked'] < STATION_CACHE_TTL:
+        return entry['gdf']
+
+    #conditional get, the body is only sent when the object changed
+    try:
+        stored = storage.get_if_changed(json_file, entry['etag'] if entry is not None else None)
+    except StorageError as e:
+        if entry is None:
+            raise
+        print(f'Unable to revalidate {json_file}: {e}')
+        stored = None
+    if stored is None:
+        entry['checked'] = now
+        return entry['gdf']
+
+    import geopandas as gpd
+
+    with span('station_geojson.parse'):
+        gdf = gpd.read_file(stored.body, driver='GeoJSON')
+        gdf = gdf.set_crs(crs= 'EPSG:4326', allow_override=True)
+    STATION_LAYERS.set(json_file, {'gdf': gdf, 'etag': stored.etag, 'checked': now})
+
+    return gdf
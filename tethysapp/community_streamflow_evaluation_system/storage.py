@@ -0,0 +1,347 @@
+"""
+Data access layer for the streamflow-app-data object layout.
+
+Every read of the app goes through a storage backend addressed by object key, e.g.
+GeoJSON/StreamStats_AL_4326.geojson. The S3 backend reads the public bucket, the local backend reads a
+directory mirroring the bucket layout, so the app can run next to a disk mirror or without network access.
+
+The backend is selected with the storage_backend ('s3' or 'local') and local_data_root custom settings,
+the CSES_STORAGE_BACKEND and CSES_DATA_ROOT environment variables take precedence, e.g. for the offline
+tools and benchmarks. Mirror the bucket with::
+
+    aws s3 sync --no-sign-request s3://streamflow-app-data /data/streamflow-app-data
+"""
+import io
+import os
+import threading
+from collections import namedtuple
+
+from .instrumentation import record_read
+
+
+BUCKET_NAME = 'streamflow-app-data'
+
+BACKEND_ENV = 'CSES_STORAGE_BACKEND'
+DATA_ROOT_ENV = 'CSES_DATA_ROOT'
+S3_BACKEND = 's3'
+LOCAL_BACKEND = 'local'
+
+#body (binary file-like) and version of an object
+StoredObject = namedtuple('StoredObject', ['body', 'etag'])
+
+#body of a byte range, version and total size of the object
+StoredRange = namedtuple('StoredRange', ['body', 'etag', 'size'])
+
+
+class StorageError(OSError):
+    """
+    An object could not be read from the storage backend.
+    """
+
+
+class ObjectNotFound(StorageError, FileNotFoundError):
+    """
+    The object does not exist in the storage backend.
+    """
+
+
+class Storage:
+    """
+    Read-only object storage addressed by bucket key.
+    """
+
+    name = None
+
+    def get(self, key):
+        """
+        Read an object.
+
+        Returns:
+            StoredObject: body and ETag of the object.
+
+        Raises:
+            ObjectNotFound: the object does not exist.
+            StorageError: the object could not be read.
+        """
+        raise NotImplementedError
+
+    def get_if_changed(self, key, etag):
+        """
+        Read an object only when its ETag differs from etag.
+
+        Returns:
+            StoredObject: the changed object, None when it still has the given ETag.
+        """
+        stored = self.get(key)
+        return None if stored.etag == etag else stored
+
+    def get_range(self, key, start, end):
+        """
+        Read the bytes [start, end) of an object.
+
+        Returns:
+            StoredRange: body of the range, ETag and total size of the object.
+        """
+        raise NotImplementedError
+
+    def etag(self, key):
+        """
+        Version of an object, raises ObjectNotFound when it does not exist.
+        """
+        raise NotImplementedError
+
+    def keys(self, prefix):
+        """
+        Keys of the objects under prefix.
+        """
+        raise NotImplementedError
+
+    def path(self, key):
+        """
+        Location of an object for libraries that open paths themselves, e.g. GDAL.
+        """
+        raise NotImplementedError
+
+    def filesystem(self):
+        """
+        pyarrow filesystem and base path of the object layout, used for ranged reads of Parquet datasets.
+
+        Returns:
+            pyarrow.fs.FileSystem, str: filesystem and the prefix to join keys to.
+        """
+        raise NotImplementedError
+
+    def dataset_path(self, key):
+        fs, base = self.filesystem()
+        return fs, f"{base}/{key.strip('/')}"
+
+
+class S3Backend(Storage):
+    """
+    Unsigned reads of the public app bucket through the shared, pooled boto3 client.
+    """
+
+    name = S3_BACKEND
+
+    def __init__(self, bucket_name=BUCKET_NAME, resource=None):
+        from botocore.exceptions import ClientError
+
+        from .fetch import s3_resource
+
+        #botocore is only imported when the S3 backend is selected
+        self.ClientError = ClientError
+        self.bucket_name = bucket_name
+        self.resource = resource if resource is not None else s3_resource()
+        self.bucket = self.resource.Bucket(bucket_name)
+        self._filesystem = None
+        self._lock = threading.Lock()
+        #GDAL reads the WBD geodatabases from s3:// paths without credentials
+        os.environ.setdefault('AWS_NO_SIGN_REQUEST', 'YES')
+
+    @staticmethod
+    def _error(key, e):
+        code = e.response.get('Error', {}).get('Code')
+        if code in ('404', 'NoSuchKey', 'NotFound'):
+            return ObjectNotFound(f'{key} not found')
+        return StorageError(f'Unable to read {key}: {e}')
+
+    def get(self, key):
+        try:
+            response = self.bucket.Object(key).get()
+        except self.ClientError as e:
+            raise self._error(key, e) from e
+        record_read(response.get('ContentLength'))
+        return StoredObject(response['Body'], response.get('ETag'))
+
+    def get_if_changed(self, key, etag):
+        if etag is None:
+            return self.get(key)
+        try:
+            #conditional get, the body is only sent when the object changed
+            response = self.bucket.Object(key).get(IfNoneMatch=etag)
+        except self.ClientError as e:
+            if e.response.get('Error', {}).get('Code') in ('304', 'NotModified'):
+                return None
+            raise self._error(key, e) from e
+        record_read(response.get('ContentLength'))
+        return StoredObject(response['Body'], response.get('ETag'))
+
+    def get_range(self, key, start, end):
+        try:
+            response = self.bucket.Object(key).get(Range=f'bytes={start}-{end - 1}')
+        except self.ClientError as e:
+            raise self._error(key, e) from e
+        record_read(response.get('ContentLength'))
+        #Content-Range: bytes start-end/size
+        size = int(response.get('ContentRange', '/0').rsplit('/', 1)[-1])
+        return StoredRange(response['Body'], response.get('ETag'), size)
+
+    def etag(self, key):
+        try:
+            return self.bucket.Object(key).e_tag
+        except self.ClientError as e:
+            raise self._error(key, e) from e
+
+    def keys(self, prefix):
+        try:
+            for obj in self.bucket.objects.filter(Prefix=prefix):
+                yield obj.key
+        except self.ClientError as e:
+            raise self._error(prefix, e) from e
+
+    def path(self, key):
+        return f"s3://{self.bucket_name}/{key}"
+
+    def filesystem(self):
+        from .fetch import CONNECT_TIMEOUT, READ_TIMEOUT, RETRIES
+
+        with self._lock:
+            if self._filesystem is None:
+                from pyarrow import fs
+                #anonymous, with the same timeouts and retry budget as the shared boto3 client
+                self._filesystem = fs.S3FileSystem(
+                    anonymous=True,
+                    region=fs.resolve_s3_region(self.bucket_name),
+                    connect_timeout=CONNECT_TIMEOUT,
+                    request_timeout=READ_TIMEOUT,
+                    retry_strategy=fs.AwsStandardS3RetryStrategy(max_attempts=RETRIES['max_attempts']),
+                )
+            return self._filesystem, self.bucket_name
+
+
+class LocalBackend(Storage):
+    """
+    A local directory with the bucket's key layout, e.g. {root}/NWIS/NWIS_sites_AL.parquet.
+    """
+
+    name = LOCAL_BACKEND
+
+    def __init__(self, root):
+        self.root = os.path.abspath(os.path.expanduser(root))
+        if not os.path.isdir(self.root):
+            raise StorageError(f'Local data root {self.root} is not a directory')
+
+    def _path(self, key):
+        path = os.path.normpath(os.path.join(self.root, key))
+        if os.path.commonpath([self.root, path]) != self.root:
+            raise ObjectNotFound(f'{key} is outside of the data root')
+        return path
+
+    def get(self, key):
+        path = self._path(key)
+        try:
+            with open(path, 'rb') as f:
+                body = io.BytesIO(f.read())
+            record_read(body.getbuffer().nbytes)
+            return StoredObject(body, self._etag(path))
+        except FileNotFoundError as e:
+            raise ObjectNotFound(f'{key} not found') from e
+        except OSError as e:
+            raise StorageError(f'Unable to read {key}: {e}') from e
+
+    def get_range(self, key, start, end):
+        path = self._path(key)
+        try:
+            with open(path, 'rb') as f:
+                size = os.fstat(f.fileno()).st_size
+                f.seek(start)
+                body = io.BytesIO(f.read(max(min(end, size) - start, 0)))
+            record_read(body.getbuffer().nbytes)
+            return StoredRange(body, self._etag(path), size)
+        except FileNotFoundError as e:
+            raise ObjectNotFound(f'{key} not found') from e
+        except OSError as e:
+            raise StorageError(f'Unable to read {key}: {e}') from e
+
+    def get_if_changed(self, key, etag):
+        if etag is not None and self.etag(key) == etag:
+            return None
+        return self.get(key)
+
+    @staticmethod
+    def _etag(path):
+        #size and modification time, changes whenever the mirror is synced
+        stat = os.stat(path)
+        return f'"{stat.st_size:x}-{stat.st_mtime_ns:x}"'
+
+    def etag(self, key):
+        path = self._path(key)
+        try:
+            if os.path.isdir(path):
+                raise FileNotFoundError(path)
+            return self._etag(path)
+        except FileNotFoundError as e:
+            raise ObjectNotFound(f'{key} not found') from e
+
+    def keys(self, prefix):
+        directory, start = os.path.split(prefix)
+        base = self._path(directory) if directory else self.root
+        for dirpath, dirnames, filenames in os.walk(base):
+            dirnames.sort()
+            for filename in sorted(filenames):
+                key = os.path.relpath(os.path.join(dirpath, filename), self.root).replace(os.sep, '/')
+                if key.startswith(prefix):
+                    yield key
+
+    def path(self, key):
+        return self._path(key)
+
+    def filesystem(self):
+        from pyarrow import fs
+        return fs.LocalFileSystem(), self.root
+
+
+def create_storage(backend=S3_BACKEND, data_root=None):
+    """
+    Build a storage backend.
+
+    Args:
+        backend (str): 's3' or 'local'.
+        data_root (str): mirror directory of the local backend.
+    """
+    backend = (backend or S3_BACKEND).strip().lower()
+    if backend == S3_BACKEND:
+        return S3Backend()
+    if backend == LOCAL_BACKEND:
+        if not data_root:
+            raise ValueError('The local storage backend needs a data root (local_data_root or CSES_DATA_ROOT)')
+        return LocalBackend(data_root)
+    raise ValueError(f"Unknown storage backend {backend}, expected '{S3_BACKEND}' or '{LOCAL_BACKEND}'")
+
+
+def _settings():
+    #environment first, then the app custom settings when running inside Tethys
+    backend = os.environ.get(BACKEND_ENV)
+    data_root = os.environ.get(DATA_ROOT_ENV)
+    if backend is None:
+        try:
+            from .app import CSES as app
+            backend = app.get_custom_setting('storage_backend')
+            data_root = data_root or app.get_custom_setting('local_data_root')
+        except Exception:
+            backend = None
+    return backend, data_root
+
+
+_STORAGE = None
+_STORAGE_LOCK = threading.Lock()
+
+
+def get_storage():
+    """
+    Process-wide storage backend selected by the settings.
+    """
+    global _STORAGE
+    with _STORAGE_LOCK:
+        if _STORAGE is None:
+            _STORAGE = create_storage(*_settings())
+        return _STORAGE
+
+
+def set_storage(storage):
+    """
+    Replace the process-wide storage backend, None selects it again from the settings on the next use.
+    """
+    global _STORAGE
+    with _STORAGE_LOCK:
+        _STORAGE = storage
@@ -0,0 +1,63 @@
+import os
+import tempfile
+from unittest import mock
+
+from tethys_sdk.testing import TethysTestCase
+
+from ..batch_eval import CHECKPOINT_FILE, RESULT_COLUMNS, checkpoint_dir, run_batch
+from ..benchmark import build_tree
+from ..storage import BACKEND_ENV, DATA_ROOT_ENV, LOCAL_BACKEND, LocalBackend, set_storage
+
+
+class BatchEvalTestCase(TethysTestCase):
+    """
+    Tests for the sharded batch evaluation.
+    """
+
+    def set_up(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.root = os.path.join(self.tmp.name, 'bucket')
+        build_tree(self.root, 4, models=['NWM_v3.0'])
+        set_storage(LocalBackend(self.root))
+        self.out_dir = checkpoint_dir(os.path.join(self.tmp.name, 'checkpoints'), 'NWM_v3.0', '2010-01-01', '2010-12-31')
+
+    def tear_down(self):
+        set_storage(None)
+        self.tmp.cleanup()
+
+    def run_states(self, states, workers=1):
+        messages = []
+        results = run_batch(states, 'NWM_v3.0', '2010-01-01', '2010-12-31', self.out_dir, workers=workers,
+                            log=messages.append)
+        return results, messages
+
+    def test_run_and_resume(self):
+        results, messages = self.run_states(['AL', 'UT', 'XX'])
+        self.assertEqual(list(results.columns), RESULT_COLUMNS)
+        self.assertEqual(len(results), 8)
+        self.assertEqual(set(results['state']), {'AL', 'UT'})
+        #the synthetic series have a few gaps
+        self.assertTrue(results['n'].between(300, 365).all())
+        self.assertTrue(results['kge'].notna().all())
+        #XX has no station layer, its empty checkpoint marks it as done
+        self.assertTrue(os.path.exists(os.path.join(self.out_dir, CHECKPOINT_FILE.format(state='XX'))))
+
+        os.remove(os.path.join(self.out_dir, CHECKPOINT_FILE.format(state='UT')))
+        resumed, messages = self.run_states(['AL', 'UT', 'XX'])
+        self.assertEqual(messages[0], 'Resuming, 2 of 3 states already done')
+        self.assertEqual(len(messages), 2)
+        self.assertTrue(messages[1].startswith('UT: scored 4 stations'))
+        self.assertTrue(resumed.equals(results))
+
+    def test_worker_processes(self):
+        expected, messages = self.run_states(['AL', 'UT'])
+        for state in ('AL', 'UT'):
+            os.remove(os.path.join(self.out_dir, CHECKPOINT_FILE.format(state=state)))
+
+        #the workers select the storage backend from the environment, never the one of this process
+        os.makedirs(os.path.join(self.tmp.name, 'empty'))
+        set_storage(LocalBackend(os.path.join(self.tmp.name, 'empty')))
+        with mock.patch.dict(os.environ, {BACKEND_ENV: LOCAL_BACKEND, DATA_ROOT_ENV: self.root}):
+            results, messages = self.run_states(['AL', 'UT'], workers=2)
+        self.assertEqual(len(messages), 2)
+        self.assertTrue(results.equals(expected))
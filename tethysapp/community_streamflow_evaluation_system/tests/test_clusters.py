@@ -0,0 +1,139 @@
+import json
+import os
+import shutil
+import subprocess
+import unittest
+
+import geopandas as gpd
+import numpy as np
+from shapely.geometry import Point
+from tethys_sdk.testing import TethysTestCase
+
+from ..clusters import CLUSTER_MAX_ZOOM, StationClusters
+from ..skill import SKILL_CLASSES, skill_style_map
+
+
+CLUSTERS_JS = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'public', 'js',
+                           'station_clusters.js')
+
+#minimal OpenLayers styles, the station styles are built from the style maps of the skill layers
+CLUSTER_COLORS_JS = '''
+const fs = require('fs');
+class Fill { constructor(o) { this.o = o || {}; } getColor() { return this.o.color; } }
+class Stroke { constructor(o) { this.o = o || {}; } getColor() { return this.o.color; } }
+class Circle { constructor(o) { this.o = o; } getFill() { return this.o.fill; } getStroke() { return this.o.stroke; } }
+class Style { constructor(o) { this.o = o; } getImage() { return this.o.image; } }
+global.ol = {style: {Style: Style, Circle: Circle, Fill: Fill, Stroke: Stroke, Text: class {}}};
+global.$ = function() {};
+eval(fs.readFileSync(process.argv[1], 'utf8') + '; global.STATION_CLUSTERS = STATION_CLUSTERS;');
+const colors = JSON.parse(process.argv[2]).map(function(style_map) {
+    const circle = style_map.Point['ol.style.Style'].image['ol.style.Circle'];
+    const station = new Style({image: new Circle({
+        fill: new Fill(circle.fill['ol.style.Fill']),
+        stroke: new Stroke(circle.stroke['ol.style.Stroke']),
+    })});
+    const cluster = {get: function(name) { return {cluster: true, count: 12}[name]; }};
+    return STATION_CLUSTERS.cluster_style(station)(cluster, 100).getImage().getFill().getColor();
+});
+console.log(JSON.stringify(colors));
+'''
+
+#minimal map with one cluster layer, the fetches stay pending until the script resolves them
+CLUSTER_PAUSE_JS = '''
+const fs = require('fs');
+const pending = [];
+global.fetch = function(url) {
+    return new Promise(function(resolve) {
+        pending.push(function() { resolve({ok: true, json: function() { return {features: [url]}; }}); });
+    });
+};
+const source = {features: [], clear: function() { this.features = []; },
+                addFeatures: function(features) { this.features = features; }};
+const layer = {tethys_data: {cluster_url: 'clusters/?state_id=AL'}, getSource: function() { return source; }};
+const view = {getZoom: function() { return 6; }, calculateExtent: function() { return [0, 0, 1, 1]; },
+              getProjection: function() { return 'EPSG:3857'; }};
+const map = {getLayers: function() { return [layer]; }, getView: function() { return view; },
+             getSize: function() { return [100, 100]; }};
+global.TETHYS_MAP_VIEW = {getMap: function() { return map; }};
+global.ol = {proj: {transformExtent: function(extent) { return extent; }},
+             format: {GeoJSON: class { readFeatures(geojson) { return geojson.features; } }}};
+global.$ = function() {};
+eval(fs.readFileSync(process.argv[1], 'utf8') + '; global.STATION_CLUSTERS = STATION_CLUSTERS;');
+const settle = function() { return new Promise(function(resolve) { setTimeout(resolve, 0); }); };
+
+(async function() {
+    const result = {};
+    //a response arriving after the pause is dropped
+    STATION_CLUSTERS.refresh();
+    STATION_CLUSTERS.pause();
+    pending.shift()();
+    await settle();
+    result.in_flight = source.features.length;
+    //no requests while paused
+    STATION_CLUSTERS.refresh();
+    result.paused = pending.length;
+    STATION_CLUSTERS.resume();
+    pending.shift()();
+    await settle();
+    result.resumed = source.features.length;
+    console.log(JSON.stringify(result));
+})();
+'''
+
+
+class StationClustersTestCase(TethysTestCase):
+    """
+    Tests for the zoom dependent station clusters.
+    """
+
+    def set_up(self):
+        #two dense groups of stations and one isolated station
+        rng = np.random.default_rng(0)
+        points = [Point(-87.0 + dx, 32.0 + dy) for dx, dy in rng.uniform(0, 0.01, (50, 2))]
+        points += [Point(-86.0 + dx, 34.0 + dy) for dx, dy in rng.uniform(0, 0.01, (30, 2))]
+        points += [Point(-88.0, 35.0)]
+        self.gdf = gpd.GeoDataFrame({
+            'id': [f'{i:08d}' for i in range(len(points))],
+            'skill_class': ['good'] * 40 + ['poor'] * 41,
+        }, geometry=points, crs='EPSG:4326')
+        self.clusters = StationClusters(self.gdf)
+
+    def tear_down(self):
+        pass
+
+    def test_low_zoom_clusters(self):
+        features = self.clusters.query(6)['features']
+        clusters = [f for f in features if f['properties'].get('cluster')]
+        stations = [f for f in features if not f['properties'].get('cluster')]
+        self.assertEqual(sorted(f['properties']['count'] for f in clusters), [30, 50])
+        #the isolated station is sent as a station feature
+        self.assertEqual([f['properties']['id'] for f in stations], ['00000080'])
+
+    def test_high_zoom_stations(self):
+        features = self.clusters.query(CLUSTER_MAX_ZOOM)['features']
+        self.assertEqual(len(features), len(self.gdf))
+        self.assertFalse(any(f['properties'].get('cluster') for f in features))
+
+    def test_bbox_and_group(self):
+        features = self.clusters.query(6, bbox=[-87.5, 31.5, -86.5, 32.5])['features']
+        self.assertEqual([f['properties']['count'] for f in features], [50])
+        features = self.clusters.query(6, group='good')['features']
+        self.assertEqual([f['properties']['count'] for f in features], [40])
+
+    def test_fit_zoom(self):
+        self.assertTrue(0 <= self.clusters.fit_zoom() < CLUSTER_MAX_ZOOM)
+
+    @unittest.skipIf(shutil.which('node') is None, 'node is not installed')
+    def test_cluster_colors(self):
+        #the clusters of each skill layer are drawn in the color of its skill class
+        style_maps = [skill_style_map(color) for name, label, lower, color in SKILL_CLASSES]
+        output = subprocess.run(['node', '-e', CLUSTER_COLORS_JS, '--', CLUSTERS_JS, json.dumps(style_maps)],
+                                capture_output=True, text=True, check=True).stdout
+        self.assertEqual(json.loads(output), [color for name, label, lower, color in SKILL_CLASSES])
+
+    @unittest.skipIf(shutil.which('node') is None, 'node is not installed')
+    def test_cluster_refresh_paused(self):
+        #extent_eval.js pauses the refresh, so moving the map keeps its results in the layers
+        output = subprocess.run(['node', '-e', CLUSTER_PAUSE_JS, '--', CLUSTERS_JS],
+                                capture_output=True, text=True, check=True).stdout
+        self.assertEqual(json.loads(output), {'in_flight': 0, 'paused': 0, 'resumed': 1})
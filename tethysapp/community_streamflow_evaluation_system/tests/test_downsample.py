@@ -0,0 +1,53 @@
+import numpy as np
+import pandas as pd
+from tethys_sdk.testing import TethysTestCase
+
+from ..downsample import MIN_POINTS, downsample, envelope_indices
+
+
+class DownsampleTestCase(TethysTestCase):
+    """
+    Tests for the min/max envelope of the hydrograph traces.
+    """
+
+    def set_up(self):
+        rng = np.random.default_rng(0)
+        self.dates = pd.date_range('1980-01-01', '2020-12-31')
+        self.flow = rng.lognormal(3, 1, len(self.dates))
+
+    def tear_down(self):
+        pass
+
+    def test_short_series_unchanged(self):
+        self.assertEqual(list(envelope_indices(self.flow[:100], 500)), list(range(100)))
+
+    def test_points_capped_and_extremes_kept(self):
+        kept = envelope_indices(self.flow, 500)
+        self.assertLessEqual(len(kept), 500)
+        self.assertTrue(np.all(np.diff(kept) > 0))
+        for position in (0, len(self.flow) - 1, self.flow.argmax(), self.flow.argmin()):
+            self.assertIn(position, kept)
+
+    def test_gaps(self):
+        flow = self.flow.copy()
+        flow[1000:2000] = np.nan
+        kept = envelope_indices(flow, 500)
+        self.assertIn(np.nanargmax(flow), kept)
+        #the gap is still drawn
+        self.assertTrue(np.isnan(flow[kept]).any())
+
+    def test_downsample(self):
+        frame = pd.DataFrame({'USGS_flow': self.flow}, index=self.dates)
+        dates, values = downsample(frame, 'USGS_flow', 1000)
+        self.assertEqual(len(dates), len(values))
+        self.assertLessEqual(len(values), 1000)
+        self.assertEqual(dates[0], '1980-01-01')
+        self.assertEqual(max(values), self.flow.max())
+
+    def test_fewest_points(self):
+        kept = envelope_indices(self.flow, MIN_POINTS)
+        self.assertLessEqual(len(kept), MIN_POINTS)
+        for position in (0, len(self.flow) - 1, self.flow.argmax(), self.flow.argmin()):
+            self.assertIn(position, kept)
+        with self.assertRaises(ValueError):
+            envelope_indices(self.flow, MIN_POINTS - 1)
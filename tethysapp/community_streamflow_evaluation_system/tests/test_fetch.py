@@ -0,0 +1,50 @@
+import threading
+import time
+
+from tethys_sdk.testing import TethysTestCase
+
+from ..fetch import FETCH_WORKERS, fetch_all, run_concurrently
+
+
+class FetchTestCase(TethysTestCase):
+    """
+    Tests for the shared fetch pool.
+    """
+
+    def set_up(self):
+        pass
+
+    def tear_down(self):
+        pass
+
+    def test_results_in_order(self):
+        def read(i):
+            time.sleep(0.01 * (5 - i))
+            return i * i
+        self.assertEqual(fetch_all(read, range(5)), [0, 1, 4, 9, 16])
+
+    def test_reads_overlap(self):
+        start = time.monotonic()
+        fetch_all(lambda i: time.sleep(0.1), range(8))
+        self.assertLess(time.monotonic() - start, 0.5)
+
+    def test_nested_fetches_do_not_block(self):
+        #more outer tasks than workers, each waiting on inner fetches
+        done = threading.Event()
+
+        def outer(i):
+            return sum(fetch_all(lambda j: j, range(4)))
+
+        def run():
+            self.result = fetch_all(outer, range(FETCH_WORKERS * 2))
+            done.set()
+
+        threading.Thread(target=run, daemon=True).start()
+        self.assertTrue(done.wait(10))
+        self.assertEqual(self.result, [6] * FETCH_WORKERS * 2)
+
+    def test_errors_raised(self):
+        def fail():
+            raise ValueError('missing object')
+        with self.assertRaises(ValueError):
+            run_concurrently(lambda: 1, fail)
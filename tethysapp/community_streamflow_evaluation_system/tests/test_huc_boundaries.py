@@ -0,0 +1,63 @@
+import os
+import tempfile
+
+import geopandas as gpd
+import numpy as np
+import shapely
+from tethys_sdk.testing import TethysTestCase
+
+from ..huc_boundaries import BOUNDARIES, BOUNDARY_KEY, DETAILS, detail_for_extent, huc_boundaries, simplify_coverage
+from ..storage import LocalBackend
+
+
+def noisy_units():
+    #two units sharing a wiggly 2000 vertex edge
+    rng = np.random.default_rng(0)
+    y = np.linspace(0, 1, 2000)
+    x = np.cumsum(rng.normal(0, 0.0005, len(y)))
+    x -= np.linspace(x[0], x[-1], len(y))
+    edge = np.column_stack([x, y])
+    left = shapely.Polygon(np.vstack([[(-1, 1), (-1, 0)], edge, [(-1, 1)]])[::-1])
+    right = shapely.Polygon(np.vstack([edge, [(1, 1), (1, 0), (0, 0)]]))
+    return [left, right]
+
+
+class HUCBoundariesTestCase(TethysTestCase):
+    """
+    Tests for the simplified WBD boundary tables.
+    """
+
+    def set_up(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.storage = LocalBackend(self.tmp.name)
+        BOUNDARIES.clear()
+
+    def tear_down(self):
+        BOUNDARIES.clear()
+        self.tmp.cleanup()
+
+    def test_simplify_coverage(self):
+        units = noisy_units()
+        for detail, tolerance in DETAILS:
+            simplified = simplify_coverage(units, tolerance)
+            self.assertTrue(all(shapely.is_valid(simplified)))
+            self.assertLess(shapely.get_num_coordinates(simplified)[0], 2003)
+            #the shared edge is simplified once for both units, no gaps or overlaps
+            self.assertAlmostEqual(simplified[0].intersection(simplified[1]).area, 0.0)
+            self.assertAlmostEqual(shapely.union_all(simplified).area, 2.0)
+
+    def test_detail_for_extent(self):
+        self.assertEqual(detail_for_extent([-125.0, 25.0, -67.0, 49.0]), 'low')
+        self.assertEqual(detail_for_extent([-114.0, 40.0, -110.0, 41.0]), 'medium')
+        self.assertEqual(detail_for_extent([-111.9, 40.6, -111.8, 40.7]), 'high')
+
+    def test_huc_boundaries(self):
+        table = gpd.GeoDataFrame({'huc': ['16020201', '16020202'], 'name': ['A', 'B']},
+                                 geometry=noisy_units(), crs='EPSG:4326')
+        path = os.path.join(self.tmp.name, BOUNDARY_KEY.format(HU='16', level=8, detail='low'))
+        os.makedirs(os.path.dirname(path))
+        table.to_parquet(path, index=False)
+
+        boundaries = huc_boundaries(self.storage, ['16020202', '1602020'], 'low')
+        self.assertEqual(list(boundaries['huc']), ['16020202'])
+        self.assertEqual(boundaries.crs.to_epsg(), 4326)
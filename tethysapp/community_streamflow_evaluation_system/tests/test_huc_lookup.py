@@ -0,0 +1,76 @@
+import os
+import tempfile
+
+import pandas as pd
+from tethys_sdk.testing import TethysTestCase
+
+from ..huc_lookup import _HUC_LOOKUP, HUC_LOOKUP_KEY, HUCGaugeLookup, huc_sites
+from ..storage import LocalBackend
+
+
+TABLE = pd.DataFrame({
+    'huc12': ['031501010101', '031501010102', '031502020201', '160202040101', '160202040102', '189900000001',
+              '190100000001'],
+    'NWIS_site_id': ['02400000', '02400001', '02400002', '10100000', '10100001', '11900000', '15000000'],
+    'state_id': ['AL', 'AL', 'AL', 'UT', 'UT', 'CA', 'AK'],
+})
+
+
+class HUCGaugeLookupTestCase(TethysTestCase):
+    """
+    Tests for the HUC to gauge prefix lookup.
+    """
+
+    def set_up(self):
+        self.lookup = HUCGaugeLookup(TABLE.sample(frac=1, random_state=0))
+        self.tmp = tempfile.TemporaryDirectory()
+        _HUC_LOOKUP.clear()
+
+    def tear_down(self):
+        _HUC_LOOKUP.clear()
+        self.tmp.cleanup()
+
+    def site_ids(self, huc_ids):
+        return sorted(self.lookup.sites(huc_ids)['NWIS_site_id'])
+
+    def test_levels(self):
+        self.assertEqual(self.site_ids(['03']), ['02400000', '02400001', '02400002'])
+        self.assertEqual(self.site_ids(['0315']), ['02400000', '02400001', '02400002'])
+        self.assertEqual(self.site_ids(['03150101']), ['02400000', '02400001'])
+        self.assertEqual(self.site_ids(['031501010102']), ['02400001'])
+
+    def test_mixed_levels(self):
+        self.assertEqual(self.site_ids(['03150202', '16', '031501010101', '0315']),
+                         ['02400000', '02400001', '02400002', '10100000', '10100001'])
+        self.assertEqual(list(self.lookup.sites(['1602']).columns), ['NWIS_site_id', 'state_id'])
+
+    def test_end_of_range(self):
+        self.assertEqual(self.site_ids(['1899']), ['11900000'])
+        self.assertEqual(self.site_ids(['19']), ['15000000'])
+        self.assertEqual(self.site_ids(['1901000000019']), [])
+
+    def test_unknown_and_empty(self):
+        self.assertEqual(self.site_ids(['99']), [])
+        self.assertEqual(self.site_ids(['0316']), [])
+        self.assertEqual(self.site_ids(['', '  ']), [])
+        self.assertEqual(self.site_ids([]), [])
+
+    def test_fallback_without_table(self):
+        storage = LocalBackend(self.tmp.name)
+        fallback_calls = []
+
+        def fallback(huc_ids):
+            fallback_calls.append(huc_ids)
+            return TABLE[['NWIS_site_id', 'state_id']].iloc[:1]
+
+        sites = huc_sites(storage, ['0315'], fallback)
+        self.assertEqual(fallback_calls, [['0315']])
+        self.assertEqual(list(sites['NWIS_site_id']), ['02400000'])
+
+        path = os.path.join(self.tmp.name, HUC_LOOKUP_KEY)
+        os.makedirs(os.path.dirname(path))
+        TABLE.to_csv(path, index=False)
+        _HUC_LOOKUP.clear()
+        sites = huc_sites(storage, ['0315'], fallback)
+        self.assertEqual(len(fallback_calls), 1)
+        self.assertEqual(len(sites), 3)
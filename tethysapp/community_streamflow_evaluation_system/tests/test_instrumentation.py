@@ -0,0 +1,52 @@
+import os
+import tempfile
+
+from tethys_sdk.testing import TethysTestCase
+
+from ..fetch import fetch_all
+from ..instrumentation import BYTES_READ, OBJECTS_READ, STAGE_CALLS, STAGE_ERRORS, STAGE_SECONDS, render_metrics, span
+from ..storage import LocalBackend
+
+
+class InstrumentationTestCase(TethysTestCase):
+    """
+    Tests for the hot path timing spans and the Prometheus text output.
+    """
+
+    def set_up(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        os.makedirs(os.path.join(self.tmp.name, 'NWIS'))
+        for i in range(3):
+            with open(os.path.join(self.tmp.name, 'NWIS', f'site_{i}.csv'), 'w') as f:
+                f.write('x' * 100)
+        self.storage = LocalBackend(self.tmp.name)
+
+    def tear_down(self):
+        self.tmp.cleanup()
+
+    def test_span_records_duration_and_errors(self):
+        with span('test.ok'):
+            pass
+        with self.assertRaises(ValueError):
+            with span('test.error'):
+                raise ValueError('unreadable object')
+
+        self.assertEqual(STAGE_SECONDS.snapshot('test.ok')['count'], 1)
+        self.assertEqual(STAGE_CALLS.value('test.error'), 1)
+        self.assertEqual(STAGE_ERRORS.value('test.error'), 1)
+        self.assertEqual(STAGE_ERRORS.value('test.ok'), 0)
+
+    def test_pooled_reads_counted_against_span(self):
+        keys = [f'NWIS/site_{i}.csv' for i in range(3)]
+        with span('test.read'):
+            fetch_all(self.storage.get, keys)
+        self.assertEqual(OBJECTS_READ.value('test.read'), 3)
+        self.assertEqual(BYTES_READ.value('test.read'), 300)
+
+    def test_render(self):
+        with span('test.render'):
+            pass
+        text = render_metrics()
+        self.assertIn('# TYPE cses_stage_duration_seconds histogram', text)
+        self.assertIn('cses_stage_duration_seconds_bucket{stage="test.render",le="+Inf"} 1', text)
+        self.assertIn('cses_stage_calls_total{stage="test.render"} 1', text)
@@ -0,0 +1,140 @@
+import os
+import tempfile
+from types import SimpleNamespace
+
+from tethys_sdk.testing import TethysTestCase
+
+from ..layer_cache import LAYER_CACHE, cached_layers, normalize_params, skip_layer_cache
+from ..series_store import VERSIONS
+from ..storage import LocalBackend, set_storage
+
+
+class FakeLayout:
+    layer_cache_params = ('state_id', 'start-date', 'model_id')
+    layer_cache_sources = ()
+
+    def __init__(self):
+        self.builds = 0
+
+    @cached_layers
+    def compose_layers(self, request, map_view, *args, **kwargs):
+        self.builds += 1
+        map_view['view']['extent'] = [-88.0, 30.0, -85.0, 35.0]
+        layer = SimpleNamespace(options={'features': [{'properties': {'state': 'AL'}}]})
+        return [{'id': 'nextgen-features', 'layers': [layer]}]
+
+
+class FileLayout(FakeLayout):
+    layer_cache_params = ('upstream_id',)
+
+    def __init__(self, path):
+        super().__init__()
+        self.path = path
+
+    def layer_cache_files(self, request, map_view, *args, **kwargs):
+        return [self.path] if request.GET.get('upstream_id') else []
+
+
+class FallbackLayout(FakeLayout):
+    def __init__(self):
+        super().__init__()
+        self.fail = True
+
+    @cached_layers
+    def compose_layers(self, request, map_view, *args, **kwargs):
+        self.builds += 1
+        try:
+            if self.fail:
+                raise OSError('bucket unavailable')
+            state_id = request.GET.get('state_id')
+        except:
+            skip_layer_cache(request)
+            state_id = 'AL'
+        return [{'id': 'nextgen-features', 'state_id': state_id, 'layers': []}]
+
+
+def request(**params):
+    return SimpleNamespace(GET=params)
+
+
+class LayerCacheTestCase(TethysTestCase):
+    """
+    Tests for the composed layer cache.
+    """
+
+    def set_up(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.stations = os.path.join(self.tmp.name, 'GeoJSON', 'StreamStats_AL_4326.geojson')
+        os.makedirs(os.path.dirname(self.stations))
+        with open(self.stations, 'w') as f:
+            f.write('{"type": "FeatureCollection", "features": []}')
+        set_storage(LocalBackend(self.tmp.name))
+        LAYER_CACHE.clear()
+        VERSIONS.clear()
+
+    def tear_down(self):
+        set_storage(None)
+        LAYER_CACHE.clear()
+        VERSIONS.clear()
+        self.tmp.cleanup()
+
+    def test_normalize_params(self):
+        self.assertEqual(normalize_params(request(huc_ids='[1603, 1602]'), ['huc_ids', 'model_id']),
+                         (('huc_ids', '1602,1603'), ('model_id', None)))
+        self.assertEqual(normalize_params(request(**{'start-date': '[01-01-2019]'}), ['start-date']),
+                         (('start-date', '01-01-2019'),))
+
+    def test_cache_hit(self):
+        layout = FakeLayout()
+        layout.compose_layers(request(state_id='AL', model_id='[NWM_v2.1]'), {'view': {}})
+        map_view = {'view': {}}
+        layer_groups = layout.compose_layers(request(state_id='AL', model_id='NWM_v2.1'), map_view)
+        self.assertEqual(layout.builds, 1)
+        self.assertEqual(map_view['view']['extent'], [-88.0, 30.0, -85.0, 35.0])
+        #the layout appends its custom layer group to the returned list, never to the cached one
+        layer_groups.append({'id': 'custom_layers', 'layers': []})
+        self.assertEqual(len(layout.compose_layers(request(state_id='AL', model_id='NWM_v2.1'), map_view)), 1)
+
+        layout.compose_layers(request(state_id='AL', model_id='NWM_v3.0'), {'view': {}})
+        self.assertEqual(layout.builds, 2)
+
+    def test_source_change(self):
+        layout = FakeLayout()
+        layout.compose_layers(request(state_id='AL'), {'view': {}})
+        with open(self.stations, 'a') as f:
+            f.write('\n')
+        os.utime(self.stations, (1, 1))
+        #object versions are cached, a change shows up once they expire
+        layout.compose_layers(request(state_id='AL'), {'view': {}})
+        self.assertEqual(layout.builds, 1)
+        VERSIONS.clear()
+        layout.compose_layers(request(state_id='AL'), {'view': {}})
+        self.assertEqual(layout.builds, 2)
+
+    def test_file_change(self):
+        network = os.path.join(self.tmp.name, 'flowpath_edge_list.json')
+        with open(network, 'w') as f:
+            f.write('[]')
+        layout = FileLayout(network)
+        layout.compose_layers(request(upstream_id='wb-1'), {'view': {}})
+        layout.compose_layers(request(upstream_id='wb-1'), {'view': {}})
+        self.assertEqual(layout.builds, 1)
+        #local files are checked on every request, without waiting for the object versions to expire
+        os.utime(network, (1, 1))
+        layout.compose_layers(request(upstream_id='wb-1'), {'view': {}})
+        self.assertEqual(layout.builds, 2)
+
+    def test_fallback_not_cached(self):
+        layout = FallbackLayout()
+        self.assertEqual(layout.compose_layers(request(state_id='UT'), {'view': {}})[0]['state_id'], 'AL')
+        #the next request builds again and caches the layers it asked for
+        layout.fail = False
+        self.assertEqual(layout.compose_layers(request(state_id='UT'), {'view': {}})[0]['state_id'], 'UT')
+        self.assertEqual(layout.compose_layers(request(state_id='UT'), {'view': {}})[0]['state_id'], 'UT')
+        self.assertEqual(layout.builds, 2)
+
+        #without parameters the default map is the requested one
+        layout.fail = True
+        layout.compose_layers(request(), {'view': {}})
+        layout.compose_layers(request(), {'view': {}})
+        self.assertEqual(layout.builds, 3)
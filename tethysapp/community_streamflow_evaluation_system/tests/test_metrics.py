@@ -0,0 +1,59 @@
+import math
+
+import numpy as np
+from tethys_sdk.testing import TethysTestCase
+
+from ..metrics import evaluate
+
+
+class MetricsTestCase(TethysTestCase):
+    """
+    Tests for the vectorized model skill metrics.
+    """
+
+    def set_up(self):
+        self.obs = np.array([10.0, 20.0, 30.0, 40.0])
+        self.sim = np.array([12.0, 18.0, 33.0, 37.0])
+
+    def tear_down(self):
+        pass
+
+    def test_single_site(self):
+        skill = evaluate(self.obs, self.sim)
+        self.assertEqual(skill['n'], 4)
+        self.assertAlmostEqual(skill['rmse'], math.sqrt((4 + 4 + 9 + 9) / 4))
+        self.assertAlmostEqual(skill['max_error'], 3.0)
+        self.assertAlmostEqual(skill['pbias'], 0.0)
+        self.assertAlmostEqual(skill['beta'], 1.0)
+        self.assertAlmostEqual(skill['nse'], 1 - 26 / 500)
+        self.assertAlmostEqual(skill['mape'], 100 * (0.2 + 0.1 + 0.1 + 0.075) / 4)
+
+    def test_perfect_model(self):
+        skill = evaluate(self.obs, self.obs)
+        self.assertAlmostEqual(skill['kge'], 1.0)
+        self.assertAlmostEqual(skill['nse'], 1.0)
+        self.assertAlmostEqual(skill['r2'], 1.0)
+        self.assertAlmostEqual(skill['rmse'], 0.0)
+
+    def test_kge_components(self):
+        skill = evaluate(self.obs, self.sim)
+        r = np.corrcoef(self.obs, self.sim)[0, 1]
+        alpha = np.std(self.sim) / np.std(self.obs)
+        beta = self.sim.sum() / self.obs.sum()
+        self.assertAlmostEqual(skill['r'], r)
+        self.assertAlmostEqual(skill['alpha'], alpha)
+        self.assertAlmostEqual(skill['kge'], 1 - math.sqrt((r - 1) ** 2 + (alpha - 1) ** 2 + (beta - 1) ** 2))
+
+    def test_many_sites_with_gaps(self):
+        obs = np.vstack([self.obs, self.obs, np.full(4, np.nan)])
+        sim = np.vstack([self.sim, self.sim, self.sim])
+        sim[1, 0] = np.nan
+        skill = evaluate(obs, sim)
+        self.assertEqual(list(skill['n']), [4, 3, 0])
+        self.assertAlmostEqual(skill['kge'][1], evaluate(self.obs[1:], self.sim[1:])['kge'])
+        self.assertTrue(np.isnan(skill['kge'][2]))
+        self.assertTrue(np.isnan(skill['max_error'][2]))
+
+    def test_shape_mismatch(self):
+        with self.assertRaises(ValueError):
+            evaluate(self.obs, self.sim[:3])
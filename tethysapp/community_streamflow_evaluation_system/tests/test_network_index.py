@@ -0,0 +1,50 @@
+from tethys_sdk.testing import TethysTestCase
+
+from ..network_index import Crosswalk, FlowNetwork, upstream_gages, upstream_selection
+
+
+#two headwater reaches joining at nex-3 and draining to wb-3
+EDGES = [
+    {'id': 'wb-1', 'toid': 'nex-3'},
+    {'id': 'wb-2', 'toid': 'nex-3'},
+    {'id': 'nex-3', 'toid': 'wb-3'},
+    {'id': 'wb-3', 'toid': 'nex-4'},
+    {'id': 'nex-4', 'toid': 'wb-4'},
+]
+
+
+class FlowNetworkTestCase(TethysTestCase):
+    """
+    Tests for the CSR hydrofabric network index.
+    """
+
+    def set_up(self):
+        self.network = FlowNetwork.from_edge_list(EDGES)
+        self.crosswalk = Crosswalk({'wb-1': ['01000001'], 'wb-3': ['01000003'], 'wb-4': ['01000004', '01000003']})
+
+    def tear_down(self):
+        pass
+
+    def test_upstream(self):
+        self.assertEqual(len(self.network), 6)
+        self.assertEqual(self.network.upstream('wb-3'), ['wb-3', 'nex-3', 'wb-1', 'wb-2'])
+        self.assertEqual(self.network.upstream('wb-1', include_start=False), [])
+
+    def test_downstream(self):
+        self.assertEqual(self.network.downstream('wb-2', include_start=False), ['nex-3', 'wb-3', 'nex-4', 'wb-4'])
+
+    def test_unknown_id(self):
+        with self.assertRaises(KeyError):
+            self.network.upstream('wb-99')
+
+    def test_upstream_gages(self):
+        self.assertEqual(upstream_gages(self.network, self.crosswalk, 'wb-3'), ['01000003', '01000001'])
+        #a gauge id starts from every waterbody it is crosswalked to
+        self.assertEqual(upstream_gages(self.network, self.crosswalk, '01000003'), ['01000003', '01000004', '01000001'])
+
+    def test_upstream_selection(self):
+        self.assertEqual(upstream_selection(self.network, self.crosswalk, 'wb-3'), (['01000003', '01000001'], None))
+        self.assertEqual(upstream_selection(self.network, self.crosswalk, 'wb-99'),
+                         ([], 'wb-99 is not in the hydrofabric network'))
+        self.assertEqual(upstream_selection(self.network, self.crosswalk, 'wb-2'),
+                         ([], 'No USGS gauges upstream of wb-2'))
@@ -0,0 +1,59 @@
+import os
+import tempfile
+
+import numpy as np
+import pandas as pd
+from tethys_sdk.testing import TethysTestCase
+
+from ..network_index import Crosswalk, FlowNetwork
+from ..nextgen import CMS_TO_CFS, gage_series, outlet_pairs
+
+
+#wb-1 drains through nex-2 to wb-2, both crosswalked to the same gauge, wb-3 has its own gauge
+EDGES = [
+    {'id': 'wb-1', 'toid': 'nex-2'},
+    {'id': 'nex-2', 'toid': 'wb-2'},
+    {'id': 'wb-2', 'toid': 'nex-4'},
+    {'id': 'wb-3', 'toid': 'nex-4'},
+    {'id': 'nex-4', 'toid': 'wb-4'},
+]
+TIMES = pd.date_range('2022-08-24', periods=48, freq='h')
+
+
+class NextGenTestCase(TethysTestCase):
+    """
+    Tests for the NextGen run evaluation.
+    """
+
+    def set_up(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.network = FlowNetwork.from_edge_list(EDGES)
+        self.crosswalk = Crosswalk({'wb-1': ['01000002'], 'wb-2': ['01000002'], 'wb-3': ['01000003']})
+
+    def tear_down(self):
+        self.tmp.cleanup()
+
+    def test_outlet_pairs(self):
+        pairs = outlet_pairs(self.crosswalk, self.network)
+        self.assertEqual(dict(zip(pairs['gage'], pairs['waterbody'])), {'01000002': 'wb-2', '01000003': 'wb-3'})
+
+    def test_troute_output(self):
+        frames = [pd.DataFrame({'location_id': n, 'time': TIMES, 'value': float(n), 'variable_name': variable})
+                  for n in (1, 2, 3) for variable in ('flow', 'depth')]
+        pd.concat(frames).to_parquet(os.path.join(self.tmp.name, 'troute_output_202208240000.parquet'))
+
+        series = gage_series(self.tmp.name, self.crosswalk, self.network)
+        self.assertEqual(list(series.index.strftime('%Y-%m-%d')), ['2022-08-24', '2022-08-25'])
+        #m3/s of the outlet waterbody to cfs, the depth rows are not read
+        np.testing.assert_allclose(series['01000002'], 2 * CMS_TO_CFS)
+        np.testing.assert_allclose(series['01000003'], 3 * CMS_TO_CFS)
+
+    def test_nexus_output(self):
+        for nexus, flow in (('2', 1.0), ('4', 5.0)):
+            with open(os.path.join(self.tmp.name, f'nex-{nexus}_output.csv'), 'w') as f:
+                f.writelines(f'{i}, {time}, {flow}\n' for i, time in enumerate(TIMES))
+
+        series = gage_series(self.tmp.name, self.crosswalk, self.network)
+        #both gauges drain to nex-4
+        np.testing.assert_allclose(series['01000002'], 5 * CMS_TO_CFS)
+        np.testing.assert_allclose(series['01000003'], 5 * CMS_TO_CFS)
@@ -0,0 +1,64 @@
+import os
+import tempfile
+from unittest import mock
+
+import numpy as np
+import pandas as pd
+from tethys_sdk.testing import TethysTestCase
+
+from .. import scorecards
+from ..scorecards import (FULL_RECORD, SCORECARD_STORE, SCORECARDS, build_scorecard, scorecard_scores,
+                          scorecard_skill, window_label, write_scorecard)
+from ..storage import LocalBackend
+
+
+class ScorecardsTestCase(TethysTestCase):
+    """
+    Tests for the precomputed skill scorecards.
+    """
+
+    def set_up(self):
+        dates = pd.date_range('2018-10-01', '2019-09-30', name='Datetime')
+        flow = np.linspace(1.0, 10.0, len(dates))
+        self.obs = pd.DataFrame({'01': flow, '02': flow}, index=dates)
+        self.sim = pd.DataFrame({'101': flow, '102': flow[::-1]}, index=dates)
+        self.stations = pd.DataFrame({
+            'id': ['01', '02', '03'],
+            'NHD_id': ['101', '102', '103'],
+            'state': ['AL', 'AL', 'UT'],
+        })
+        self.tmp = tempfile.TemporaryDirectory()
+        SCORECARDS.clear()
+
+    def tear_down(self):
+        self.tmp.cleanup()
+        SCORECARDS.clear()
+
+    def test_window_label(self):
+        self.assertEqual(window_label('2018-10-01', '2019-09-30'), 'WY2019')
+        self.assertEqual(window_label('1980-01-01', '2020-12-30'), FULL_RECORD)
+        self.assertIsNone(window_label('2019-01-01', '2019-06-11'))
+        self.assertIsNone(window_label('1960-10-01', '1961-09-30'))
+
+    def test_build_and_lookup(self):
+        with mock.patch.object(scorecards, 'read_state_series', return_value=(self.obs, self.sim)):
+            card = build_scorecard(None, 'AL', self.stations[self.stations.state == 'AL'], models=['NWM_v2.1'])
+
+        self.assertEqual(set(card['window']), {'WY2019', FULL_RECORD})
+        write_scorecard(card, os.path.join(self.tmp.name, SCORECARD_STORE.format(state='AL')))
+        storage = LocalBackend(self.tmp.name)
+
+        scores, missing = scorecard_scores(storage, self.stations, 'NWM_v2.1', '2018-10-01', '2019-09-30')
+        self.assertAlmostEqual(scores.loc['01', 'kge'], 1.0, places=5)
+        self.assertLess(scores.loc['02', 'kge'], 0)
+        #UT has no scorecard, its station is left for on-the-fly scoring
+        self.assertEqual(list(missing['id']), ['03'])
+
+        skill = scorecard_skill(storage, 'AL', '01', 'NWM_v2.1', '2018-10-01', '2019-09-30')
+        self.assertEqual(skill['n'], len(self.obs))
+        self.assertIsNone(scorecard_skill(storage, 'AL', '01', 'NWM_v2.1', '2019-01-01', '2019-02-01'))
+
+    def test_custom_window_not_looked_up(self):
+        scores, missing = scorecard_scores(None, self.stations, 'NWM_v2.1', '2019-01-01', '2019-06-11')
+        self.assertEqual(len(scores), 0)
+        self.assertEqual(len(missing), 3)
@@ -0,0 +1,47 @@
+import json
+
+import geopandas as gpd
+import numpy as np
+from shapely.geometry import Point
+from tethys_sdk.testing import TethysTestCase
+
+from ..serialize import dumps, station_geojson
+
+
+class StationGeojsonTestCase(TethysTestCase):
+    """
+    Tests for the lean station GeoJSON.
+    """
+
+    def set_up(self):
+        self.gdf = gpd.GeoDataFrame({
+            'id': ['02453000', '02450250'],
+            'NHD_id': ['18217526', '18216914'],
+            'state': ['AL', 'AL'],
+            'NWIS_sitename': ['Site A', 'Site B'],
+            'drainage_area': [120.5, 88.0],
+            'kge': [0.61, np.nan],
+        }, geometry=[Point(-87.123456789, 31.987654321), Point(-86.5, 32.25)], crs='EPSG:4326')
+
+    def tear_down(self):
+        pass
+
+    def test_properties_and_precision(self):
+        geojson = station_geojson(self.gdf)
+        feature = geojson['features'][0]
+        self.assertEqual(feature['id'], '02453000')
+        self.assertEqual(feature['geometry'], {'type': 'Point', 'coordinates': [-87.12346, 31.98765]})
+        self.assertEqual(feature['properties'], {'id': '02453000', 'name': 'Site A', 'NHD_id': '18217526',
+                                                 'state': 'AL', 'kge': 0.61})
+        #missing values are null
+        self.assertIsNone(geojson['features'][1]['properties']['kge'])
+        self.assertIn('crs', geojson)
+
+    def test_dumps(self):
+        geojson = station_geojson(self.gdf)
+        self.assertEqual(json.loads(dumps(geojson)), geojson)
+
+    def test_no_id_column(self):
+        geojson = station_geojson(self.gdf.drop(columns=['id']), properties=['name'])
+        self.assertNotIn('id', geojson['features'][0])
+        self.assertEqual(geojson['features'][0]['properties'], {'name': 'Site A'})
@@ -0,0 +1,53 @@
+import tempfile
+
+import numpy as np
+import pandas as pd
+from tethys_sdk.testing import TethysTestCase
+
+from ..series_cache import SIZE_FILE, SeriesCache
+
+
+class SeriesCacheTestCase(TethysTestCase):
+    """
+    Tests for the disk-backed series cache.
+    """
+
+    def set_up(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        dates = pd.date_range('2019-01-01', periods=1000, name='Datetime')
+        self.frame = pd.DataFrame({'flow': np.arange(1000.0)}, index=dates)
+
+    def tear_down(self):
+        self.tmp.cleanup()
+
+    def test_round_trip(self):
+        cache = SeriesCache(self.tmp.name)
+        cache.put('a', self.frame, version='1')
+        np.testing.assert_allclose(cache.get('a', version='1')['flow'], self.frame['flow'])
+        self.assertIsNone(cache.get('a', version='2'))
+
+    def test_budget_shared_by_workers(self):
+        #two workers on the same folder, each entry is about 12 kB
+        first = SeriesCache(self.tmp.name, max_bytes=30000)
+        second = SeriesCache(self.tmp.name, max_bytes=30000)
+        for i in range(3):
+            for name, cache in (('first', first), ('second', second)):
+                cache.put(f'{name}-{i}', self.frame)
+                self.assertLessEqual(cache.size(), 30000)
+        self.assertIsNotNone(second.get('second-2'))
+        self.assertIsNone(first.get('first-0'))
+
+        first.clear()
+        self.assertEqual(second.size(), 0)
+
+    def test_overwrite_keeps_size(self):
+        cache = SeriesCache(self.tmp.name, max_bytes=30000)
+        cache.put('a', self.frame, version='1')
+        cache.put('b', self.frame, version='1')
+        #replacing an entry counts only the difference, so it never evicts the others
+        for version in range(2, 6):
+            cache.put('a', self.frame.iloc[:500 + version], version=str(version))
+            with open(f'{self.tmp.name}/{SIZE_FILE}') as f:
+                self.assertEqual(int(f.read()), cache.size())
+        self.assertIsNotNone(cache.get('b', version='1'))
+        self.assertEqual(len(cache.get('a', version='5')), 505)
@@ -0,0 +1,104 @@
+import os
+import tempfile
+
+import numpy as np
+import pandas as pd
+from tethys_sdk.testing import TethysTestCase
+
+from ..series_cache import SeriesCache
+from ..series_store import (DATASETS, MODEL_FRAMES, MODEL_ID_COL, MODEL_STORE, OBS_COL, OBS_ID_COL, OBS_STORE, TIME_COL,
+                            VERSIONS, convert_models, convert_observations, read_models, read_observations, read_store,
+                            store_version, write_store, write_version)
+from ..storage import LocalBackend
+
+
+class SeriesStoreTestCase(TethysTestCase):
+    """
+    Tests for the columnar series store, its converters and the disk cached reads.
+    """
+
+    def set_up(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.root = self.tmp.name
+        self.storage = LocalBackend(self.root)
+        DATASETS.clear()
+        MODEL_FRAMES.clear()
+        VERSIONS.clear()
+
+    def tear_down(self):
+        self.tmp.cleanup()
+
+    def write_csv(self, key, value_col, dates, values):
+        path = os.path.join(self.root, key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        pd.DataFrame({TIME_COL: dates.strftime('%Y-%m-%d'), value_col: values}).to_csv(path, index=False)
+
+    def test_read_store_pushdown(self):
+        dates = pd.date_range('2017-01-01', '2019-12-31')
+        frame = pd.concat([pd.DataFrame({OBS_ID_COL: site_id, TIME_COL: dates, OBS_COL: np.arange(len(dates)) + offset})
+                           for site_id, offset in (('01', 0), ('02', 10000))])
+        path = os.path.join(self.root, OBS_STORE.format(state='AL'))
+        write_store(frame, path, OBS_ID_COL)
+        self.assertEqual(sorted(os.listdir(path)), ['year=2017', 'year=2018', 'year=2019'])
+
+        store = read_store(self.storage, OBS_STORE.format(state='AL'), OBS_ID_COL, ['02'], [OBS_COL],
+                           '2018-12-30', '2019-01-02')
+        self.assertEqual(list(store[OBS_ID_COL].unique()), ['02'])
+        self.assertEqual(list(store[TIME_COL]), list(pd.date_range('2018-12-30', '2019-01-02')))
+        self.assertEqual(list(store[OBS_COL]), [10728.0, 10729.0, 10730.0, 10731.0])
+
+        #a removed partition is never read by a window outside of it
+        for name in os.listdir(os.path.join(path, 'year=2017')):
+            os.remove(os.path.join(path, 'year=2017', name))
+        DATASETS.clear()
+        store = read_store(self.storage, OBS_STORE.format(state='AL'), OBS_ID_COL, ['01'], [OBS_COL], '2019-01-01')
+        self.assertEqual(len(store), 365)
+        self.assertEqual(len(read_store(self.storage, OBS_STORE.format(state='AL'), OBS_ID_COL, ['03'], [OBS_COL])), 0)
+
+    def test_convert_observations(self):
+        dates = pd.date_range('2018-01-01', '2019-12-31')
+        self.write_csv('NWIS/NWIS_sites_AL.h5/NWIS_01.csv', OBS_COL, dates, np.arange(len(dates)))
+        self.write_csv('NWIS/NWIS_sites_AL.h5/NWIS_02.csv', OBS_COL, dates[:10], np.ones(10))
+
+        self.assertEqual(convert_observations(self.storage, 'AL', self.root), 2)
+        self.assertEqual(convert_observations(self.storage, 'UT', self.root), 0)
+        self.assertTrue(os.path.exists(os.path.join(self.root, OBS_STORE.format(state='AL'), '_version.json')))
+
+        USGS_df = read_observations(self.storage, 'AL', '01', '2019-01-01', '2019-01-03')
+        self.assertEqual(list(USGS_df[OBS_COL]), [365.0, 366.0, 367.0])
+        self.assertEqual(len(read_observations(self.storage, 'AL', '02')), 10)
+
+    def test_convert_models(self):
+        dates = pd.date_range('2019-01-01', '2019-12-31')
+        self.write_csv('NWM_v2.1/NHD_segments_AL.h5/NWM_v2.1_100.csv', 'NWM_flow', dates, np.arange(365))
+        self.write_csv('NWM_v3.0/NHD_segments_AL.h5/NWM_v3.0_100.csv', 'NWM_flow', dates, np.arange(365) * 2)
+        self.write_csv('LSTM/NHD_segments_AL.h5/LSTM_200.csv', 'LST_flow', dates, np.ones(365))
+
+        self.assertEqual(convert_models(self.storage, 'AL', self.root), 2)
+        store = read_store(self.storage, MODEL_STORE.format(state='AL'), MODEL_ID_COL, ['100'], ['NWM_v3.0'])
+        self.assertEqual(len(store), 365)
+
+        model_df = read_models(self.storage, 'AL', '100', startdate='2019-02-01', enddate='2019-02-02')
+        self.assertEqual(list(model_df.columns), ['NWM_v2.1', 'NWM_v3.0'])
+        self.assertEqual(list(model_df['NWM_v3.0']), [62.0, 64.0])
+        self.assertEqual(list(read_models(self.storage, 'AL', '200').columns), ['LSTM'])
+
+    def test_open_ended_cached_read(self):
+        #the record reaches past the last year of the evaluation record
+        dates = pd.date_range('2019-12-30', '2022-01-02')
+        frame = pd.DataFrame({OBS_ID_COL: '01', TIME_COL: dates, OBS_COL: np.arange(len(dates))})
+        path = os.path.join(self.root, OBS_STORE.format(state='AL'))
+        write_store(frame, path, OBS_ID_COL)
+        write_version(path)
+        cache = SeriesCache(os.path.join(self.root, 'cache'))
+
+        uncached = read_observations(self.storage, 'AL', '01')
+        for startdate, enddate in ((None, None), ('2021-12-31', None), (None, '2020-01-01')):
+            cached = read_observations(self.storage, 'AL', '01', startdate, enddate, cache)
+            pd.testing.assert_frame_equal(cached, uncached.loc[startdate:enddate], check_freq=False)
+        self.assertEqual(len(cached), 3)
+
+        #a closed window still goes through the cache
+        window = read_observations(self.storage, 'AL', '01', '2020-12-31', '2021-01-01', cache)
+        self.assertEqual(list(window[OBS_COL]), [367.0, 368.0])
+        self.assertIsNotNone(cache.get('obs/AL/01/2021', store_version(self.storage, OBS_STORE.format(state='AL'))))
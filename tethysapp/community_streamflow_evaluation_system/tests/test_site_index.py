@@ -0,0 +1,60 @@
+import io
+
+from tethys_sdk.testing import TethysTestCase
+
+from ..site_index import StreamStatsIndex, normalize_site_ids
+
+
+STREAMSTATS_CSV = """Unnamed: 0,NWIS_site_id,NWIS_sitename,dec_lat_va,dec_long_va,state_id,NHD_reachcode
+0,2453000,Site A,33.1,-87.1,AL,10001
+1,10126000,Site B,41.5,-112.0,UT,10002
+2,2453000,Site A,33.1,-87.1,AL,10001
+3,10171000,Site C,40.7,-111.9,UT,10003
+"""
+
+
+class SiteIndexTestCase(TethysTestCase):
+    """
+    Tests for the process-wide StreamStats site index.
+    """
+
+    def set_up(self):
+        self.index = StreamStatsIndex.from_csv(io.StringIO(STREAMSTATS_CSV), etag='"abc"')
+
+    def tear_down(self):
+        pass
+
+    def test_normalize_site_ids(self):
+        self.assertEqual(list(normalize_site_ids([2453000, '10126000', ' 2453000 '])),
+                         ['02453000', '10126000', '02453000'])
+
+    def test_duplicates_dropped(self):
+        self.assertEqual(len(self.index), 3)
+        self.assertIn('02453000', self.index)
+        self.assertIn(2453000, self.index)
+
+    def test_lookup_keeps_request_order(self):
+        sites = self.index.lookup(['10171000', '2453000', '99999999', '10171000'])
+        self.assertEqual(list(sites.index), ['10171000', '02453000'])
+        self.assertEqual(list(sites['state_id']), ['UT', 'AL'])
+
+    def test_states(self):
+        self.assertEqual(self.index.states(['10126000', '10171000', '02453000']), ['UT', 'AL'])
+
+    def test_gdf(self):
+        gdf = self.index.gdf
+        self.assertEqual(len(gdf), 3)
+        self.assertAlmostEqual(gdf.geometry.iloc[0].x, -87.1)
+
+    def test_within_bbox(self):
+        sites = self.index.within_bbox([-112.5, 40.0, -111.5, 42.0])
+        self.assertEqual(sorted(sites.index), ['10126000', '10171000'])
+        self.assertEqual(len(self.index.within_bbox([-80.0, 20.0, -70.0, 30.0])), 0)
+
+    def test_within_radius(self):
+        #Site C is 0 km from the center, Site B about 90 km north west of it
+        sites = self.index.within_radius(-111.9, 40.7, 100)
+        self.assertEqual(list(sites.index), ['10171000', '10126000'])
+        self.assertAlmostEqual(sites['distance_km'].iloc[0], 0.0)
+        self.assertGreater(sites['distance_km'].iloc[1], 80)
+        self.assertEqual(list(self.index.within_radius(-111.9, 40.7, 50).index), ['10171000'])
@@ -0,0 +1,55 @@
+from unittest import mock
+
+import numpy as np
+import pandas as pd
+from tethys_sdk.testing import TethysTestCase
+
+from .. import skill
+from ..skill import add_skill, score_stations, skill_class
+
+
+class SkillTestCase(TethysTestCase):
+    """
+    Tests for the batched station scoring behind the skill-colored map.
+    """
+
+    def set_up(self):
+        dates = pd.date_range('2019-01-01', periods=5, name='Datetime')
+        self.stations = pd.DataFrame({
+            'id': ['01', '02', '03'],
+            'NHD_id': ['101', '102', '103'],
+            'state': ['AL', 'AL', 'AL'],
+        })
+        self.obs = pd.DataFrame({
+            '01': [1.0, 2.0, 3.0, 4.0, 5.0],
+            '02': [1.0, 2.0, 3.0, 4.0, 5.0],
+        }, index=dates)
+        self.sim = pd.DataFrame({
+            '101': [1.0, 2.0, 3.0, 4.0, 5.0],
+            '102': [5.0, 4.0, 3.0, 2.0, 1.0],
+        }, index=dates)
+
+    def tear_down(self):
+        pass
+
+    def test_skill_class(self):
+        classes = skill_class([0.9, 0.5, 0.2, 0.0, -1.5, np.nan])
+        self.assertEqual(list(classes), ['good', 'good', 'fair', 'fair', 'poor', 'none'])
+
+    def test_score_stations_from_store(self):
+        with mock.patch.object(skill, '_score_state_store', return_value=(self.obs, self.sim)):
+            scores = score_stations(None, self.stations, 'NWM_v2.1', '2019-01-01', '2019-01-05')
+
+        self.assertAlmostEqual(scores.loc['01', 'kge'], 1.0)
+        self.assertLess(scores.loc['02', 'kge'], 0)
+        #station without series is kept with no metrics
+        self.assertEqual(scores.loc['03', 'n'], 0)
+        self.assertTrue(np.isnan(scores.loc['03', 'kge']))
+
+    def test_add_skill(self):
+        with mock.patch.object(skill, '_score_state_store', return_value=(self.obs, self.sim)):
+            scores = score_stations(None, self.stations, 'NWM_v2.1', '2019-01-01', '2019-01-05')
+
+        gdf = add_skill(self.stations, scores)
+        self.assertEqual(list(gdf['skill_class']), ['good', 'poor', 'none'])
+        self.assertNotIn('kge', self.stations.columns)
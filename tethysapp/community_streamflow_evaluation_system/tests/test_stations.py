@@ -0,0 +1,90 @@
+import os
+import tempfile
+from unittest import mock
+
+from tethys_sdk.testing import TethysTestCase
+
+from .. import stations
+from ..cache import LRUCache
+from ..stations import STATION_LAYERS, load_station_layer
+from ..storage import LocalBackend, StorageError
+
+
+FEATURE = '{{"type": "Feature", "properties": {{"id": "{id}"}}, "geometry": {{"type": "Point", "coordinates": [-87.0, 32.0]}}}}'
+
+
+class CountingBackend(LocalBackend):
+    """
+    Local backend counting the object bodies it sends.
+    """
+
+    def __init__(self, root):
+        super().__init__(root)
+        self.gets = 0
+        self.fail = False
+
+    def get(self, key):
+        self.gets += 1
+        return super().get(key)
+
+    def get_if_changed(self, key, etag):
+        if self.fail:
+            raise StorageError('bucket unavailable')
+        return super().get_if_changed(key, etag)
+
+
+class StationLayersTestCase(TethysTestCase):
+    """
+    Tests for the cached station layers.
+    """
+
+    def set_up(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        os.makedirs(os.path.join(self.tmp.name, 'GeoJSON'))
+        self.write('AL', ['01'])
+        self.write('UT', ['02'])
+        self.storage = CountingBackend(self.tmp.name)
+        STATION_LAYERS.clear()
+
+    def tear_down(self):
+        STATION_LAYERS.clear()
+        self.tmp.cleanup()
+
+    def write(self, state, ids):
+        features = ', '.join(FEATURE.format(id=i) for i in ids)
+        path = os.path.join(self.tmp.name, 'GeoJSON', f'StreamStats_{state}_4326.geojson')
+        with open(path, 'w') as f:
+            f.write(f'{{"type": "FeatureCollection", "features": [{features}]}}')
+        return path
+
+    def test_cache_hit(self):
+        gdf = load_station_layer('GeoJSON/StreamStats_AL_4326.geojson', self.storage)
+        self.assertIs(load_station_layer('GeoJSON/StreamStats_AL_4326.geojson', self.storage), gdf)
+        self.assertEqual(self.storage.gets, 1)
+
+    def test_revalidation(self):
+        key = 'GeoJSON/StreamStats_AL_4326.geojson'
+        with mock.patch.object(stations, 'STATION_CACHE_TTL', 0):
+            gdf = load_station_layer(key, self.storage)
+            #unchanged ETag, the parsed layer is kept without sending the body again
+            self.assertIs(load_station_layer(key, self.storage), gdf)
+            self.assertEqual(self.storage.gets, 1)
+
+            path = self.write('AL', ['01', '03'])
+            os.utime(path, (1, 1))
+            changed = load_station_layer(key, self.storage)
+            self.assertEqual(list(changed['id']), ['01', '03'])
+            self.assertEqual(self.storage.gets, 2)
+
+            #a failed refresh serves the cached layer
+            self.storage.fail = True
+            self.assertIs(load_station_layer(key, self.storage), changed)
+        with self.assertRaises(StorageError):
+            load_station_layer('GeoJSON/StreamStats_UT_4326.geojson', self.storage)
+
+    def test_lru(self):
+        with mock.patch.object(stations, 'STATION_LAYERS', LRUCache(maxsize=1)):
+            load_station_layer('GeoJSON/StreamStats_AL_4326.geojson', self.storage)
+            load_station_layer('GeoJSON/StreamStats_UT_4326.geojson', self.storage)
+            load_station_layer('GeoJSON/StreamStats_AL_4326.geojson', self.storage)
+        self.assertEqual(self.storage.gets, 3)
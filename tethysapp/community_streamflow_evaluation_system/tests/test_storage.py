@@ -0,0 +1,103 @@
+import json
+import os
+import tempfile
+
+import pandas as pd
+from tethys_sdk.testing import TethysTestCase
+
+from ..series_store import (CSV_INDEX, CSV_INDEXES, OBS_COL, OBS_CSV, OBS_ID_COL, OBS_STORE, TIME_COL, build_csv_index,
+                            read_observations, write_store, write_version)
+from ..storage import LocalBackend, ObjectNotFound, StorageError, create_storage
+
+
+class LocalBackendTestCase(TethysTestCase):
+    """
+    Tests for the local mirror storage backend.
+    """
+
+    def set_up(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.root = self.tmp.name
+        os.makedirs(os.path.join(self.root, 'GeoJSON'))
+        with open(os.path.join(self.root, 'GeoJSON', 'StreamStats_AL_4326.geojson'), 'w') as f:
+            f.write('{"type": "FeatureCollection", "features": []}')
+        self.storage = LocalBackend(self.root)
+
+    def tear_down(self):
+        self.tmp.cleanup()
+
+    def test_get(self):
+        stored = self.storage.get('GeoJSON/StreamStats_AL_4326.geojson')
+        self.assertIn(b'FeatureCollection', stored.body.read())
+        self.assertEqual(stored.etag, self.storage.etag('GeoJSON/StreamStats_AL_4326.geojson'))
+
+    def test_missing_object(self):
+        with self.assertRaises(ObjectNotFound):
+            self.storage.get('GeoJSON/StreamStats_XX_4326.geojson')
+        with self.assertRaises(ObjectNotFound):
+            self.storage.etag('GeoJSON')
+        #keys outside of the mirror are never read
+        with self.assertRaises(ObjectNotFound):
+            self.storage.get('../outside.csv')
+
+    def test_get_if_changed(self):
+        key = 'GeoJSON/StreamStats_AL_4326.geojson'
+        etag = self.storage.etag(key)
+        self.assertIsNone(self.storage.get_if_changed(key, etag))
+        self.assertIsNotNone(self.storage.get_if_changed(key, '"old"'))
+
+    def test_keys(self):
+        self.assertEqual(list(self.storage.keys('GeoJSON/StreamStats_')), ['GeoJSON/StreamStats_AL_4326.geojson'])
+        self.assertEqual(list(self.storage.keys('NWIS/')), [])
+
+    def test_create_storage(self):
+        self.assertIsInstance(create_storage('local', self.root), LocalBackend)
+        with self.assertRaises(ValueError):
+            create_storage('local')
+        with self.assertRaises(ValueError):
+            create_storage('ftp')
+        with self.assertRaises(StorageError):
+            create_storage('local', os.path.join(self.root, 'missing'))
+
+    def test_read_store_from_mirror(self):
+        dates = pd.date_range('2019-12-30', '2020-01-02')
+        frame = pd.DataFrame({OBS_ID_COL: '02453000', TIME_COL: dates, OBS_COL: [1.0, 2.0, 3.0, 4.0]})
+        path = os.path.join(self.root, OBS_STORE.format(state='AL'))
+        write_store(frame, path, OBS_ID_COL)
+        write_version(path)
+
+        USGS_df = read_observations(self.storage, 'AL', '02453000', '2019-12-31', '2020-01-01')
+        self.assertEqual(list(USGS_df[OBS_COL]), [2.0, 3.0])
+
+    def test_get_range(self):
+        key = 'GeoJSON/StreamStats_AL_4326.geojson'
+        stored = self.storage.get_range(key, 1, 5)
+        self.assertEqual(stored.body.read(), b'"typ')
+        self.assertEqual(stored.size, len(self.storage.get(key).body.read()))
+
+    def test_indexed_csv_reads_window(self):
+        dates = pd.date_range('2017-01-01', '2019-12-31')
+        frame = pd.DataFrame({TIME_COL: dates.strftime('%Y-%m-%d'), OBS_COL: range(len(dates))})
+        key = OBS_CSV.format(state='AL', site_id='02453000')
+        path = os.path.join(self.root, key)
+        os.makedirs(os.path.dirname(path))
+        frame.to_csv(path, index=False)
+        with open(path, 'rb') as f:
+            index = build_csv_index(f.read())
+        self.assertEqual(sorted(index['years']), ['2017', '2018', '2019'])
+        with open(os.path.join(self.root, CSV_INDEX.format(key=key)), 'w') as f:
+            json.dump(index, f)
+        CSV_INDEXES.clear()
+
+        ranges = []
+        get_range = self.storage.get_range
+        self.storage.get_range = lambda key, start, end: ranges.append((start, end)) or get_range(key, start, end)
+        USGS_df = read_observations(self.storage, 'AL', '02453000', '2018-03-01', '2018-03-31')
+        self.assertEqual(list(USGS_df[OBS_COL]), list(range(424, 455)))
+        #only the 2018 rows were read
+        self.assertEqual(ranges, [tuple(index['years']['2018'])])
+
+    def test_unsorted_csv_not_indexed(self):
+        data = b'Datetime,USGS_flow\n2019-01-02,1.0\n2018-01-01,2.0\n'
+        self.assertIsNone(build_csv_index(data))
+        self.assertIsNone(build_csv_index(b'date,flow\n2019-01-01,1.0\n'))
@@ -1,44 +1,85 @@
-import json
+import os
+from urllib.parse import urlencode
 from .app import CSES as app
 import pandas as pd
-import geopandas as gpd
+
+from .cache import LRUCache
+from .clusters import StationClusters
+from .downsample import MIN_POINTS, PLOT_MAX_POINTS, downsample
+from .fetch import fetch_all, run_concurrently
+from .instrumentation import instrumented, span
+from .metrics import evaluate
+from .scorecards import scorecard_skill, station_scores
+from .series_cache import SERIES_CACHE_DIR, get_series_cache
+from .serialize import CRS84, station_geojson
+from .series_store import MODEL_IDS, align, read_models, read_observations
+from .site_index import get_site_index
+from .skill import NO_SKILL, SKILL_CLASSES, add_skill, skill_style_map
+from .stations import STATION_LAYERS, load_station_layer
+
+
+#name of the plottable station layers, suffixed with the skill class when the stations are scored
+STATIONS_LAYER = 'USGS Stations'
+
+#scored station cluster indexes per state and evaluation, shared by the state map and the cluster endpoint
+STATION_CLUSTERS = LRUCache(maxsize=32, ttl=3600)
+
+#trace colors of the comparison plot, the observations stay blue
+MODEL_COLORS = {
+    'NWM_v2.1': 'red',
+    'NWM_v3.0': 'orange',
+    'MLP': 'green',
+    'XGBoost': 'purple',
+    'CNN': 'brown',
+    'LSTM': 'magenta',
+}
+
+#metrics of the comparison table, name and decimals
+COMPARE_METRICS = [('kge', 'KGE', 2), ('nse', 'NSE', 2), ('rmse', 'RMSE (cfs)', 0), ('pbias', 'PBIAS (%)', 1),
+                   ('max_error', 'MaxError (cfs)', 0)]
+
+#code for the models to compare of a map request, repeated compare_ids parameters or a [a, b] list
+def compare_models(request):
+    if hasattr(request.GET, 'getlist'):
+        values = request.GET.getlist('compare_ids')
+    else:
+        values = [request.GET.get('compare_ids') or '']
+    models = [model.strip() for value in values for model in value.strip('][').split(',')]
+    return [model for model in dict.fromkeys(models) if model in MODEL_IDS]
 
 
 #code for combining json files
-def combine_jsons(file_list, BUCKET_NAME, s3):
-    all_data_df = gpd.GeoDataFrame()
-    for json_file in file_list:
-        obj = s3.Object(BUCKET_NAME, json_file)
-        stations_geojson = json.load(obj.get()['Body']) 
-        gdf = gpd.read_file(obj.get()['Body'], driver='GeoJSON')
-        all_data_df = pd.concat([all_data_df, gdf]).set_crs(crs= 'EPSG:4326')
+@instrumented('combine_jsons')
+def combine_jsons(file_list, storage):
+    #the state files are fetched concurrently
+    gdfs = fetch_all(lambda json_file: load_station_layer(json_file, storage), file_list)
+    if len(gdfs) == 0:
+        import geopandas as gpd
+        return gpd.GeoDataFrame()
 
-    return all_data_df
+    all_data_df = pd.concat(gdfs, ignore_index=True).set_crs(crs= 'EPSG:4326', allow_override=True)
 
-#code for reach json files
-def reach_json(reach_ids,BUCKET, BUCKET_NAME, S3):
-        csv_key = 'Streamstats/Streamstats.csv'
-        obj = BUCKET.Object(csv_key)
-        body = obj.get()['Body']
-        Streamstats = pd.read_csv(body)
-        Streamstats.pop('Unnamed: 0')
-        Streamstats.drop_duplicates(subset = 'NWIS_site_id', inplace = True)
-        Streamstats.reset_index(inplace = True, drop = True)
+    return all_data_df
 
-        #Convert to geodataframe
-        StreamStats = gpd.GeoDataFrame(Streamstats, geometry=gpd.points_from_xy(Streamstats.dec_long_va, Streamstats.dec_lat_va))
+#code for selecting station features out of combined state geojsons
+def select_stations(combined, site_ids):
+    #get site ids out of DF to make new geojson, drop any duplicates
+    finaldf = combined[combined['USGS_id'].isin(list(site_ids))]
+    finaldf = finaldf.drop_duplicates('USGS_id')
+    finaldf.reset_index(inplace = True, drop = True)
 
-        #the csv loses the 0 in front of USGS ids, fix
-        NWIS = list(Streamstats['NWIS_site_id'].astype(str))
-        Streamstats['NWIS_site_id'] = ["0"+str(i) if len(i) <8 else i for i in NWIS]  
+    return finaldf
 
-        #Get streamstats information for each USGS location
-        sites = pd.DataFrame()
+#code for reach json files
+@instrumented('reach_json')
+def reach_json(reach_ids, storage):
+        #Get streamstats information for each USGS location from the process-wide site index
+        sites = get_site_index(storage).lookup(reach_ids)
 
-        for site in reach_ids:
-            s = Streamstats[Streamstats['NWIS_site_id'] ==  str(site)]
-            sites = pd.concat([sites, s])
+        return site_stations(sites, storage)
 
+#code for the station features of site index rows, e.g. the sites of a spatial query
+def site_stations(sites, storage):
         stateids = list(set(list(sites['state_id'])))
 
         stationpaths = []
@@ -47,16 +88,380 @@ def reach_json(reach_ids,BUCKET, BUCKET_NAME, S3):
             stationpaths.append(stations_path)
 
         #combine stations
-        combined = combine_jsons(stationpaths, BUCKET_NAME, S3)
+        combined = combine_jsons(stationpaths, storage)
         
         #get site ids out of DF to make new geojson
-        finaldf = gpd.GeoDataFrame()
-        for site in reach_ids:
-            df = combined[combined['USGS_id'] == site]
-            finaldf = pd.concat([finaldf, df])
-
-        #reset index and drop any duplicates
-        finaldf.reset_index(inplace = True, drop = True)
-        finaldf.drop_duplicates('USGS_id', inplace = True)        
+        finaldf = select_stations(combined, sites.index)
 
         return finaldf
+
+#code for the disk-backed time series cache in the app workspace
+def series_cache(app_workspace):
+    if app_workspace is None:
+        return None
+    try:
+        max_mb = app.get_custom_setting('series_cache_mb')
+    except Exception:
+        max_mb = None
+    return get_series_cache(os.path.join(app_workspace.path, SERIES_CACHE_DIR), max_mb)
+
+#code for the point cap of the hydrograph traces
+def plot_max_points():
+    try:
+        max_points = app.get_custom_setting('plot_max_points')
+    except Exception:
+        max_points = None
+    return max(int(max_points), MIN_POINTS) if max_points else PLOT_MAX_POINTS
+
+#code for scoring the stations of a map request, the skill class sets the icon color
+@instrumented('score_layer')
+def score_layer(storage, gdf, app_workspace=None):
+        """
+        Add the skill of every station for the model and window stored in its startdate, enddate and model_id
+        properties. Standard windows are read from the precomputed scorecards, the remaining stations are
+        scored on the fly. The stations are returned unscored when the series cannot be read.
+        """
+        if len(gdf) == 0:
+            return gdf
+        model_id = gdf['model_id'].iloc[0]
+        startdate = gdf['startdate'].iloc[0]
+        enddate = gdf['enddate'].iloc[0]
+        try:
+            scores = station_scores(storage, gdf, model_id, startdate, enddate, cache=series_cache(app_workspace))
+        except Exception as e:
+            print(f'Unable to score stations: {e}')
+            return gdf
+        return add_skill(gdf, scores)
+
+#code for the scored stations of a state evaluation, indexed for clustering
+def station_clusters(storage, state_id, startdate, enddate, model_id, app_workspace=None):
+        """
+        Stations of a state with the evaluation properties and skill, built once per process and evaluation.
+
+        Args:
+            storage (Storage): storage backend holding the station layers and series.
+            state_id (str): two letter state id.
+            startdate (str): first date (YYYY-MM-DD) of the evaluation window.
+            enddate (str): last date (YYYY-MM-DD) of the evaluation window.
+            model_id (str): model to evaluate.
+            app_workspace (TethysWorkspace): workspace holding the series cache.
+
+        Returns:
+            StationClusters: index of the scored stations, its gdf holds the station features.
+        """
+        key = (state_id, startdate, enddate, model_id)
+        source = load_station_layer(f"GeoJSON/StreamStats_{state_id}_4326.geojson", storage)
+        entry = STATION_CLUSTERS.get(key)
+        #rebuilt when the station layer was reloaded
+        if entry is not None and entry[0] is source:
+            return entry[1]
+
+        gdf = source.copy()
+        gdf['startdate'] = startdate
+        gdf['enddate'] = enddate
+        gdf['model_id'] = model_id
+        clusters = StationClusters(score_layer(storage, gdf, app_workspace))
+        STATION_CLUSTERS.set(key, (source, clusters))
+        return clusters
+
+#code for the scored stations of a spatial query, e.g. the visible extent of a map
+@instrumented('extent_stations')
+def extent_stations(storage, sites, startdate=None, enddate=None, model_id=None, app_workspace=None):
+        """
+        Lean GeoJSON of the stations of site index rows, scored for a model and window when one is given.
+
+        Every feature is bound to the station layer of its skill class through its layer_name property, so the
+        features can be drawn in and plotted from the station layers of any evaluation page.
+
+        Args:
+            storage (Storage): storage backend holding the station layers and series.
+            sites (pd.DataFrame): site index rows, see StreamStatsIndex.within_bbox and within_radius.
+            startdate (str): first date (YYYY-MM-DD) of the evaluation window.
+            enddate (str): last date (YYYY-MM-DD) of the evaluation window.
+            model_id (str): model to evaluate, None for unscored stations.
+            app_workspace (TethysWorkspace): workspace holding the series cache.
+
+        Returns:
+            dict: GeoJSON FeatureCollection.
+        """
+        gdf = site_stations(sites, storage) if len(sites) > 0 else None
+        if gdf is None or len(gdf) == 0:
+            return {'type': 'FeatureCollection', 'crs': CRS84, 'features': []}
+
+        scored = model_id is not None
+        if scored:
+            gdf = gdf.copy()
+            gdf['startdate'] = startdate
+            gdf['enddate'] = enddate
+            gdf['model_id'] = model_id
+            gdf = score_layer(storage, gdf, app_workspace)
+            scored = 'skill_class' in gdf.columns
+
+        geojson = station_geojson(gdf)
+        labels = {name: label for name, label, lower, color in SKILL_CLASSES + [NO_SKILL]}
+        for feature in geojson['features']:
+            skill = feature['properties'].get('skill_class')
+            feature['properties']['layer_name'] = f'{STATIONS_LAYER} ({labels.get(skill, NO_SKILL[1])})' if scored else STATIONS_LAYER
+        return geojson
+
+#code for the station layers of the map, one layer per skill class once the stations are scored
+@instrumented('station_layers.serialize')
+def station_layers(layout, gdf, clusters=None, cluster_url=None, compare_models=None):
+        """
+        Build the USGS station layers of a MapLayout.
+
+        Stations scored with add_skill are split into one layer per skill class, each drawn in the class color,
+        unscored stations keep the single white station layer. With a cluster index the layers start with the
+        clusters of the whole state and station_clusters.js refreshes them from cluster_url as the map moves.
+
+        Args:
+            layout (MapLayout): the controller building the layers.
+            gdf (gpd.GeoDataFrame): station features, with a skill_class column when scored.
+            clusters (StationClusters): index of gdf, None embeds every station.
+            cluster_url (str): cluster endpoint with the evaluation parameters, required with clusters.
+            compare_models (list): model ids plotted next to the selected model when a station is clicked.
+
+        Returns:
+            list: MVLayers, all named 'USGS Stations ...' so they stay plottable.
+        """
+        if 'skill_class' not in gdf.columns:
+            groups = [(NO_SKILL, gdf)]
+        else:
+            groups = [(skill, gdf[gdf['skill_class'] == skill[0]]) for skill in SKILL_CLASSES + [NO_SKILL]]
+            groups = [(skill, subset) for skill, subset in groups if len(subset) > 0]
+
+        layers = []
+        for (name, label, lower, color), subset in groups:
+            scored = 'skill_class' in gdf.columns
+            layer_name = f'{STATIONS_LAYER} ({label})' if scored else STATIONS_LAYER
+            #lean features with the popup and plot properties only
+            if clusters is not None:
+                stations_geojson = clusters.query(clusters.fit_zoom(), group=name if scored else None)
+                stations_geojson['crs'] = CRS84
+            else:
+                stations_geojson = station_geojson(subset)
+
+            stations_layer = layout.build_geojson_layer(
+                geojson=stations_geojson,
+                layer_name=layer_name,
+                layer_title=f'USGS Station {label}' if scored else 'USGS Station',
+                layer_variable=f'stations_{name}' if scored else 'stations',
+                visible=True,
+                selectable=True,
+                plottable=True,
+            )
+            if scored:
+                stations_layer.layer_options['style_map'] = skill_style_map(color)
+            if clusters is not None:
+                params = {'layer_name': layer_name, 'skill': name} if scored else {'layer_name': layer_name}
+                stations_layer.data['cluster_url'] = f"{cluster_url}&{urlencode(params)}"
+            if compare_models:
+                stations_layer.data['compare_models'] = list(compare_models)
+            layers.append(stations_layer)
+
+        return layers
+
+#code for the hydrograph of a clicked station, shared by the State, HUC and Reach evaluation classes
+def station_plot(storage, feature_props, app_workspace=None, compare_models=None):
+        """
+        Retrieves plot data for a USGS station feature.
+        Args:
+            storage (Storage): storage backend holding the observed and modeled series.
+            feature_props (dict): The properties of the selected feature.
+            app_workspace (TethysWorkspace): workspace holding the disk cache shared by the worker processes.
+            compare_models (list): other model ids to plot with the selected model, see compare_plot.
+
+        Returns:
+            str, list<dict>, dict: plot title, data series, and layout options, respectively.
+        """
+        #clusters of the state map group several stations, they are split up by zooming in
+        if feature_props.get('cluster'):
+            return f"{feature_props.get('count')} stations, zoom in to plot a station", [], {}
+
+        # Get the feature ids, add start/end date, and model as features in geojson above to have here.
+        id = feature_props.get('id') #we could connect the hydrofabric in here for NWM v3.0
+        NHD_id = feature_props.get('NHD_id') 
+        state = feature_props.get('state')
+        startdate= feature_props.get('startdate')
+        enddate = feature_props.get('enddate')
+        model_id = feature_props.get('model_id')
+
+        layout = {
+            'yaxis': {
+                'title': 'Streamflow (cfs)'
+            },
+            'xaxis': {
+                'title': 'Date'
+            }
+        }  
+
+        #memory-mapped series cache shared by all workers
+        cache = series_cache(app_workspace)
+
+        #USGS observed and modeled flow are read concurrently, only the requested window is read from the columnar
+        #stores and all models of the reach are loaded and cached together
+        with span('station_plot.read'):
+            USGS_df, models_df = run_concurrently(
+                lambda: read_observations(storage, state, id, startdate, enddate, cache=cache),
+                lambda: read_models(storage, state, NHD_id, startdate=startdate, enddate=enddate, cache=cache),
+            )
+
+        #comparison mode, one trace per model from the same reads
+        if compare_models and model_id:
+            return compare_plot(id, [model_id] + list(compare_models), USGS_df, models_df, startdate, enddate, layout)
+
+        #modeled flow, starting with NWM
+        try:
+            #try to use model/date inputs for plotting
+            model_df = models_df[[model_id]]
+
+            #combine Dfs, select user input dates
+            DF = align(USGS_df, model_df, startdate, enddate)
+
+            #each trace is capped at plot_max_points, keeping the peaks and low flows of every bucket
+            obs_time, USGS_streamflow_cfs = downsample(DF, 'USGS_flow', plot_max_points())
+            mod_time, Mod_streamflow_cfs = downsample(DF, model_id, plot_max_points())
+
+            #calculate model skill on the full series, standard windows are read from the precomputed scorecards
+            with span('station_plot.metrics'):
+                skill = scorecard_skill(storage, state, id, model_id, startdate, enddate)
+                if skill is None:
+                    skill = evaluate(DF.USGS_flow.to_numpy(), DF[model_id].to_numpy())
+            rmse = round(skill['rmse'],0)
+            maxerror = round(skill['max_error'],0)
+            kge = round(skill['kge'],2)
+
+
+            data = [
+                {
+                    'name': 'USGS Observed',
+                    'mode': 'lines',
+                    'x': obs_time,
+                    'y': USGS_streamflow_cfs,
+                    'line': {
+                        'width': 2,
+                        'color': 'blue'
+                    }
+                },
+                { 
+                    'name': f"{model_id} Modeled",
+                    'mode': 'lines',
+                    'x': mod_time,
+                    'y': Mod_streamflow_cfs,
+                    'line': {
+                        'width': 2,
+                        'color': 'red'
+                    }
+                },
+            ]
+            
+
+            return f"{model_id} and Observed Streamflow at USGS site: {id} <br> RMSE: {rmse} cfs <br> KGE: {kge} <br> MaxError: {maxerror} cfs", data, layout
+        
+        except:
+            print("No user inputs, default configuration.")
+            model = 'NWM_v2.1'
+            model_df = models_df[[model]]
+
+            #combine Dfs
+            DF = align(USGS_df, model_df)
+            obs_time, USGS_streamflow_cfs = downsample(DF, 'USGS_flow', plot_max_points())
+            mod_time, Mod_streamflow_cfs = downsample(DF, model, plot_max_points())
+
+            #calculate model skill on the full series
+            skill = evaluate(DF.USGS_flow.to_numpy(), DF[model].to_numpy())
+            rmse = round(skill['rmse'],0)
+            maxerror = round(skill['max_error'],0)
+            kge = round(skill['kge'],2)
+
+            data = [
+                {
+                    'name': 'USGS Observed',
+                    'mode': 'lines',
+                    'x': obs_time,
+                    'y': USGS_streamflow_cfs,
+                    'line': {
+                        'width': 2,
+                        'color': 'blue'
+                    }
+                },
+                {
+                    'name': f"Default Configuration: NWM v2.1 Modeled",
+                    'mode': 'lines',
+                    'x': mod_time,
+                    'y': Mod_streamflow_cfs,
+                    'line': {
+                        'width': 2,
+                        'color': 'red'
+                    }
+                },
+            ]
+
+
+            return f'Default Configuration:{model} Observed Streamflow at USGS site: {id} <br> RMSE: {rmse} cfs <br> KGE: {kge} <br> MaxError: {maxerror} cfs', data, layout
+
+
+#code for the multi-model hydrograph of a clicked station
+def compare_plot(id, models, USGS_df, models_df, startdate, enddate, layout):
+        """
+        Hydrograph of several models at one station with a table comparing their skill.
+
+        The observed and modeled series are aligned once and every model is scored in one vectorized call.
+
+        Args:
+            id (str): USGS site id.
+            models (list): model ids, the selected model first. Models without data at the reach are skipped.
+            USGS_df (pd.DataFrame): observed flow indexed by Datetime.
+            models_df (pd.DataFrame): one column per model indexed by Datetime, see read_models.
+            startdate (str): first date (YYYY-MM-DD).
+            enddate (str): last date (YYYY-MM-DD).
+            layout (dict): plot layout options.
+
+        Returns:
+            str, list<dict>, dict: plot title with the metrics table, data series, and layout options.
+        """
+        models = [model for model in dict.fromkeys(models) if model in MODEL_IDS and model in models_df.columns]
+        if len(models) == 0:
+            return f"No modeled streamflow at USGS site: {id}", [], layout
+
+        DF = align(USGS_df, models_df[models], startdate, enddate)
+
+        #every model is scored against the same observations on the full series
+        with span('station_plot.metrics'):
+            obs = DF.USGS_flow.to_numpy()
+            skill = evaluate([obs] * len(models), DF[models].to_numpy().T)
+
+        obs_time, USGS_streamflow_cfs = downsample(DF, 'USGS_flow', plot_max_points())
+        data = [
+            {
+                'name': 'USGS Observed',
+                'mode': 'lines',
+                'x': obs_time,
+                'y': USGS_streamflow_cfs,
+                'line': {
+                    'width': 2,
+                    'color': 'blue'
+                }
+            },
+        ]
+        for model in models:
+            mod_time, Mod_streamflow_cfs = downsample(DF, model, plot_max_points())
+            data.append({
+                'name': f"{model} Modeled",
+                'mode': 'lines',
+                'x': mod_time,
+                'y': Mod_streamflow_cfs,
+                'line': {
+                    'width': 2,
+                    'color': MODEL_COLORS.get(model, 'gray')
+                }
+            })
+
+        header = ''.join(f'<th>{label}</th>' for _, label, _ in COMPARE_METRICS)
+        rows = ''
+        for i, model in enumerate(models):
+            cells = ''.join(f'<td>{round(float(skill[metric][i]), decimals)}</td>' for metric, _, decimals in COMPARE_METRICS)
+            rows += f'<tr><td>{model}</td>{cells}</tr>'
+        table = f'<table class="table table-sm"><tr><th>Model</th>{header}</tr>{rows}</table>'
+
+        return f"Model comparison at USGS site: {id} <br> {table}", data, layout